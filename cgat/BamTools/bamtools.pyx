@@ -12,7 +12,7 @@ from pysam.libcalignmentfile cimport *
 from pysam.libcalignedsegment cimport pysam_bam_get_cigar, \
     pysam_bam_get_qname, pysam_get_n_cigar
 from pysam.libcfaidx cimport *
-from libc.string cimport strchr
+from libc.string cimport strchr, strcmp
 from libc.stdint cimport int8_t
 from libc.stdio cimport puts, printf
 from libc.stdlib cimport abs
@@ -35,6 +35,7 @@ import sys
 cimport numpy
 
 import cgatcore.experiment as E
+import cgat.ColumnarOutput as ColumnarOutput
 
 def parse_region_string(s):
     """parse a genomic region string.
@@ -130,8 +131,11 @@ def bam2stats_count(AlignmentFile samfile,
                     outfile_details=None,
                     add_alignment_details=False,
                     outfile_readmap=None,
-                    detailed_count=None):
+                    detailed_count=None,
+                    details_columnar_file=None):
     '''
+    If *details_columnar_file* is given, per-read details are
+    written to it in a columnar format, see :mod:`ColumnarOutput`.
     '''
     cdef AlignedSegment read
     cdef bint _add_alignment_details = add_alignment_details
@@ -673,7 +677,7 @@ def bam2stats_count(AlignmentFile samfile,
         coverages = numpy.zeros(fastq_nreads, dtype=numpy.float)
         mask = numpy.ones(fastq_nreads, dtype=numpy.int)
 
-        if outfile_details:
+        if outfile_details or details_columnar_file:
             header = ["read_md5",
                       "read_length",
                       "alignments",
@@ -704,31 +708,47 @@ def bam2stats_count(AlignmentFile samfile,
                     "deletion_rate",
                     "error_rate"])
 
-            if outfile_details != sys.stdout:
+            if details_columnar_file:
+                # read_md5 is a hex digest, do not parse as a number
+                details_writer = ColumnarOutput.ColumnarWriter(
+                    details_columnar_file, header,
+                    dtypes=[str] + [None] * (len(header) - 1))
+            else:
+                details_writer = None
+
+            if outfile_details == sys.stdout:
+                outfile_text = None
+            else:
+                outfile_text = outfile_details
+
+            if outfile_text is not None or details_writer is not None:
                 # later: get access FILE * object
-                outfile_details.write("\t".join(header) + "\n")
+                if outfile_text is not None:
+                    outfile_text.write("\t".join(header) + "\n")
                 for qname, read_index in reads.items():
                     fastq_count = &fastq_counts[read_index]
                     # remove "\n" from base64 encoded md5
-                    outfile_details.write("%s\t%s" % (
-                        base64.encodestring(qname)[:-1].decode("ascii"),
-                        "\t".join( \
-                                   map(str,
-                                       (fastq_count.read_length,
-                                        fastq_count.alignments,
-                                        "{:5.2f}".format(fastq_count.mean_quality / 1000.0),
-                                        "{:5.2f}".format(fastq_count.median_quality / 1000.0),
-                                        fastq_count.is_unmapped,
-                                        fastq_count.mate_is_unmapped,
-                                        fastq_count.is_paired,
-                                        fastq_count.mapped_is_read1,
-                                        fastq_count.mapped_is_read2,
-                                        fastq_count.is_proper_pair,
-                                        fastq_count.is_secondary,
-                                        fastq_count.is_qcfail,
-                                        fastq_count.is_duplicate,
-                                        fastq_count.is_supplementary
-                                    ) )) ))
+                    read_md5 = base64.encodebytes(qname)[:-1].decode("ascii")
+                    values = [fastq_count.read_length,
+                              fastq_count.alignments,
+                              fastq_count.mean_quality / 1000.0,
+                              fastq_count.median_quality / 1000.0,
+                              fastq_count.is_unmapped,
+                              fastq_count.mate_is_unmapped,
+                              fastq_count.is_paired,
+                              fastq_count.mapped_is_read1,
+                              fastq_count.mapped_is_read2,
+                              fastq_count.is_proper_pair,
+                              fastq_count.is_secondary,
+                              fastq_count.is_qcfail,
+                              fastq_count.is_duplicate,
+                              fastq_count.is_supplementary]
+                    if outfile_text is not None:
+                        outfile_text.write("%s\t%s" % (
+                            read_md5,
+                            "\t".join(
+                                ["{:5.2f}".format(x) if isinstance(x, float) else str(x)
+                                 for x in values])))
                     if _add_alignment_details:
                         if fastq_count.is_unmapped > 0:
                             substitution_rate = 0
@@ -771,18 +791,32 @@ def bam2stats_count(AlignmentFile samfile,
                             error_rates[read_index] = error_rate
                             coverages[read_index] = coverage
 
-                        outfile_details.write(
-                            "\t" +
-                            "\t".join(map(str, alignment_details[read_index, :])) +
-                            "\t{:6.4f}".format(coverage) +
-                            "\t{:6.4f}".format(substitution_rate) +
-                            "\t{:6.4f}".format(insertion_rate) +
-                            "\t{:6.4f}".format(deletion_rate) +
-                            "\t{:6.4f}".format(error_rate) +
-                            "\n")
-                    else:
-                        outfile_details.write("\n")
-            else:
+                        if outfile_text is not None:
+                            outfile_text.write(
+                                "\t" +
+                                "\t".join(map(str, alignment_details[read_index, :])) +
+                                "\t{:6.4f}".format(coverage) +
+                                "\t{:6.4f}".format(substitution_rate) +
+                                "\t{:6.4f}".format(insertion_rate) +
+                                "\t{:6.4f}".format(deletion_rate) +
+                                "\t{:6.4f}".format(error_rate) +
+                                "\n")
+                        values.extend(alignment_details[read_index, :])
+                        values.extend((coverage,
+                                       substitution_rate,
+                                       insertion_rate,
+                                       deletion_rate,
+                                       error_rate))
+                    elif outfile_text is not None:
+                        outfile_text.write("\n")
+
+                    if details_writer is not None:
+                        details_writer.append([read_md5] + values)
+
+                if details_writer is not None:
+                    details_writer.close()
+
+            if outfile_details == sys.stdout:
                 # TODO: this code is incomplete.
                 # output to stdout much quicker
                 # use puts to avoid the following error:
@@ -2406,3 +2440,232 @@ def bams2bam_filter(AlignmentFile genome_samfile,
     E.info( "filtering finished" )
 
     return c
+
+
+cdef struct Location:
+    int32_t file_idx
+    int32_t tid
+    int64_t start
+    int64_t end
+    int32_t code
+
+
+cdef inline bint location_less(Location * a, Location * b):
+    if a.tid != b.tid:
+        return a.tid < b.tid
+    if a.start != b.start:
+        return a.start < b.start
+    return a.file_idx < b.file_idx
+
+
+cdef void sort_locations(Location * locations, int n):
+    '''insertion sort of *locations* by contig and position.
+
+    The number of alignments per read is usually small.
+    '''
+    cdef int x, y
+    cdef Location tmp
+    for x from 1 <= x < n:
+        tmp = locations[x]
+        y = x - 1
+        while y >= 0 and location_less(&tmp, &locations[y]):
+            locations[y + 1] = locations[y]
+            y -= 1
+        locations[y + 1] = tmp
+
+
+cdef int32_t cluster_locations(Location * locations, int n,
+                               int64_t max_distance):
+    '''assign a location code to each alignment in sorted *locations*.
+
+    An alignment starts a new location if it is on a different
+    contig or starts after the end of the alignments in the current
+    location. If *max_distance* is not negative, a new location
+    starts if the alignment is more than *max_distance* bases
+    downstream of the previous one instead.
+
+    returns the number of locations.
+    '''
+    cdef int x
+    cdef int32_t code = -1
+    cdef int32_t last_tid = -1
+    cdef int64_t last_start = 0, last_end = 0
+    for x from 0 <= x < n:
+        if max_distance >= 0:
+            if locations[x].tid != last_tid or \
+               locations[x].start - last_start > max_distance:
+                code += 1
+        else:
+            if locations[x].tid != last_tid or \
+               locations[x].start >= last_end:
+                code += 1
+                last_end = locations[x].end
+            elif locations[x].end > last_end:
+                last_end = locations[x].end
+        locations[x].code = code
+        last_tid = locations[x].tid
+        last_start = locations[x].start
+    return code + 1
+
+
+cdef int read_alignment(htsFile * hts, bam_hdr_t * header, bam1_t * b,
+                        filename) except -2:
+    '''read the next alignment from *hts* into *b*.
+
+    returns 1 if an alignment has been read and 0 at the end of the
+    file. Raises IOError if the file could not be read.
+    '''
+    cdef int retval = sam_read1(hts, header, b)
+    if retval >= 0:
+        return 1
+    elif retval == -1:
+        return 0
+    raise IOError("error {} while reading alignments from {}".format(
+        retval, filename))
+
+
+def bams2diff(infiles, outfile, max_distance=None):
+    '''compare alignments of reads in multiple BAM files.
+
+    *infiles* is a list of :class:`pysam.AlignmentFile` objects
+    sorted by read name. Reads are merged across files by name and
+    the alignments of a read are clustered into locations. For
+    each read, a line with the number of locations, the number of
+    files in which the read is mapped, the number of alignments
+    per file and the location codes per file is written to *outfile*.
+
+    Locations are defined by overlapping alignment spans. If
+    *max_distance* is given, alignments within *max_distance*
+    bases of each other are grouped into the same location.
+
+    returns a tuple of a counter and a concordance matrix. The
+    concordance matrix contains for each pair of files the number
+    of reads that are mapped to the same locations in both files.
+    The diagonal contains the number of reads mapped in a file.
+    '''
+    cdef int nfiles = len(infiles)
+    cdef int x, y, n
+    cdef int nlocations, nmatched
+    cdef int capacity = 64
+    cdef int64_t c_max_distance = -1
+    cdef AlignmentFile infile
+    cdef Location * locations = <Location *>malloc(
+        capacity * sizeof(Location))
+    cdef bam1_t ** reads = <bam1_t **>calloc(nfiles, sizeof(bam1_t *))
+    cdef int * has_read = <int *>calloc(nfiles, sizeof(int))
+    cdef int * nh = <int *>calloc(nfiles, sizeof(int))
+    cdef htsFile ** htsfiles = <htsFile **>calloc(nfiles, sizeof(htsFile *))
+    cdef bam_hdr_t ** headers = <bam_hdr_t **>calloc(
+        nfiles, sizeof(bam_hdr_t *))
+    cdef bam1_t * b
+    cdef char * target
+    cdef bytes target_name
+    cdef Location * location
+    cdef Location * new_locations
+
+    if max_distance is not None:
+        c_max_distance = max_distance
+
+    concordance = numpy.zeros((nfiles, nfiles), dtype=numpy.int64)
+    cdef int64_t[:, :] concordance_view = concordance
+
+    c = E.Counter()
+
+    filenames = [infile.filename for infile in infiles]
+
+    try:
+        if locations == NULL or reads == NULL or has_read == NULL or \
+           nh == NULL or htsfiles == NULL or headers == NULL:
+            raise MemoryError("could not allocate buffers for {} files".format(
+                nfiles))
+
+        for x, infile in enumerate(infiles):
+            htsfiles[x] = infile.htsfile
+            headers[x] = infile.header.ptr
+            reads[x] = bam_init1()
+            if reads[x] == NULL:
+                raise MemoryError("could not allocate alignment")
+            has_read[x] = read_alignment(
+                htsfiles[x], headers[x], reads[x], filenames[x])
+
+        while True:
+            # find the smallest read name
+            target = NULL
+            for x from 0 <= x < nfiles:
+                if has_read[x]:
+                    if target == NULL or \
+                       strcmp(pysam_bam_get_qname(reads[x]), target) < 0:
+                        target = pysam_bam_get_qname(reads[x])
+            if target == NULL:
+                break
+            target_name = target
+            target = target_name
+            c.input += 1
+
+            # collect alignments of read in all files
+            n = 0
+            for x from 0 <= x < nfiles:
+                nh[x] = 0
+                while has_read[x] and \
+                        strcmp(pysam_bam_get_qname(reads[x]), target) == 0:
+                    b = reads[x]
+                    if not b.core.flag & BAM_FUNMAP:
+                        if n == capacity:
+                            capacity *= 2
+                            new_locations = <Location *>realloc(
+                                locations, capacity * sizeof(Location))
+                            if new_locations == NULL:
+                                raise MemoryError(
+                                    "could not allocate {} locations".format(
+                                        capacity))
+                            locations = new_locations
+                        location = &locations[n]
+                        location.file_idx = x
+                        location.tid = b.core.tid
+                        location.start = b.core.pos
+                        location.end = bam_endpos(b)
+                        n += 1
+                        nh[x] += 1
+                    has_read[x] = read_alignment(
+                        htsfiles[x], headers[x], b, filenames[x])
+
+            sort_locations(locations, n)
+            nlocations = cluster_locations(locations, n, c_max_distance)
+
+            # location codes per file, sorted as locations are sorted
+            codes = [[] for x in range(nfiles)]
+            for y from 0 <= y < n:
+                codes[locations[y].file_idx].append(locations[y].code)
+
+            nmatched = 0
+            for x from 0 <= x < nfiles:
+                if nh[x] == 0:
+                    continue
+                nmatched += 1
+                for y from 0 <= y <= x:
+                    if nh[y] > 0 and codes[x] == codes[y]:
+                        concordance_view[x, y] += 1
+
+            outfile.write("%s\t%i\t%i\t%s\t%s\n" % (
+                target_name.decode(),
+                nlocations,
+                nmatched,
+                "\t".join(["%i" % nh[x] for x in range(nfiles)]),
+                "\t".join([",".join(map(str, file_codes))
+                           for file_codes in codes])))
+            c.output += 1
+    finally:
+        if reads != NULL:
+            for x from 0 <= x < nfiles:
+                if reads[x] != NULL:
+                    bam_destroy1(reads[x])
+        free(reads)
+        free(has_read)
+        free(nh)
+        free(htsfiles)
+        free(headers)
+        free(locations)
+
+    # make concordance matrix symmetric
+    concordance = numpy.tril(concordance) + numpy.tril(concordance, -1).T
+    return c, concordance
@@ -1,6 +1,7 @@
 #cimport csamtools
 
 from pysam.libcalignmentfile cimport *
+from libc.stdint cimport int64_t
 import collections
 import cgatcore.experiment as E
 import numpy
@@ -18,6 +19,38 @@ PeakShapeCounts = collections.namedtuple(
     "PeakShapeCounts",
     "nreads median counts" )
 
+# namedtuple can not determine the module within cython, set
+# it explicitly so that results can be pickled
+PeakShapeResult.__module__ = __name__
+PeakShapeCounts.__module__ = __name__
+
+def binCounts(counts, bins, int offset):
+    '''sum *counts* in *bins* shifted by *offset*.
+
+    Only complete bins are counted, bins that extend
+    beyond *counts* are set to 0.
+
+    return a numpy array of length len(bins) - 1.
+    '''
+    edges = numpy.asarray(bins, dtype=numpy.int64) + offset
+    hist = numpy.zeros(len(edges) - 1, dtype=numpy.int64)
+    valid = numpy.flatnonzero(
+        (edges[:-1] >= 0) & (edges[1:] < len(counts)))
+    if len(valid) == 0:
+        return hist
+
+    # valid bins are contiguous as bins are sorted
+    first, last = valid[0], valid[-1]
+    starts = edges[first:last + 1]
+    # reduceat returns the element at an index for zero-width bins
+    # instead of 0, so sum over bins with a width only
+    nonempty = starts < edges[first + 1:last + 2]
+    if nonempty.any():
+        hist[first:last + 1][nonempty] = numpy.add.reduceat(
+            counts[:edges[last + 1]], starts[nonempty])
+    return hist
+
+
 cdef class Counter:
     '''base class for counters computing densities 
     from genomic data.
@@ -50,21 +83,10 @@ cdef class Counter:
                                                  pos + bins[-1],
                                                  **kwargs )
 
-        nbins = len(bins) - 1
-        hist = numpy.zeros(nbins, dtype=numpy.int)
-        cdef int lcounts = len(counts)
-
         if self.smooth_method is not None:
             smoothed_counts = self.smooth_method(counts)
 
-        offset = -bins[0]
-        xstart = offset + bins[0] 
-        for i from 0 <= i < nbins:
-            xend = offset + bins[i+1]
-            # only take complete bins
-            if xstart >= 0 and xend < lcounts:
-                hist[i] = sum(counts[xstart:xend]) 
-            xstart = xend
+        hist = binCounts(counts, bins, -bins[0])
 
         result = PeakShapeCounts._make((nreads, 
                                         numpy.median(counts),
@@ -195,8 +217,6 @@ cdef class Counter:
 
         #################################################
         # compute histogram
-        nbins = len(bins) - 1
-        hist = numpy.zeros(nbins, dtype = numpy.int)
 
         # decide in which region to count - interval or window
         if use_interval:
@@ -209,16 +229,8 @@ cdef class Counter:
             # counts_in_window
             offset = peak_center + offset_left
 
-        cdef int lcounts = len(counts)
-
         # count averages
-        xstart = offset + bins[0] 
-        for i from 0 <= i < nbins:
-            xend = offset + bins[i+1]
-            # only take complete bins
-            if xstart >= 0 and xend < lcounts:
-                hist[i] = sum(counts[xstart:xend]) 
-            xstart = xend
+        hist = binCounts(counts, bins, offset)
 
         result = PeakShapeResult._make((interval_width, npeaks,
                                         start + peak_center, 
@@ -235,15 +247,130 @@ cdef class Counter:
 
 
 cdef class CounterBam(Counter):
-    '''compute densities in intervals from bam files.'''
+    '''compute densities in intervals from bam files.
+
+    If *block_size* is larger than 0, reads are fetched in blocks
+    of at least *block_size* bases and cached so that neighbouring
+    intervals share a single fetch. This is efficient if intervals
+    are sorted by position.
+    '''
 
     cdef int shift
+    cdef int block_size
+    cdef dict contig2tid
+    cdef dict blocks
 
-    def __init__(self, shift = 0, *args, **kwargs):
+    def __init__(self, shift = 0, block_size = 0, *args, **kwargs):
 
         Counter.__init__(self, *args, **kwargs)
 
         self.shift = shift
+        self.block_size = block_size
+        self.contig2tid = {}
+        self.blocks = {}
+
+    def getTid(self, AlignmentFile samfile, contig):
+        '''return tid of *contig* in *samfile* or -1 if not present.'''
+        try:
+            mapping = self.contig2tid[samfile]
+        except KeyError:
+            mapping = self.contig2tid[samfile] = dict(
+                (x, i) for i, x in enumerate(samfile.references))
+        return mapping.get(contig, -1)
+
+    def fetchBlock(self,
+                   AlignmentFile samfile,
+                   contig,
+                   int start,
+                   int end):
+        '''return cached reads covering *start* to *end* on *contig*.
+
+        The cache holds a single block per file. If the block does
+        not contain the region, a new block starting at *start* is
+        fetched.
+
+        returns a tuple of numpy arrays with the fetch start, fetch end,
+        alignment end and strand of each read. Alignment ends are -1
+        for reads without a CIGAR string.
+        '''
+        block = self.blocks.get(samfile, None)
+        if block is not None and block[0] == contig and \
+           block[1] <= start and end <= block[2]:
+            return block[3]
+
+        cdef int block_end = max(end, start + self.block_size)
+        cdef int nreads = 0
+        cdef AlignedSegment read
+        starts, ends, aends, reverse = [], [], [], []
+        for read in samfile.fetch(contig, start, block_end):
+            starts.append(read.pos)
+            aend = read.aend
+            if aend is None:
+                aends.append(-1)
+                ends.append(read.pos + 1)
+            else:
+                aends.append(aend)
+                ends.append(aend)
+            reverse.append(read.is_reverse)
+
+        reads = (numpy.array(starts, dtype=numpy.int64),
+                 numpy.array(ends, dtype=numpy.int64),
+                 numpy.array(aends, dtype=numpy.int64),
+                 numpy.array(reverse, dtype=numpy.bool_))
+        self.blocks[samfile] = (contig, start, block_end, reads)
+        return reads
+
+    def coverageInBlock(self,
+                        AlignmentFile samfile,
+                        contig,
+                        int start,
+                        int end):
+        '''return coverage in window on *contig* bounded by *start*
+        and *end* using cached blocks of reads.
+
+        See :meth:`coverageInInterval`.
+        '''
+        cdef int offset = self.shift // 2
+        cdef int interval_width = end - start
+
+        if self.shift:
+            starts, ends, aends, reverse = self.fetchBlock(
+                samfile, contig,
+                max(0, start - offset), end + offset)
+
+            # forward strand reads, extend from upstream position
+            xstart, xend = max(0, start - offset), max(0, end - offset)
+            selected = ~reverse & (starts < xend) & (ends > xstart)
+            nreads = numpy.count_nonzero(selected)
+            rstarts = numpy.maximum(0, starts[selected] - xstart)
+            rends = numpy.minimum(interval_width,
+                                  starts[selected] + 2 * offset - xstart)
+
+            # reverse strand reads, extend from downstream position
+            xstart, xend = start + offset, end + offset
+            selected = reverse & (starts < xend) & (ends > xstart)
+            nreads += numpy.count_nonzero(selected)
+            selected &= aends >= 0
+            rstarts = numpy.concatenate((
+                rstarts,
+                numpy.maximum(0, aends[selected] - 2 * offset - xstart)))
+            rends = numpy.concatenate((
+                rends,
+                numpy.minimum(interval_width, aends[selected] - xstart)))
+        else:
+            starts, ends, aends, reverse = self.fetchBlock(
+                samfile, contig, start, end)
+            selected = (starts < end) & (ends > start)
+            nreads = numpy.count_nonzero(selected)
+            selected &= aends >= 0
+            rstarts = numpy.maximum(0, starts[selected] - start)
+            rends = numpy.minimum(interval_width, aends[selected] - start)
+
+        # accumulate coverage in a difference array
+        take = rstarts < rends
+        diff = numpy.bincount(rstarts[take], minlength=interval_width + 1)
+        diff -= numpy.bincount(rends[take], minlength=interval_width + 1)
+        return nreads, numpy.cumsum(diff[:interval_width])
 
     #################################################
     # bigwig versions
@@ -275,17 +402,25 @@ cdef class CounterBam(Counter):
         # note: does this work with paired-end data?
         cdef int offset = shift // 2
         cdef int nreads = 0
+        cdef int rstart, rend, xstart, xend
 
         # collect pileup profile in region bounded by maxwindow_start and maxwindow_end.
         cdef int interval_width = end - start
-        cdef int * ccounts = <int*>calloc( interval_width, sizeof(int))
 
         if interval_width <= 0: 
             return 0, numpy.zeros(0)
             
-        if contig not in samfile.references:
+        if self.getTid(samfile, contig) < 0:
             return 0, numpy.zeros(0)
 
+        if self.block_size > 0:
+            return self.coverageInBlock(samfile, contig, start, end)
+
+        # reads are added to a difference array, which is
+        # converted to coverage by a cumulative sum
+        diff = numpy.zeros(interval_width + 1, dtype=numpy.int64)
+        cdef int64_t[:] cdiff = diff
+
         if shift:
             xstart, xend = max(0, start - offset), max(0, end - offset)
 
@@ -298,7 +433,9 @@ cdef class CounterBam(Counter):
                 # truncate to interval
                 rstart = max( 0, rstart - xstart )
                 rend = min( interval_width, rend - xstart )
-                for i from rstart <= i < rend: ccounts[i] += 1
+                if rstart < rend:
+                    cdiff[rstart] += 1
+                    cdiff[rend] -= 1
 
             # on the - strand, shift tags downstream
             xstart, xend = start + offset, end + offset
@@ -306,43 +443,39 @@ cdef class CounterBam(Counter):
             for read in samfile.fetch( contig, xstart, xend ):
                 if not read.is_reverse: continue
                 nreads += 1
-                rend = read.aend
-                # shift and extend reads from downstream pos
-                try:
-                    rstart = rend - 2 * offset
-                except TypeError:
-                    # read.aend can be None if CIGAR string is missing
-                    # read is unmapped but has still a coordinate
-                    # assigned.
+                aend = read.aend
+                # read.aend can be None if CIGAR string is missing
+                # read is unmapped but has still a coordinate
+                # assigned.
+                if aend is None:
                     continue
+                rend = aend
+                # shift and extend reads from downstream pos
+                rstart = rend - 2 * offset
                 # truncate to interval
                 rstart = max( 0, rstart - xstart )
                 rend = min( interval_width, rend - xstart )
-
-                for i from rstart <= i < rend: ccounts[i] += 1
+                if rstart < rend:
+                    cdiff[rstart] += 1
+                    cdiff[rend] -= 1
 
         else:
             for read in samfile.fetch(contig, start, end):
                 nreads += 1
+                aend = read.aend
+                # aend can be None if CIGAR string is missing
+                # read is unmapped but has still a coordinate
+                # assigned.
+                if aend is None:
+                    continue
                 # truncate to interval
                 rstart = max(0, read.pos - start)
-                try:
-                    rend = min(interval_width, read.aend - start)
-                except TypeError:
-                    # aend can be None if CIGAR string is missing
-                    # read is unmapped but has still a coordinate
-                    # assigned.
-                    continue
-
-                for i from rstart <= i < rend: ccounts[i] += 1
-
-        # transfer to numpy count object
-        counts = numpy.zeros( interval_width, dtype = numpy.int )
-        for i from 0 <= i < interval_width: counts[i] = ccounts[i]
-
-        free( ccounts )
+                rend = min(interval_width, aend - start)
+                if rstart < rend:
+                    cdiff[rstart] += 1
+                    cdiff[rend] -= 1
 
-        return nreads, counts
+        return nreads, numpy.cumsum(diff[:interval_width])
 
 cdef class CounterBigwig(Counter):
     '''compute densities in intervals from bigwig files.'''
@@ -37,6 +37,26 @@ Headers = [
     "blockSizes", "blockStarts"]
 
 
+def _field_property(position):
+    '''return a property accessing the optional column at
+    *position* of a :class:`Bed` record.'''
+
+    def fget(self):
+        try:
+            return self.fields[position]
+        except IndexError:
+            return None
+
+    def fset(self, value):
+        fields = self.fields
+        if position >= len(fields):
+            fields.extend([self.default_value] *
+                          (position - len(fields) + 1))
+        fields[position] = value
+
+    return property(fget, fset)
+
+
 class Bed(object):
     """an interval in bed format.
 
@@ -49,8 +69,12 @@ class Bed(object):
        print b["contig"]
 
     Bed-formatted records can have a variable number of columuns
-    with a minimum of 3. Accessing an optional attribute that is not present
-    will raise an IndexError.
+    with a minimum of 3. Accessing an optional attribute that is not
+    present will return None.
+
+    Records use ``__slots__`` and optional columns are accessed
+    through properties. Setting an optional attribute will set
+    the column, adding empty columns if necessary.
 
     Attributes
     ----------
@@ -89,12 +113,27 @@ class Bed(object):
 
     default_value = "."
 
-    def __init__(self):
-        self.contig = None
-        self.start = 0
-        self.end = 0
-        self.fields = []
-        self.track = None
+    __slots__ = ("contig", "start", "end", "fields", "track", "__dict__")
+
+    name = _field_property(map_key2field["name"])
+    score = _field_property(map_key2field["score"])
+    strand = _field_property(map_key2field["strand"])
+    thickStart = _field_property(map_key2field["thickStart"])
+    thickEnd = _field_property(map_key2field["thickEnd"])
+    itemRGB = _field_property(map_key2field["itemRGB"])
+    blockCount = _field_property(map_key2field["blockCount"])
+    blockSizes = _field_property(map_key2field["blockSizes"])
+    blockStarts = _field_property(map_key2field["blockStarts"])
+
+    def __init__(self, contig=None, start=0, end=0, fields=None, track=None):
+        self.contig = contig
+        self.start = start
+        self.end = end
+        if fields is None:
+            self.fields = []
+        else:
+            self.fields = fields
+        self.track = track
 
     def __str__(self):
         return "\t".join((self.contig, str(self.start),
@@ -103,8 +142,9 @@ class Bed(object):
     def copy(self):
         '''Returns a new bed object that is a copy of this one'''
 
-        new_entry = Bed()
-        new_entry.__dict__ = self.__dict__.copy()
+        new_entry = Bed(self.contig, self.start, self.end,
+                        list(self.fields), self.track)
+        new_entry.__dict__.update(self.__dict__)
         return new_entry
 
     def fromGTF(self, gff, is_gtf=False, name=None):
@@ -236,12 +276,6 @@ class Bed(object):
 
             self.fields[position] = value
 
-    def __getattr__(self, key):
-        try:
-            return self.fields[self.map_key2field[key]]
-        except IndexError:
-            return None
-
     @property
     def columns(self):
         '''return number of columns in bed-entry.'''
@@ -303,16 +337,13 @@ def iterator(infile):
         if line.strip() == "":
             continue
 
-        b = Bed()
         # split at tab (Bed standard, do not split at space as this will split
         # the name field)
         data = line[:-1].split("\t")
         try:
-            b.contig, b.start, b.end = data[0], int(data[1]), int(data[2])
+            b = Bed(data[0], int(data[1]), int(data[2]), data[3:], track)
         except IndexError:
             raise ValueError("parsing error in line '%s'" % line[:-1])
-        b.fields = data[3:]
-        b.track = track
         yield b
 
 
@@ -321,6 +352,92 @@ def bed_iterator(infile):
     return iterator(infile)
 
 
+def read_arrays(infile, with_names=False, block_size=100000):
+    """read intervals in a :term:`bed` formatted file into arrays.
+
+    Comments, track lines and empty lines are ignored. Lines are
+    processed in blocks of *block_size* lines without creating
+    :class:`Bed` objects.
+
+    Arguments
+    ---------
+    infile : File
+    with_names : bool
+       If True, return the names of intervals.
+    block_size : int
+       Number of lines to process at a time.
+
+    Returns
+    -------
+    contigs : list
+       Contig names in order of first occurrence.
+    codes : numpy.array
+       For each interval, the index of its contig in `contigs`.
+    starts : numpy.array
+       Start coordinates.
+    ends : numpy.array
+       End coordinates.
+    names : numpy.array
+       Array of names. Intervals without a name are set to None.
+       None if `with_names` is False.
+    """
+
+    rx = re.compile("^([^\t\r\n]*)\t([^\t\r\n]*)\t([^\t\r\n]*)"
+                    "(?:\t([^\t\r\n]*))?", re.M)
+
+    contig2code = {}
+    codes, starts, ends, names = [], [], [], []
+
+    while 1:
+        lines = list(itertools.islice(infile, block_size))
+        if not lines:
+            break
+
+        lines = [line for line in lines
+                 if not line.startswith(("track", "#")) and line.strip()]
+        if not lines:
+            continue
+
+        # parse columns of all lines in block at once
+        data = rx.findall("".join(lines))
+        if len(data) != len(lines):
+            for line in lines:
+                if not rx.match(line):
+                    raise ValueError("parsing error in line '%s'" %
+                                     line[:-1])
+
+        codes.append(numpy.fromiter(
+            (contig2code.setdefault(x[0], len(contig2code)) for x in data),
+            dtype=numpy.int32, count=len(data)))
+        starts.append(numpy.fromiter(
+            (int(x[1]) for x in data), dtype=numpy.int64, count=len(data)))
+        ends.append(numpy.fromiter(
+            (int(x[2]) for x in data), dtype=numpy.int64, count=len(data)))
+        if with_names:
+            names.append(numpy.array(
+                [x[3] if x[3] else None for x in data], dtype=object))
+
+    contigs = sorted(contig2code, key=contig2code.get)
+
+    if codes:
+        codes = numpy.concatenate(codes)
+        starts = numpy.concatenate(starts)
+        ends = numpy.concatenate(ends)
+    else:
+        codes = numpy.zeros(0, dtype=numpy.int32)
+        starts = numpy.zeros(0, dtype=numpy.int64)
+        ends = numpy.zeros(0, dtype=numpy.int64)
+
+    if not with_names:
+        names = None
+    elif names:
+        names = numpy.concatenate(names)
+    else:
+        names = numpy.zeros(0, dtype=object)
+
+    return contigs, codes, starts, ends, names
+
+
 def setName(iterator):
     """yield bed entries in which name is set to the record number if
     unset.
@@ -0,0 +1,334 @@
+'''ColumnarOutput.py - write tables in columnar formats
+=====================================================
+
+This module provides :class:`ColumnarWriter`, which collects the rows
+of a table in column buffers and writes them in batches to a columnar
+file. Tables written in these formats can be loaded much faster than
+tab-separated tables.
+
+The following formats are supported:
+
+npz
+   numpy :file:`.npz` archive with one array per column. As the
+   format can not be appended to, batches are kept as typed arrays
+   and the archive is written when the writer is closed.
+
+feather
+   Arrow IPC (feather version 2) file. Each batch is written as a
+   record batch. Requires pyarrow.
+
+parquet
+   Parquet file. Each batch is written as a row group. Requires
+   pyarrow.
+
+The type of each column is inferred from the first batch unless
+given explicitly. As inference parses strings such as ``001`` or
+``1e5`` as numbers, callers should declare the type of identifier
+and other key columns as ``str``. Columns are stored as 64-bit
+integers, 64-bit floats or strings. Missing values such as ``na`` are stored as NaN
+in float columns. If a later batch does not fit the inferred type,
+the column is promoted from integer to float or from a number to
+string and the batches written so far are converted. Batches that
+do not fit an explicitly given type raise a ValueError.
+
+Tables can be loaded with pandas::
+
+   pandas.read_parquet("table.parquet")
+   pandas.read_feather("table.feather")
+   pandas.DataFrame(dict(numpy.load("table.npz")))
+
+Reference
+---------
+
+'''
+
+import os
+import zipfile
+import numpy
+import numpy.lib.format
+
+FORMATS = ("npz", "feather", "parquet")
+
+# values that are treated as missing in numeric columns
+MISSING_VALUES = ("", "na", "NA", "nan", "NaN", "None")
+
+
+def convert_column(values, dtype=None):
+    '''convert a sequence of *values* to a numpy array.
+
+    If *dtype* is not given, the type is inferred. Integer values
+    are converted to int64 and other numbers to float64. Strings
+    are parsed as integers or floats if possible and kept as
+    strings otherwise.
+
+    Raises ValueError if *values* can not be converted to *dtype*.
+    '''
+    array = numpy.asarray(values)
+    if array.dtype.kind == "O":
+        array = array.astype(str)
+
+    if dtype is not None:
+        dtype = numpy.dtype(dtype)
+        if dtype.kind == "U":
+            return array.astype(str)
+        if array.dtype.kind == "U" and dtype.kind == "f":
+            array = numpy.where(numpy.isin(array, MISSING_VALUES),
+                                "nan", array)
+        if array.dtype.kind == "f" and dtype.kind in "iu":
+            raise ValueError("can not store floats in an integer column")
+        return array.astype(dtype)
+
+    if array.dtype.kind in "biu":
+        return array.astype(numpy.int64)
+    elif array.dtype.kind == "f":
+        return array.astype(numpy.float64)
+
+    for dtype in (numpy.int64, numpy.float64):
+        try:
+            return convert_column(array, dtype)
+        except (ValueError, OverflowError):
+            pass
+    return array
+
+
+def promote_dtype(dtype1, dtype2):
+    '''return the type that can hold values of both *dtype1* and
+    *dtype2*.
+
+    Integers are promoted to float64 and numbers to strings.
+    '''
+    kinds = (numpy.dtype(dtype1).kind, numpy.dtype(dtype2).kind)
+    if "U" in kinds:
+        return numpy.dtype(str)
+    elif "f" in kinds:
+        return numpy.dtype(numpy.float64)
+    else:
+        return numpy.dtype(numpy.int64)
+
+
+def get_format(filename):
+    '''return the columnar format for *filename* from its extension.'''
+    ext = os.path.splitext(filename)[1][1:]
+    if ext not in FORMATS:
+        raise ValueError(
+            "can not determine columnar format from filename {}, "
+            "expected one of {}".format(filename, FORMATS))
+    return ext
+
+
+class ColumnarWriter(object):
+    '''write a table with *columns* to *filename* in a columnar
+    format.
+
+    Rows are added with :meth:`append` and collected in one buffer
+    per column. Every *batch_size* rows, the buffers are converted
+    to typed arrays and written. If *format* is not given, it is
+    determined from the filename extension.
+
+    *dtypes* is an optional list with a numpy type for each
+    column. Types that are None are inferred from the first batch
+    and promoted as required by later batches.
+    '''
+
+    def __init__(self, filename, columns, format=None, batch_size=100000,
+                 dtypes=None):
+
+        if format is None:
+            format = get_format(filename)
+        if format not in FORMATS:
+            raise ValueError("unknown columnar format {}, expected "
+                             "one of {}".format(format, FORMATS))
+
+        if format in ("feather", "parquet"):
+            try:
+                import pyarrow
+            except ImportError:
+                raise ImportError(
+                    "columnar format {} requires pyarrow".format(format))
+
+        self.filename = filename
+        self.columns = list(columns)
+        self.format = format
+        self.batch_size = batch_size
+        self.buffers = [[] for x in self.columns]
+        self.nbuffered = 0
+        self.nrows = 0
+        if dtypes is not None and len(dtypes) != len(self.columns):
+            raise ValueError(
+                "expected {} dtypes, got {}".format(
+                    len(self.columns), len(dtypes)))
+        if dtypes is None:
+            dtypes = [None] * len(self.columns)
+        self.declared = [x is not None for x in dtypes]
+        self.dtypes = [None if x is None else numpy.dtype(x)
+                       for x in dtypes]
+        self.batches = []
+        self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def append(self, row):
+        '''add a row of values to the table.'''
+        if len(row) != len(self.columns):
+            raise ValueError(
+                "expected {} values, got {}".format(
+                    len(self.columns), len(row)))
+        for buf, value in zip(self.buffers, row):
+            buf.append(value)
+        self.nbuffered += 1
+        if self.nbuffered >= self.batch_size:
+            self.flush()
+
+    def append_columns(self, columns):
+        '''add a block of rows given as a sequence or array
+        for each column.'''
+        if len(columns) != len(self.columns):
+            raise ValueError(
+                "expected {} columns, got {}".format(
+                    len(self.columns), len(columns)))
+        self.flush()
+        self.write_batch(columns)
+
+    def flush(self):
+        '''write buffered rows.'''
+        if self.nbuffered == 0:
+            return
+        buffers = self.buffers
+        self.buffers = [[] for x in self.columns]
+        self.nbuffered = 0
+        self.write_batch(buffers)
+
+    def write_batch(self, columns):
+        if len(columns[0]) == 0:
+            return
+
+        arrays = []
+        promoted = False
+        for x, values in enumerate(columns):
+            dtype = self.dtypes[x]
+            if dtype is None:
+                array = convert_column(values)
+                self.dtypes[x] = promote_dtype(array.dtype, array.dtype)
+                arrays.append(array)
+                continue
+            try:
+                array = convert_column(values, dtype)
+            except (ValueError, OverflowError) as ex:
+                if self.declared[x]:
+                    raise ValueError(
+                        "values in batch starting at row {} do not match "
+                        "the type {} of column {}: {}".format(
+                            self.nrows, dtype, self.columns[x], ex))
+                dtype = promote_dtype(dtype, convert_column(values).dtype)
+                array = convert_column(values, dtype)
+                self.dtypes[x] = dtype
+                promoted = True
+            arrays.append(array)
+
+        if promoted:
+            self.convert_batches()
+
+        self.nrows += len(arrays[0])
+
+        if self.format == "npz":
+            self.batches.append(arrays)
+            return
+
+        self.write_arrays(arrays)
+
+    def convert_batches(self):
+        '''convert the batches written so far to the current column
+        types.'''
+
+        def _convert(arrays):
+            return [x if x.dtype.kind == dtype.kind else x.astype(dtype)
+                    for x, dtype in zip(arrays, self.dtypes)]
+
+        if self.format == "npz":
+            self.batches = [_convert(x) for x in self.batches]
+            return
+
+        if self.writer is None:
+            return
+
+        # rewrite the file with the new schema batch by batch
+        self.writer.close()
+        self.writer = None
+        tmpfile = self.filename + ".tmp"
+        os.rename(self.filename, tmpfile)
+        try:
+            if self.format == "parquet":
+                import pyarrow.parquet
+                batches = pyarrow.parquet.ParquetFile(tmpfile).iter_batches()
+            else:
+                import pyarrow.ipc
+                reader = pyarrow.ipc.open_file(tmpfile)
+                batches = (reader.get_batch(x)
+                           for x in range(reader.num_record_batches))
+            for batch in batches:
+                self.write_arrays(_convert(
+                    [numpy.asarray(x.to_numpy(zero_copy_only=False))
+                     for x in batch.columns]))
+        finally:
+            os.unlink(tmpfile)
+
+    def write_arrays(self, arrays):
+        '''write typed *arrays* with pyarrow.'''
+        import pyarrow
+        table = pyarrow.Table.from_arrays(
+            [pyarrow.array(x) for x in arrays],
+            names=self.columns)
+
+        if self.writer is None:
+            if self.format == "parquet":
+                import pyarrow.parquet
+                self.writer = pyarrow.parquet.ParquetWriter(
+                    self.filename, table.schema)
+            else:
+                import pyarrow.ipc
+                self.writer = pyarrow.ipc.new_file(
+                    self.filename, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        '''write remaining rows and close the file.'''
+        self.flush()
+
+        if self.format == "npz":
+            if self.batches:
+                data = [numpy.concatenate(x) for x in zip(*self.batches)]
+            else:
+                data = [numpy.array([], dtype=numpy.float64)
+                        for x in self.columns]
+            # write arrays as numpy.savez_compressed does, column
+            # names are not passed as keyword arguments
+            with zipfile.ZipFile(self.filename, "w",
+                                 compression=zipfile.ZIP_DEFLATED,
+                                 allowZip64=True) as outf:
+                for column, array in zip(self.columns, data):
+                    with outf.open(column + ".npy", "w",
+                                   force_zip64=True) as f:
+                        numpy.lib.format.write_array(
+                            f, array, allow_pickle=False)
+            self.batches = []
+        elif self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        else:
+            # empty table, write schema only
+            import pyarrow
+            table = pyarrow.Table.from_arrays(
+                [pyarrow.array([], type=pyarrow.string())
+                 for x in self.columns],
+                names=self.columns)
+            if self.format == "parquet":
+                import pyarrow.parquet
+                pyarrow.parquet.write_table(table, self.filename)
+            else:
+                import pyarrow.feather
+                pyarrow.feather.write_feather(table, self.filename)
@@ -1,5 +1,8 @@
 import random
 
+import numpy
+import pandas
+
 
 class Diamond(object):
 
@@ -80,7 +83,6 @@ def query_iterator(alignment_iterator):
     iterate over alignments by query
     return a list of alignments
     '''
-    reads_found = set()
     last = None
     alignments = []
     for alignment in alignment_iterator:
@@ -89,7 +91,6 @@ def query_iterator(alignment_iterator):
             if last:
                 yield alignments
             alignments = []
-            reads_found.add(alignment.qid)
         alignments.append(alignment)
         last = this
     if last:
@@ -112,3 +113,143 @@ def best_alignment_iterator(query_iterator):
             best_alignments = random.sample(best_alignments, 1)
         best_alignment = best_alignments[0]
         yield best_alignment
+
+
+def parse_ref(ref):
+    '''return the reference name in a DIAMOND subject id.
+
+    Subject ids of the form ``gi|<gi>|ref|<ref>|`` are reduced to
+    ``<ref>``.
+    '''
+    fields = ref.split("|")
+    if len(fields) == 1:
+        return fields[0]
+    return fields[3]
+
+
+class CodeTable(object):
+    '''map names to consecutive integer codes.'''
+
+    def __init__(self):
+        self.codes = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        '''return code for *name*, adding it if it is new.'''
+        try:
+            return self.codes[name]
+        except KeyError:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+            return code
+
+    def encode(self, values, transform=None):
+        '''return an array of codes for *values*.
+
+        Each distinct value is looked up only once. If *transform*
+        is given, it is applied to distinct values before they are
+        looked up.
+        '''
+        codes, uniques = pandas.factorize(values)
+        if transform is not None:
+            lookup = [self.add(transform(x)) for x in uniques]
+        else:
+            lookup = [self.add(x) for x in uniques]
+        return numpy.array(lookup, dtype=numpy.int64)[codes]
+
+
+class CogMap(object):
+    '''map reference codes to COG codes.
+
+    The COG of each reference is looked up once and stored in an
+    array indexed by reference code.
+    '''
+
+    def __init__(self, gene2cog):
+        self.gene2cog = gene2cog
+        self.cogs = CodeTable()
+        self.ref2cog = numpy.zeros(0, dtype=numpy.int64)
+
+    def lookup(self, refs, codes):
+        '''return COG codes for reference *codes* in :class:`CodeTable`
+        *refs*.'''
+        nknown = len(self.ref2cog)
+        if nknown < len(refs):
+            self.ref2cog = numpy.concatenate(
+                [self.ref2cog,
+                 numpy.array([self.cogs.add(self.gene2cog[x])
+                              for x in refs.names[nknown:]],
+                             dtype=numpy.int64)])
+        return self.ref2cog[codes]
+
+
+def alignment_block_iterator(infile, block_size=1000000):
+    '''iterate over DIAMOND tabular output in blocks.
+
+    yield dataframes with the query id, reference id and bitscore of
+    about *block_size* alignments. Consecutive alignments of a query
+    are always in the same block.
+    '''
+    reader = pandas.read_csv(infile,
+                             sep="\t",
+                             header=None,
+                             usecols=[0, 1, 11],
+                             names=["qid", "ref", "score"],
+                             dtype={"qid": str, "ref": str,
+                                    "score": numpy.float64},
+                             keep_default_na=False,
+                             na_filter=False,
+                             quoting=3,
+                             chunksize=block_size)
+    remainder = None
+    for block in reader:
+        if len(block) == 0:
+            continue
+        if remainder is not None:
+            block = pandas.concat([remainder, block], ignore_index=True)
+        qids = block["qid"].values
+        other = numpy.flatnonzero(qids != qids[-1])
+        if len(other) == 0:
+            remainder = block
+            continue
+        # keep alignments of the last query for the next block
+        start = other[-1] + 1
+        remainder = block.iloc[start:]
+        yield block.iloc[:start]
+
+    if remainder is not None and len(remainder) > 0:
+        yield remainder
+
+
+def best_alignments(block, rng=None):
+    '''find the best alignment for each query in *block*.
+
+    Alignments of a query are consecutive. The best alignment has
+    the highest bitscore. Ties are broken randomly with the
+    :class:`numpy.random.RandomState` *rng*.
+
+    return a tuple of (groups, best) with the query index of each
+    alignment in *groups* and the row of the best alignment of each
+    query in *best*.
+    '''
+    qids = pandas.factorize(block["qid"].values)[0]
+    is_start = numpy.ones(len(qids), dtype=bool)
+    is_start[1:] = qids[1:] != qids[:-1]
+    starts = numpy.flatnonzero(is_start)
+    groups = numpy.cumsum(is_start) - 1
+
+    # candidates have the maximum score of their query, pick the
+    # one with the highest random key
+    scores = block["score"].values
+    is_max = scores == numpy.maximum.reduceat(scores, starts)[groups]
+    if rng is None:
+        rng = numpy.random
+    keys = numpy.where(is_max, rng.random_sample(len(qids)), -1.0)
+    is_best = keys == numpy.maximum.reduceat(keys, starts)[groups]
+    # take the last row per query in case random keys are identical
+    best = numpy.maximum.reduceat(
+        numpy.where(is_best, numpy.arange(len(qids)), -1), starts)
+    return groups, best
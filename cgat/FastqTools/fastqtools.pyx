@@ -1,14 +1,15 @@
-"""Utility functions for the bam2stats utility."""
+"""Utility functions for the fastqs2fastqs utility."""
 
-import collections
+import concurrent.futures
 
 import pysam
 from pysam.libchtslib cimport *
 from pysam.libcbcf cimport VariantFile, VariantRecord, VariantRecordSample
 from pysam.libcfaidx cimport FastxFile, FastqProxy
 from pysam.libctabix cimport TabixFile
-from libc.string cimport strchr
-from libc.stdint cimport int8_t
+from libc.string cimport strchr, memset
+from libc.stdint cimport int8_t, uint8_t, int64_t, uint64_t
+from libc.stdlib cimport malloc, free
 from libc.stdio cimport puts, printf
 from cpython cimport array as c_array
 
@@ -19,28 +20,217 @@ cimport numpy
 DTYPE = numpy.uint32
 ctypedef numpy.uint32_t DTYPE_t
 
-cdef count_diagonals(sequence,
-                     forward_hash,
-                     reverse_hash,
-                     uint32_t query_sequence_length,
-                     uint32_t kmer_size):
-    cdef uint32_t x, count
-    cdef uint32_t offset = len(sequence)
-    cdef uint32_t l = len(sequence) + query_sequence_length
-    cdef numpy.ndarray[DTYPE_t, ndim=1] forward_counts = numpy.zeros(l, dtype=DTYPE)
-    cdef numpy.ndarray[DTYPE_t, ndim=1] reverse_counts = numpy.zeros(l, dtype=DTYPE)
-    
-    for x from 0 <= x < len(sequence) - kmer_size:
-        kmer = sequence[x: x + kmer_size]
-        if kmer in forward_hash:
-            for count in forward_hash[kmer]:
-                forward_counts[count - x + offset] += 1
-
-        if kmer in reverse_hash:
-            for count in reverse_hash[kmer]:
-                reverse_counts[count - x + offset] += 1
-
-    return forward_counts.max(), reverse_counts.max()
+# number of bits per nucleotide in a packed kmer
+DEF BITS_PER_CODE = 3
+
+# maximum kmer size that can be packed into a 64-bit key
+DEF MAX_KMER_SIZE = 21
+
+# code for characters outside of ACGTacgt
+DEF INVALID_CODE = 8
+
+# 3-bit nucleotide codes indexed by ASCII value. Upper and lower
+# case nucleotides have different codes so that kmers are matched
+# case-sensitively, all other characters are invalid and break
+# a kmer.
+cdef uint8_t NUCLEOTIDE_CODES[256]
+memset(NUCLEOTIDE_CODES, INVALID_CODE, 256)
+NUCLEOTIDE_CODES[ord("A")] = 0
+NUCLEOTIDE_CODES[ord("C")] = 1
+NUCLEOTIDE_CODES[ord("G")] = 2
+NUCLEOTIDE_CODES[ord("T")] = 3
+NUCLEOTIDE_CODES[ord("a")] = 4
+NUCLEOTIDE_CODES[ord("c")] = 5
+NUCLEOTIDE_CODES[ord("g")] = 6
+NUCLEOTIDE_CODES[ord("t")] = 7
+
+
+def build_kmer_index(sequence, uint32_t kmer_size):
+    '''build a sorted index of 3-bit packed kmers in *sequence*.
+
+    Kmers containing characters other than ACGT or acgt are skipped.
+
+    return a tuple of two numpy arrays (keys, positions) sorted by key.
+    '''
+    if kmer_size == 0 or kmer_size > MAX_KMER_SIZE:
+        raise ValueError(
+            "kmer size must be between 1 and {}, got {}".format(
+                MAX_KMER_SIZE, kmer_size))
+
+    cdef bytes _sequence = sequence.encode("ascii")
+    cdef const uint8_t * s = <const uint8_t *><char *>_sequence
+    cdef uint32_t length = len(_sequence)
+    cdef uint32_t x, run = 0, nkmers = 0
+    cdef uint8_t code
+    cdef uint64_t key = 0
+    cdef uint64_t mask = ((<uint64_t>1) << (BITS_PER_CODE * kmer_size)) - 1
+
+    keys = numpy.zeros(max(length, 1), dtype=numpy.uint64)
+    positions = numpy.zeros(max(length, 1), dtype=numpy.uint32)
+    cdef uint64_t[:] _keys = keys
+    cdef uint32_t[:] _positions = positions
+
+    for x from 0 <= x < length:
+        code = NUCLEOTIDE_CODES[s[x]]
+        if code == INVALID_CODE:
+            run = 0
+            key = 0
+            continue
+        key = ((key << BITS_PER_CODE) | code) & mask
+        run += 1
+        # kmers are registered at their start position. The final
+        # kmer of the sequence is excluded as in the original
+        # string based implementation.
+        if run >= kmer_size and x + 1 < length:
+            _keys[nkmers] = key
+            _positions[nkmers] = x + 1 - kmer_size
+            nkmers += 1
+
+    keys = keys[:nkmers]
+    positions = positions[:nkmers]
+    order = numpy.argsort(keys, kind="stable")
+    return keys[order], positions[order]
+
+
+cdef inline uint32_t lower_bound(const uint64_t * keys,
+                                 uint32_t nkeys,
+                                 uint64_t key) nogil:
+    cdef uint32_t lo = 0, hi = nkeys, mid
+    while lo < hi:
+        mid = (lo + hi) >> 1
+        if keys[mid] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+cdef uint32_t count_diagonals(const uint8_t * sequence,
+                              uint32_t sequence_length,
+                              const uint64_t * keys,
+                              const uint32_t * positions,
+                              uint32_t nkeys,
+                              uint32_t query_sequence_length,
+                              uint32_t kmer_size,
+                              uint32_t * counts) nogil:
+    '''return the maximum number of kmers shared with the query
+    on any diagonal.
+
+    *counts* is a work buffer of at least *sequence_length* +
+    *query_sequence_length* elements.
+    '''
+    cdef uint32_t x, j, d, run = 0, best = 0
+    cdef uint8_t code
+    cdef uint64_t key = 0
+    cdef uint64_t mask = ((<uint64_t>1) << (BITS_PER_CODE * kmer_size)) - 1
+
+    if nkeys == 0 or sequence_length <= kmer_size:
+        return 0
+
+    memset(counts, 0,
+           (sequence_length + query_sequence_length) * sizeof(uint32_t))
+
+    for x from 0 <= x < sequence_length - 1:
+        code = NUCLEOTIDE_CODES[sequence[x]]
+        if code == INVALID_CODE:
+            run = 0
+            key = 0
+            continue
+        key = ((key << BITS_PER_CODE) | code) & mask
+        run += 1
+        if run < kmer_size:
+            continue
+        j = lower_bound(keys, nkeys, key)
+        while j < nkeys and keys[j] == key:
+            d = positions[j] + sequence_length - (x + 1 - kmer_size)
+            counts[d] += 1
+            if counts[d] > best:
+                best = counts[d]
+            j += 1
+    return best
+
+
+cdef class KmerFilter:
+    '''screen read pairs for kmers shared with a query sequence.
+
+    The kmers of the query sequence and its reverse complement are
+    stored as 3-bit packed integer keys in sorted arrays. Reads are
+    scanned without creating python strings and the GIL is released
+    while counting so that batches can be processed in parallel.
+    '''
+
+    cdef readonly uint32_t kmer_size
+    cdef readonly uint32_t min_kmer_matches
+    cdef readonly uint32_t query_sequence_length
+    cdef numpy.ndarray forward_keys, forward_positions
+    cdef numpy.ndarray reverse_keys, reverse_positions
+
+    def __init__(self,
+                 query_sequence,
+                 uint32_t kmer_size=10,
+                 uint32_t min_kmer_matches=20):
+        self.kmer_size = kmer_size
+        self.min_kmer_matches = min_kmer_matches
+        self.query_sequence_length = len(query_sequence)
+        self.forward_keys, self.forward_positions = build_kmer_index(
+            query_sequence, kmer_size)
+        self.reverse_keys, self.reverse_positions = build_kmer_index(
+            reverse_complement(query_sequence), kmer_size)
+
+    def screen(self,
+               bytes sequences,
+               numpy.ndarray[numpy.int64_t, ndim=1] offsets,
+               numpy.ndarray[numpy.uint8_t, ndim=1] matched,
+               Py_ssize_t first,
+               Py_ssize_t last):
+        '''screen read pairs *first* to *last* in a batch.
+
+        *sequences* contains the concatenated sequences of all reads
+        in the batch, ordered as first read, second read for each
+        pair. Sequence *i* occupies offsets[i]:offsets[i+1].
+
+        Sets matched[pair] to 1 for pairs in which either read has
+        more than `min_kmer_matches` kmers on a single diagonal.
+        '''
+        cdef const uint8_t * s = <const uint8_t *><char *>sequences
+        cdef const int64_t * o = <int64_t *>offsets.data
+        cdef uint8_t * m = <uint8_t *>matched.data
+        cdef const uint64_t * fkeys = <uint64_t *>self.forward_keys.data
+        cdef const uint32_t * fpos = <uint32_t *>self.forward_positions.data
+        cdef const uint64_t * rkeys = <uint64_t *>self.reverse_keys.data
+        cdef const uint32_t * rpos = <uint32_t *>self.reverse_positions.data
+        cdef uint32_t nfkeys = len(self.forward_keys)
+        cdef uint32_t nrkeys = len(self.reverse_keys)
+        cdef uint32_t qlen = self.query_sequence_length
+        cdef uint32_t k = self.kmer_size
+        cdef uint32_t threshold = self.min_kmer_matches
+        cdef Py_ssize_t pair, read, max_length = 0
+        cdef uint32_t length, best
+        cdef uint32_t * counts
+
+        for read from 2 * first <= read < 2 * last:
+            if o[read + 1] - o[read] > max_length:
+                max_length = o[read + 1] - o[read]
+
+        counts = <uint32_t *>malloc(
+            (max_length + qlen + 1) * sizeof(uint32_t))
+        if counts == NULL:
+            raise MemoryError("could not allocate diagonal counts")
+
+        with nogil:
+            for pair from first <= pair < last:
+                best = 0
+                for read from 2 * pair <= read < 2 * pair + 2:
+                    length = o[read + 1] - o[read]
+                    best = max(best,
+                               count_diagonals(s + o[read], length,
+                                               fkeys, fpos, nfkeys,
+                                               qlen, k, counts),
+                               count_diagonals(s + o[read], length,
+                                               rkeys, rpos, nrkeys,
+                                               qlen, k, counts))
+                m[pair] = best > threshold
+        free(counts)
 
 
 def filter_by_sequence(
@@ -52,54 +242,100 @@ def filter_by_sequence(
         outf_unmatched1,
         outf_unmatched2,
         uint32_t kmer_size=10,
-        uint32_t min_kmer_matches=20):
+        uint32_t min_kmer_matches=20,
+        uint32_t batch_size=100000,
+        uint32_t threads=1):
+    '''split read pairs into those matching *query_sequence* and
+    those that do not.
 
-    _query_sequence = query_sequence.encode("ascii")
-    reverse_sequence = reverse_complement(query_sequence)
-    cdef uint32_t query_sequence_length = len(query_sequence)
-    cdef uint32_t x
-    cdef char * s = _query_sequence
+    Read pairs are processed in batches of *batch_size*. Each batch
+    is screened by *threads* worker threads while the next batch is
+    being read. Output is written in blocks, one per batch.
 
-    forward_hash = collections.defaultdict(list)
-    reverse_hash = collections.defaultdict(list)
-    for x from 0 <= x < query_sequence_length - kmer_size:
-        forward_hash[query_sequence[x:x + kmer_size]].append(x)
-        reverse_hash[reverse_sequence[x: x + kmer_size]].append(x)
+    return a counter with the number of input, matched and unmatched
+    pairs.
+    '''
+    kmer_filter = KmerFilter(query_sequence,
+                             kmer_size=kmer_size,
+                             min_kmer_matches=min_kmer_matches)
 
-    cdef FastqProxy read1, read2
     cdef uint32_t ninput = 0
     cdef uint32_t nmatched = 0
     cdef uint32_t nunmatched = 0
-    cdef uint32_t fc1, rc1, fc2, rc2
-
-    for read1, read2 in zip(in_stream1, in_stream2):
-    
-        fc1, rc1 = count_diagonals(
-            read1.sequence,
-            forward_hash,
-            reverse_hash,
-            query_sequence_length,
-            kmer_size)
-        fc2, rc2 = count_diagonals(
-            read2.sequence,
-            forward_hash,
-            reverse_hash,
-            query_sequence_length,
-            kmer_size)
-
-        if max(fc1, rc1, fc2, rc2) > min_kmer_matches:
-            nmatched += 1
-            outf_matched1.write(str(read1) + "\n")
-            outf_matched2.write(str(read2) + "\n")
-        else:
-            nunmatched += 1
-            outf_unmatched1.write(str(read1) + "\n")
-            outf_unmatched2.write(str(read2) + "\n")
-        
-        ninput += 1
-        if ninput % 1000 == 0:
-            E.info("iteration: {}, matched={}, unmatched={}, permille_matched={}".format(
-                ninput, nmatched, nunmatched, 1000.0 * nmatched / ninput))
+    cdef uint32_t nworkers = max(1, threads)
+
+    def read_batches():
+        batch = []
+        for read1, read2 in zip(in_stream1, in_stream2):
+            batch.append((str(read1), read1.sequence,
+                          str(read2), read2.sequence))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def submit(pool, batch):
+        sequences = []
+        for record1, sequence1, record2, sequence2 in batch:
+            sequences.append(sequence1)
+            sequences.append(sequence2)
+        offsets = numpy.zeros(len(sequences) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(x) for x in sequences], out=offsets[1:])
+        buf = "".join(sequences).encode("ascii")
+        matched = numpy.zeros(len(batch), dtype=numpy.uint8)
+        step = (len(batch) + nworkers - 1) // nworkers
+        futures = [pool.submit(kmer_filter.screen,
+                               buf, offsets, matched,
+                               first, min(first + step, len(batch)))
+                   for first in range(0, len(batch), step)]
+        return batch, matched, futures
+
+    def write(batch, matched):
+        m1, m2, u1, u2 = [], [], [], []
+        for (record1, sequence1, record2, sequence2), is_matched in zip(
+                batch, matched):
+            if is_matched:
+                m1.append(record1)
+                m2.append(record2)
+            else:
+                u1.append(record1)
+                u2.append(record2)
+        for outf, records in ((outf_matched1, m1),
+                              (outf_matched2, m2),
+                              (outf_unmatched1, u1),
+                              (outf_unmatched2, u2)):
+            if records:
+                outf.write("\n".join(records) + "\n")
+        return len(m1), len(u1)
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=nworkers) as pool:
+        pending = None
+        for batch in read_batches():
+            # screen the current batch while the previous one
+            # is being written and the next one is being read
+            current = submit(pool, batch)
+            if pending is not None:
+                for future in pending[2]:
+                    future.result()
+                m, u = write(pending[0], pending[1])
+                nmatched += m
+                nunmatched += u
+                ninput += len(pending[0])
+                E.info("iteration: {}, matched={}, unmatched={}, "
+                       "permille_matched={}".format(
+                           ninput, nmatched, nunmatched,
+                           1000.0 * nmatched / ninput))
+            pending = current
+
+        if pending is not None:
+            for future in pending[2]:
+                future.result()
+            m, u = write(pending[0], pending[1])
+            nmatched += m
+            nunmatched += u
+            ninput += len(pending[0])
 
     c = E.Counter()
     c.input = ninput
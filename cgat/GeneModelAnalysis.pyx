@@ -158,6 +158,9 @@ class Counter:
 
     header = [ "contig", "strand" ]
 
+    # numpy types of the columns in header, None to infer types
+    dtypes = None
+
     mMinIntronSize = 10
 
     def __init__(self, fasta = None, section = None, 
@@ -184,6 +187,26 @@ class Counter:
     def __str__(self):
         return "\t".join( (self.contig, self.strand) )
 
+    def getValues(self):
+        """return the values of the counter as a list in the same
+        order as the header.
+
+        Counters that keep their values in typed attributes override
+        this method to avoid formatting them as strings.
+        """
+        return str(self).split("\t")
+
+    def getDtypes(self):
+        """return the numpy type of each column in the same order as
+        the header.
+
+        Columns with type None have their type inferred from the
+        values, see :mod:`cgat.ColumnarOutput`.
+        """
+        if self.dtypes is None:
+            return [None] * len(self.getHeader().split("\t"))
+        return list(self.dtypes)
+
     def getHeader(self):
         if self.section:
             return "\t".join( ["%s_%s" % (self.section, x) for x in self.header] )
@@ -1077,10 +1100,14 @@ class CounterReadCountsFull(CounterBAM):
         self.counters = counters
         self.reads_below_quality = quality_read_status
 
+    def getValues(self):
+        return list(self.counters.flat) + [self.reads_below_quality]
+
+    def getDtypes(self):
+        return [numpy.int64] * len(self.header)
+
     def __str__(self):
-        return "\t".join(map(str, (self.counters.flat) )) +\
-            "\t" +\
-            "\t".join(map(str, (self.reads_below_quality,)))
+        return "\t".join(map(str, self.getValues()))
                                 
 
 class CounterReadCounts(CounterReadCountsFull):
@@ -1183,19 +1210,21 @@ class CounterReadCounts(CounterReadCountsFull):
             self.sense_other +
             self.antisense )
 
+    def getValues(self):
+        return [self.sense_spliced +
+                self.sense_unspliced,
+                self.sense_spliced,
+                self.sense_unspliced,
+                self.sense_intronic,
+                self.sense_inconsistent,
+                self.sense_other,
+                self.antisense,
+                self.nonsense,
+                self.reads_below_quality,
+                self.total_reads]
+
     def __str__(self):
-        return "\t".join(map(str,(
-            self.sense_spliced +\
-            self.sense_unspliced,
-            self.sense_spliced,
-            self.sense_unspliced,
-            self.sense_intronic,
-            self.sense_inconsistent,
-            self.sense_other,
-            self.antisense,
-            self.nonsense,
-            self.reads_below_quality,
-            self.total_reads)))
+        return "\t".join(map(str, self.getValues()))
 
 
 class CounterReadPairCountsFull(CounterBAM):
@@ -1674,11 +1703,15 @@ class CounterReadPairCountsFull(CounterBAM):
         self.reads_below_quality = quality_read_status
         self.pairs_below_quality = quality_pair_status
 
+    def getValues(self):
+        return list(self.counters.flat) + [self.pairs_below_quality,
+                                           self.reads_below_quality]
+
+    def getDtypes(self):
+        return [numpy.int64] * len(self.header)
+
     def __str__(self):
-        return "\t".join(map(str, (self.counters.flat) )) +\
-            "\t" +\
-            "\t".join(map(str, (self.pairs_below_quality,
-                                self.reads_below_quality)))
+        return "\t".join(map(str, self.getValues()))
 
 ##-----------------------------------------------------------------------------------
 class CounterReadPairCounts(CounterReadPairCountsFull):
@@ -1795,21 +1828,23 @@ class CounterReadPairCounts(CounterReadPairCountsFull):
             self.nonsense +
             self.improper_pairs)
 
+    def getValues(self):
+        return [self.sense_proper_pairs_spliced +
+                self.sense_proper_pairs_unspliced,
+                self.sense_proper_pairs_spliced,
+                self.sense_proper_pairs_unspliced,
+                self.sense_intronic_pairs,
+                self.sense_inconsistent_pairs,
+                self.sense_other_pairs,
+                self.antisense,
+                self.nonsense,
+                self.improper_pairs,
+                self.pairs_below_quality,
+                self.reads_below_quality,
+                self.total_pairs]
+
     def __str__(self):
-        return "\t".join(map(str,(
-            self.sense_proper_pairs_spliced +\
-            self.sense_proper_pairs_unspliced,
-            self.sense_proper_pairs_spliced,
-            self.sense_proper_pairs_unspliced,
-            self.sense_intronic_pairs,
-            self.sense_inconsistent_pairs,
-            self.sense_other_pairs,
-            self.antisense,
-            self.nonsense,
-            self.improper_pairs,
-            self.pairs_below_quality,
-            self.reads_below_quality,
-            self.total_pairs)))
+        return "\t".join(map(str, self.getValues()))
 
 
 class CounterIntronsExons(Counter):
@@ -1819,6 +1854,8 @@ class CounterIntronsExons(Counter):
 
     header = ("ntranscripts", "nexons", "nintrons", )
 
+    dtypes = (numpy.int64, numpy.int64, numpy.int64)
+
     def __init__(self, *args, **kwargs):
         Counter.__init__(self, *args, **kwargs)
 
@@ -1828,10 +1865,11 @@ class CounterIntronsExons(Counter):
         self.mNExons = len(segments)
         self.mNIntrons = len(segments) - 1
 
+    def getValues(self):
+        return [self.mNTranscripts, self.mNExons, self.mNIntrons]
+
     def __str__(self):
-        return "\t".join((str(self.mNTranscripts),
-                          str(self.mNSegments),
-                          str(self.mNIntrons)))
+        return "\t".join([str(x) for x in self.getValues()])
 
 
 class CounterPosition(Counter):
@@ -1839,6 +1877,9 @@ class CounterPosition(Counter):
     """output the position of the transcript."""
     header = ("contig", "strand", "start", "end")
 
+    # start and end are "na" for transcripts without segments
+    dtypes = (str, str, None, None)
+
     def __init__(self, *args, **kwargs):
         Counter.__init__(self, *args, **kwargs)
 
@@ -1854,9 +1895,11 @@ class CounterPosition(Counter):
         else:
             self.start, self.end = "na", "na"
 
+    def getValues(self):
+        return [self.contig, self.strand, self.start, self.end]
+
     def __str__(self):
-        return "\t".join([str(x) for x in (
-            self.contig, self.strand, self.start, self.end)])
+        return "\t".join([str(x) for x in self.getValues()])
 
 # ----------------------------------------------------------------
 
@@ -980,6 +980,68 @@ def IsStopCodon(codon, stop_codons=("TAG", "TAA", "TGA")):
     return codon in stop_codons
 
 
+# Lookup tables for vectorized codon translation. Nucleotides are
+# encoded as A=0, C=1, G=2, T=3 and a codon as the index
+# 16 * n1 + 4 * n2 + n3. Codons containing any other character
+# map to INVALID_CODON_INDEX.
+INVALID_CODON_INDEX = 64
+
+
+def _buildNucleotideCodes(ignore_case):
+    codes = numpy.full(256, 4, dtype=numpy.uint8)
+    for code, nucleotide in enumerate("ACGT"):
+        codes[ord(nucleotide)] = code
+        if ignore_case:
+            codes[ord(nucleotide.lower())] = code
+    return codes
+
+
+def _buildCodonTable(genetic_code):
+    table = numpy.zeros(INVALID_CODON_INDEX + 1, dtype=numpy.uint8)
+    for codon, aa in genetic_code.items():
+        table[encodeCodons(codon)[0]] = ord(aa)
+    return table
+
+
+NUCLEOTIDE_CODES = _buildNucleotideCodes(ignore_case=True)
+NUCLEOTIDE_CODES_UPPER = _buildNucleotideCodes(ignore_case=False)
+
+# characters that mark a codon as lower case in :func:`translate`
+LOWER_CASE_CODON_CHARS = numpy.zeros(256, dtype=numpy.bool_)
+LOWER_CASE_CODON_CHARS[[ord(x) for x in "acgtnx"]] = True
+
+# map upper case ASCII characters to lower case
+TO_LOWER_CASE = numpy.arange(256, dtype=numpy.uint8)
+TO_LOWER_CASE[ord("A"):ord("Z") + 1] += ord("a") - ord("A")
+
+
+def encodeCodons(sequence, ignore_case=True):
+    """return an array of codon indices for *sequence*.
+
+    Codons containing characters other than ACGT, or
+    lower case characters if ``ignore_case`` is False,
+    are set to :data:`INVALID_CODON_INDEX`. An incomplete
+    codon at the end of the sequence is ignored.
+    """
+    ncodons = len(sequence) // 3
+    data = numpy.frombuffer(
+        sequence[:3 * ncodons].encode("ascii", "replace"),
+        dtype=numpy.uint8)
+    if ignore_case:
+        codes = NUCLEOTIDE_CODES[data]
+    else:
+        codes = NUCLEOTIDE_CODES_UPPER[data]
+    codes = codes.reshape(ncodons, 3).astype(numpy.int32)
+    index = codes[:, 0] * 16 + codes[:, 1] * 4 + codes[:, 2]
+    index[(codes == 4).any(axis=1)] = INVALID_CODON_INDEX
+    return index
+
+
+CODON_TABLE = _buildCodonTable(GeneticCode)
+CODON_TABLE_SELENO = _buildCodonTable(GeneticCodeSeleno)
+STOP_CODON_INDICES = encodeCodons("".join(StopCodons), ignore_case=False)
+
+
 def MapCodon2AA(codon, is_seleno=False, ignore_n=True):
     '''map a codon to an amino acid using the standard translation
     tables
@@ -1110,29 +1172,60 @@ def translate(sequence,
     If ``ignore_n`` is set, codons with ``n`` are returned
     as ``?`` in order to distinguish them from stop codons.
 
+    Codons consisting of ACGT only are translated in a single
+    pass through :data:`CODON_TABLE`, all other codons are
+    translated with :func:`MapCodon2AA`.
     '''
-    residues = []
-
-    for x in range(0, len(sequence), 3):
+    def _translate(codon):
         if prefer_lowercase:
             is_lower = False
-            for c in sequence[x:x + 3]:
+            for c in codon:
                 is_lower = is_lower or c in "acgtnx"
         else:
             is_lower = True
-            for c in sequence[x:x + 3]:
+            for c in codon:
                 is_lower = is_lower and c in "acgtnx"
 
+        aa = MapCodon2AA(codon.upper(),
+                         is_seleno=is_seleno,
+                         ignore_n=ignore_n)
         if is_lower:
-            residues.append(MapCodon2AA(sequence[x:x + 3].upper(),
-                                        is_seleno=is_seleno,
-                                        ignore_n=ignore_n).lower())
+            return aa.lower()
         else:
-            residues.append(MapCodon2AA(sequence[x:x + 3].upper(),
-                                        is_seleno=is_seleno,
-                                        ignore_n=ignore_n).upper())
+            return aa.upper()
+
+    ncodons = len(sequence) // 3
+    index = encodeCodons(sequence)
+
+    if is_seleno:
+        residues = CODON_TABLE_SELENO[index]
+    else:
+        residues = CODON_TABLE[index]
+
+    data = numpy.frombuffer(
+        sequence[:3 * ncodons].encode("ascii", "replace"),
+        dtype=numpy.uint8).reshape(ncodons, 3)
+    if prefer_lowercase:
+        is_lower = LOWER_CASE_CODON_CHARS[data].any(axis=1)
+    else:
+        is_lower = LOWER_CASE_CODON_CHARS[data].all(axis=1)
+    residues = numpy.where(is_lower, TO_LOWER_CASE[residues], residues)
+
+    # codons with gaps, ambiguity codes or other characters
+    # are translated individually
+    invalid = numpy.flatnonzero(index == INVALID_CODON_INDEX)
+    if len(invalid) == 0:
+        result = residues.tobytes().decode("ascii")
+    else:
+        result = [chr(x) for x in residues]
+        for x in invalid:
+            result[x] = _translate(sequence[3 * x:3 * x + 3])
+        result = "".join(result)
+
+    if len(sequence) % 3:
+        result += _translate(sequence[3 * ncodons:])
 
-    return "".join(residues)
+    return result
 
 
 def TranslateDNA2Protein(*args, **kwargs):
@@ -1720,21 +1813,19 @@ def IsJunk(contig):
 
 
 def CountCodons(sequence):
-    """count the codons in a sequence."""
+    """count the codons in a sequence.
+
+    Only upper case codons are counted, stop codons are skipped.
+    """
     if len(sequence) % 3 != 0:
-        raise "sequence is not multiple of 3: %i" % len(sequence)
+        raise ValueError(
+            "sequence is not multiple of 3: %i" % len(sequence))
 
-    counts = {}
-    for c in list(GeneticCodeAA.keys()):
-        counts[c] = 0
-    for codon in [sequence[x:x + 3] for x in range(0, len(sequence), 3)]:
-        try:
-            counts[codon] += 1
-        except KeyError:
-            # skip stop-codons
-            pass
+    counts = numpy.bincount(encodeCodons(sequence, ignore_case=False),
+                            minlength=INVALID_CODON_INDEX + 1)
 
-    return counts
+    return dict([(codon, int(counts[encodeCodons(codon)[0]]))
+                 for codon in GeneticCodeAA])
 
 
 def GetUniformCodonUsage():
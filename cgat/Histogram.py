@@ -9,14 +9,24 @@ Histograms can be calculated from a list/tuple/array of
 values. The histogram returned is then a list of tuples
 of the format [(bin1,value1), (bin2,value2), ...].
 
+Large data sets can be histogrammed with :class:`ArrayHistogram`,
+which keeps bin boundaries and counts in numpy arrays. Values
+are added in chunks, for example from :func:`iterate_columns`,
+so that the data never need to be held in memory. Histograms
+with the same bins can be merged, so that partial histograms
+computed in separate processes can be combined.
+
 """
 
 import sys
 import re
+import io
+import csv
 import math
 import scipy
-import bisect
+import itertools
 import numpy
+import pandas
 from functools import reduce
 
 
@@ -120,18 +130,19 @@ def Calculate(values,
     if len(values) == 0:
         return []
 
+    values = numpy.asarray(values)
+
     if not intervals:
 
         if min_value is None:
-            min_value = min(values)
+            min_value = values.min()
 
         if max_value is None:
-            max_value = max(values)
+            max_value = values.max()
 
         if dynamic_bins:
-            intervals = list(
-                set([x for x in values if min_value <= x <= max_value]))
-            intervals.sort()
+            intervals = numpy.unique(
+                values[(values >= min_value) & (values <= max_value)]).tolist()
         else:
             if increment:
                 step_size = increment
@@ -146,15 +157,7 @@ def Calculate(values,
                          for x in range(num_bins + 1)]
 
     if not ignore_out_of_range:
-        new_values = []
-        for v in values:
-            if v < min_value:
-                v = min_value
-            elif v > max_value:
-                v = max_value
-            new_values.append(v)
-
-        values = new_values
+        values = numpy.clip(values, min_value, max_value)
 
     return convert(numpy.histogram(values, bins=intervals)[0], intervals, no_empty_bins)
 
@@ -724,14 +727,17 @@ def fill(iterator, bins):
     bin (range) of values.
     """
 
-    h = numpy.zeros(len(bins))
+    h = ArrayHistogram(numpy.append(bins, numpy.inf))
+    iterator = iter(iterator)
 
-    # bins might not be uniform, so do a bisect
-    for value in iterator:
-        i = bisect.bisect_left(value)
-        h[i] += 1
+    while True:
+        values = numpy.fromiter(itertools.islice(iterator, 100000),
+                                numpy.float64)
+        if len(values) == 0:
+            break
+        h.add(values)
 
-    return h
+    return h.counts.astype(numpy.float64)
 
 
 def fillHistograms(infile, columns, bins):
@@ -763,20 +769,193 @@ def fillHistograms(infile, columns, bins):
 
     assert(len(bins) == len(columns))
 
-    hh = [numpy.zeros(len(bins[x]), numpy.float) for x in range(len(columns))]
+    hh = [ArrayHistogram(numpy.append(b, numpy.inf)) for b in bins]
+
+    for chunk in iterate_columns(infile, columns, sep=r"\s+"):
+        for h, values in zip(hh, chunk):
+            h.add(values)
+
+    return [h.counts.astype(numpy.float64) for h in hh]
+
+
+def make_bins(min_value, max_value, bin_size=None, num_bins=None,
+              log=False):
+    """return bin boundaries for the range *min_value* to *max_value*.
+
+    The bins are either set by *bin_size* or by *num_bins*. If
+    *log* is set, the bins are equally spaced in log10 space and
+    *bin_size* is given in log10 units.
+
+    Returns a 1D array of length num_bins + 1 with the lower
+    boundaries of each bin followed by the upper boundary of
+    the last bin.
+    """
+
+    if log:
+        if min_value <= 0:
+            raise ValueError(
+                "log-spaced bins require a positive minimum value, "
+                "got %s" % str(min_value))
+        min_value, max_value = math.log10(min_value), math.log10(max_value)
+
+    if num_bins is None:
+        if bin_size is None:
+            raise ValueError("please supply either bin_size or num_bins")
+        bin_size = float(bin_size)
+        num_bins = max(1, int(math.ceil(
+            (float(max_value) - float(min_value)) / bin_size)))
+        # same boundaries as computed by Calculate
+        bins = float(min_value) + numpy.arange(num_bins + 1) * bin_size
+    else:
+        bins = numpy.linspace(min_value, max_value, num_bins + 1)
+
+    if log:
+        return 10.0 ** bins
+    else:
+        return bins
+
+
+class ArrayHistogram(object):
+    """a histogram with bins and counts stored in numpy arrays.
+
+    *bins* are the bin boundaries, see :func:`make_bins`. A value v
+    falls into bin x if bins[x] <= v < bins[x+1]. The last bin
+    includes its upper boundary. Values outside the range are
+    ignored unless *clip* is set, in which case they are counted in
+    the first or last bin. Missing values (NaN) are always ignored.
+
+    Histograms with the same bins can be added up with
+    :meth:`merge`. Instances can be pickled, so that histograms
+    built in separate processes can be combined.
+    """
+
+    def __init__(self, bins, counts=None, clip=False):
+
+        self.bins = numpy.asarray(bins, dtype=numpy.float64)
+        if len(self.bins) < 2:
+            raise ValueError("a histogram requires at least two bin boundaries")
 
-    for line in infile:
-        if line[0] == "#":
+        if counts is None:
+            self.counts = numpy.zeros(len(self.bins) - 1, dtype=numpy.int64)
+        else:
+            self.counts = numpy.asarray(counts)
+            if len(self.counts) != len(self.bins) - 1:
+                raise ValueError(
+                    "number of counts (%i) does not match number of bins (%i)" %
+                    (len(self.counts), len(self.bins) - 1))
+
+        self.clip = clip
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, values):
+        """add an array of *values* to the histogram."""
+
+        values = numpy.asarray(values, dtype=numpy.float64)
+        values = values[~numpy.isnan(values)]
+        nbins = len(self.counts)
+
+        if self.clip:
+            values = numpy.clip(values, self.bins[0], self.bins[-1])
+
+        idx = numpy.searchsorted(self.bins, values, side="right") - 1
+        idx[values == self.bins[-1]] = nbins - 1
+        idx = idx[(idx >= 0) & (idx < nbins)]
+
+        self.counts += numpy.bincount(idx, minlength=nbins)
+        return self
+
+    def fill(self, chunks):
+        """add values from an iterator over arrays of values."""
+        for values in chunks:
+            self.add(values)
+        return self
+
+    def merge(self, other):
+        """add the counts of histogram *other*."""
+        if not numpy.array_equal(self.bins, other.bins):
+            raise ValueError("can not merge histograms with different bins")
+        self.counts = self.counts + other.counts
+        return self
+
+    def cumulate(self, direction=1):
+        """return cumulative histogram.
+
+        If *direction* is not 1, values are accumulated from the
+        last bin towards the first.
+        """
+        if direction == 1:
+            counts = numpy.cumsum(self.counts)
+        else:
+            counts = numpy.cumsum(self.counts[::-1])[::-1]
+        return ArrayHistogram(self.bins, counts, self.clip)
+
+    def normalize(self):
+        """return histogram with counts divided by the total."""
+        total = self.counts.sum()
+        if total == 0:
+            total = 1
+        return ArrayHistogram(self.bins, self.counts / float(total),
+                              self.clip)
+
+    def tolist(self, no_empty_bins=False):
+        """return histogram as a list of (bin, value) tuples.
+
+        Bins are labelled by their lower boundary.
+        """
+        return convert(self.counts.tolist(), self.bins[:-1].tolist(),
+                       no_empty_bins)
+
+
+def combine_arrays(histograms):
+    """combine a list of :class:`ArrayHistogram` with the same bins.
+
+    Returns a list of tuples (bin, [value1, value2, ...]) as
+    :func:`Combine`.
+    """
+
+    if len(histograms) == 0:
+        return []
+
+    bins = histograms[0].bins
+    for h in histograms[1:]:
+        if not numpy.array_equal(bins, h.bins):
+            raise ValueError("can not combine histograms with different bins")
+
+    counts = numpy.column_stack([h.counts for h in histograms]).tolist()
+    return list(zip(bins[:-1].tolist(), counts))
+
+
+def iterate_columns(infile, columns, sep="\t", chunk_size=1000000):
+    """iterate over numeric *columns* in a table in chunks.
+
+    Lines starting with ``#`` are ignored, ``#`` elsewhere in a
+    line is part of the value. Values that are missing or can not be
+    converted to float are returned as NaN.
+
+    Yields a list of 1D arrays, one array for each column, with
+    up to *chunk_size* values.
+    """
+
+    names = list(range(max(columns) + 1))
+    lines = (x for x in infile if not x.startswith("#"))
+
+    while True:
+        block = list(itertools.islice(lines, chunk_size))
+        if not block:
+            break
+        try:
+            chunk = pandas.read_csv(io.StringIO("".join(block)),
+                                    sep=sep,
+                                    header=None,
+                                    names=names,
+                                    usecols=sorted(set(columns)),
+                                    index_col=False,
+                                    quoting=csv.QUOTE_NONE)
+        except pandas.errors.EmptyDataError:
+            continue
+        if len(chunk) == 0:
             continue
-        data = line[:-1].split()
-        # bins might not be uniform, so do a bisect
-        for x, y in enumerate(columns):
-            try:
-                v = float(data[y])
-            except IndexError:
-                continue
-            i = bisect.bisect(bins[x], v) - 1
-            if i >= 0:
-                hh[x][i] += 1
-
-    return hh
+        yield [pandas.to_numeric(chunk[x], errors="coerce").to_numpy(
+            dtype=numpy.float64) for x in columns]
@@ -38,6 +38,8 @@ Reference
 import os
 import sys
 import array
+import collections
+import concurrent.futures
 import string
 import re
 import struct
@@ -47,6 +49,7 @@ import random
 import zlib
 import gzip
 import tempfile
+import time
 import io
 from cgatcore import experiment as E
 import cgatcore.iotools as iotools
@@ -54,7 +57,6 @@ import cgat.Genomics as Genomics
 from cgat.AString import AString
 import pysam
 import dbm
-from io import StringIO
 
 
 class Uncompressor:
@@ -83,7 +85,7 @@ class Uncompressor:
         for x in range(d, d + nchunks):
             s = self.mFile.read(indices[x + 1] - indices[x])
             fragments.append(self.mUnMangler(s))
-        u = "".join(fragments)
+        u = b"".join(fragments)
 
         assert len(u) >= end - start, \
             "fragment smaller than requested size: %i > %i-%i=%i" %\
@@ -92,44 +94,9 @@ class Uncompressor:
         return u[r:r + end - start]
 
 
-def writeFragments(outfile_fasta,
-                   outfile_index,
-                   fragments,
-                   mangler, size,
-                   write_all=False):
-    """write mangled fragments to *outfile_fasta* in chunks of *size*
-    updating *outfile_index*.
-
-    returns part of last fragment that has not been written and is
-    less than *size* and the number of fragments output.
-
-    If *write_all* is True, all of the fragments are written to
-    the file and the last file position is added to *outfile_index*
-    as well.
-    """
-
-    s = "".join(fragments)
-    rest = len(s) % size
-    if len(s) > size:
-        for x in range(0, len(s) - rest, size):
-            outfile_index.write("\t%i" % outfile_fasta.tell())
-            outfile_fasta.write(mangler(s[x:x + size]))
-
-    if rest:
-        if write_all:
-            outfile_index.write("\t%i" % outfile_fasta.tell())
-            outfile_fasta.write(mangler(s[-rest:]))
-            outfile_index.write("\t%i" % outfile_fasta.tell())
-            return ""
-        else:
-            return s[-rest:]
-    else:
-        return ""
-
-
 def gzip_mangler(s):
 
-    xfile = StringIO()
+    xfile = io.BytesIO()
     gzipfile = gzip.GzipFile(fileobj=xfile, mode="wb")
     gzipfile.write(s)
     gzipfile.close()
@@ -142,13 +109,9 @@ def gzip_mangler(s):
 
 
 def gzip_demangler(s):
-    if sys.version_info.major >= 3:
-        gzipfile = io.TextIOWrapper(
-            gzip.GzipFile(fileobj=io.BytesIO(s), mode="rb"),
-            encoding="ascii")
-    else:
-        gzipfile = gzip.GzipFile(fileobj=io.BytesIO(s), mode="rb")
-    m = gzipfile.readline()
+    gzipfile = gzip.GzipFile(fileobj=io.BytesIO(s), mode="rb")
+    m = gzipfile.read()
+    gzipfile.close()
 
     return m
 
@@ -253,10 +216,18 @@ class TranslatorBytes(Translator):
 
 class MultipleFastaIterator:
 
+    """iterate over sequences in multiple fasta files.
+
+    Files are read in blocks of *block_size* bytes. The iterator
+    returns tuples of (is_new, identifier, fragment), where
+    fragment is a portion of sequence without white-space.
+    """
+
     def __init__(self,
                  filenames,
                  regex_identifier=None,
-                 format="auto"):
+                 format="auto",
+                 block_size=1 << 20):
 
         if isinstance(filenames, str):
             self.filenames = [filenames]
@@ -266,6 +237,7 @@ class MultipleFastaIterator:
         self.regexIdentifier = regex_identifier
         self.iterator = self._iterate()
         self.format = format
+        self.block_size = block_size
 
     def __iter__(self):
         return self
@@ -285,33 +257,68 @@ class MultipleFastaIterator:
     def _iterate(self):
         """iterate over muliple files."""
 
+        rx_header = re.compile("^[>#][^\n]*\n?", re.M)
+
+        def _get_identifier(line):
+            if line.endswith("\n"):
+                line = line[1:-1]
+            else:
+                line = line[1:]
+            if self.regexIdentifier:
+                try:
+                    return re.search(
+                        self.regexIdentifier, line).groups()[0]
+                except AttributeError:
+                    raise ValueError(
+                        "could not parse identifier from line %s "
+                        "- check the input" % line)
+            else:
+                return re.split("\s", line)[0]
+
         def _iter(infile):
 
             identifier = None
             is_new = False
+            rest = ""
+
+            while 1:
+                # read complete lines so that description
+                # lines are not split between blocks
+                block = infile.read(self.block_size)
+                data = rest + block
+                if block:
+                    end = data.rfind("\n") + 1
+                    if end == 0:
+                        rest = data
+                        continue
+                    data, rest = data[:end], data[end:]
+                elif data:
+                    rest = ""
+                else:
+                    break
 
-            for line in infile:
-                if line.startswith("#"):
-                    continue
-                if line.startswith(">"):
-
-                    if self.regexIdentifier:
-                        try:
-                            identifier = re.search(
-                                self.regexIdentifier, line[1:-1]).groups()[0]
-                        except AttributeError:
+                start = 0
+                for match in rx_header.finditer(data):
+                    if match.start() > start:
+                        if not identifier:
                             raise ValueError(
-                                "could not parse identifier from line %s "
-                                "- check the input" % line[1:-1])
-                    else:
-                        identifier = re.split("\s", line[1:-1])[0]
-                    is_new = True
-                else:
+                                "refusing to emit sequence without "
+                                "identifier - check the input")
+                        yield (is_new, identifier,
+                               "".join(data[start:match.start()].split()))
+                        is_new = False
+                    line = match.group(0)
+                    if line.startswith(">"):
+                        identifier = _get_identifier(line)
+                        is_new = True
+                    start = match.end()
+
+                if len(data) > start:
                     if not identifier:
                         raise ValueError(
                             "refusing to emit sequence without identifier "
                             "- check the input")
-                    yield is_new, identifier, line.strip()
+                    yield is_new, identifier, "".join(data[start:].split())
                     is_new = False
 
         for filename in self.filenames:
@@ -352,7 +359,178 @@ class MultipleFastaIterator:
             if filename != "-":
                 infile.close()
 
-        raise StopIteration
+
+INDEX_ENTRY_FORMAT = "QQi"
+INDEX_ENTRY_SIZE = struct.calcsize(INDEX_ENTRY_FORMAT)
+
+
+def pack_index_entry(pos_id, pos_seq, lsequence, points=None):
+    """pack an index entry into a byte string.
+
+    For compressed databases, *pos_seq* is the block size and
+    *points* are the file positions of the compressed chunks.
+    """
+    data = struct.pack(INDEX_ENTRY_FORMAT, pos_id, pos_seq, lsequence)
+    if points:
+        data += struct.pack("%iQ" % len(points), *points)
+    return data
+
+
+def unpack_index_entry(data):
+    """unpack an index entry.
+
+    returns a tuple of (pos_id, pos_seq, lsequence, points). *points*
+    is None for uncompressed databases.
+    """
+    if isinstance(data, tuple):
+        return data
+    pos_id, pos_seq, lsequence = struct.unpack(
+        INDEX_ENTRY_FORMAT, data[:INDEX_ENTRY_SIZE])
+    npoints = (len(data) - INDEX_ENTRY_SIZE) // 8
+    if npoints:
+        points = list(struct.unpack("%iQ" % npoints,
+                                    data[INDEX_ENTRY_SIZE:]))
+    else:
+        points = None
+    return pos_id, pos_seq, lsequence, points
+
+
+class IndexWriter:
+
+    """write the index of a database.
+
+    The index is written as a text file. If *binary* is set, the
+    index is written as a dbm file as well (see
+    :meth:`cgatIndexedFasta.compressIndex`).
+    """
+
+    def __init__(self, filename, binary=False):
+        self.outfile = open(filename, "w")
+        if binary:
+            self.dbm = dbm.open(filename + ".dbm", "n")
+        else:
+            self.dbm = None
+
+    def add(self, identifier, pos_id, pos_seq, lsequence, points=None):
+        fields = [pos_id, pos_seq]
+        if points:
+            fields.extend(points)
+        fields.append(lsequence)
+        self.outfile.write("%s\t%s\n" % (
+            identifier, "\t".join(map(str, fields))))
+        if self.dbm is not None:
+            self.dbm[identifier] = pack_index_entry(
+                pos_id, pos_seq, lsequence, points)
+
+    def addSynonym(self, key, val):
+        self.outfile.write("%s\t%s\n" % (key, val))
+
+    def close(self):
+        self.outfile.close()
+        if self.dbm is not None:
+            self.dbm.close()
+
+
+class ChunkWriter:
+
+    """write sequences to *outfile* as compressed chunks of
+    *chunk_size* residues.
+
+    Chunks are compressed with *mangler* by a pool of *threads*
+    threads. Compressed chunks are written in input order and a
+    sequence is added to *index* once all of its chunks have been
+    written.
+    """
+
+    def __init__(self, outfile, index, mangler, chunk_size, threads=1):
+        self.outfile = outfile
+        self.index = index
+        self.mangler = mangler
+        self.chunk_size = chunk_size
+        self.threads = max(1, threads)
+        if self.threads > 1:
+            self.pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.threads)
+        else:
+            self.pool = None
+        self.pending = collections.deque()
+        self.fragments = []
+        self.lfragments = 0
+        self.record = None
+        self.nbytes = 0
+
+    def _submit(self, kind, data=None):
+        if data is None:
+            result = None
+        elif self.pool is not None:
+            result = self.pool.submit(self.mangler, data.encode("ascii"))
+        else:
+            result = self.mangler(data.encode("ascii"))
+        self.pending.append((kind, result, self.record))
+        while len(self.pending) > 2 * self.threads:
+            self._writeNext()
+
+    def _writeNext(self):
+        kind, result, record = self.pending.popleft()
+        pos = self.outfile.tell()
+        if kind == "end":
+            record["points"].append(pos)
+            self.index.add(record["identifier"],
+                           record["pos_id"],
+                           self.chunk_size,
+                           record["lsequence"],
+                           record["points"])
+            return
+        if kind == "header":
+            record["pos_id"] = pos
+        else:
+            record["points"].append(pos)
+        if self.pool is not None:
+            result = result.result()
+        self.outfile.write(result)
+        self.nbytes += len(result)
+
+    def _submitChunks(self, write_all=False):
+        s = "".join(self.fragments)
+        chunk_size = self.chunk_size
+        nchunks = len(s) // chunk_size
+        for x in range(0, nchunks * chunk_size, chunk_size):
+            self._submit("chunk", s[x:x + chunk_size])
+        rest = s[nchunks * chunk_size:]
+        if write_all and rest:
+            self._submit("chunk", rest)
+            rest = ""
+        if rest:
+            self.fragments = [rest]
+        else:
+            self.fragments = []
+        self.lfragments = len(rest)
+
+    def start(self, identifier):
+        """start a new sequence."""
+        self.record = {"identifier": identifier,
+                       "pos_id": None,
+                       "points": []}
+        self._submit("header", ">%s\n" % identifier)
+
+    def write(self, sequence):
+        """add *sequence* to the current sequence."""
+        self.fragments.append(sequence)
+        self.lfragments += len(sequence)
+        if self.lfragments >= self.chunk_size:
+            self._submitChunks()
+
+    def finish(self, lsequence):
+        """finish the current sequence of length *lsequence*."""
+        self._submitChunks(write_all=True)
+        self.record["lsequence"] = lsequence
+        self._submit("end")
+
+    def close(self):
+        while self.pending:
+            self._writeNext()
+        if self.pool is not None:
+            self.pool.shutdown()
 
 
 def createDatabase(db, iterator,
@@ -364,13 +542,16 @@ def createDatabase(db, iterator,
                    clean_sequence=False,
                    ignore_duplicates=False,
                    allow_duplicates=False,
-                   translator=None):
+                   translator=None,
+                   threads=1,
+                   binary_index=False):
     """index files in filenames to create database.
 
     Two new files are created - db.fasta and db_name.idx
 
     If compression is enabled, provide random access points
-    every # bytes.
+    every # bytes. Chunks are compressed in parallel using
+    *threads* threads.
 
     Dictzip is treated as an uncompressed file.
 
@@ -378,6 +559,9 @@ def createDatabase(db, iterator,
     If None, the part until the first white-space character is used.
 
     translator: specify a translator
+
+    If *binary_index* is set, a dbm version of the index is
+    written alongside the text index.
     """
 
     if db.endswith(".fasta"):
@@ -451,7 +635,7 @@ def createDatabase(db, iterator,
     if os.path.exists(index_name) and not force:
         raise ValueError("database index %s already exists." % index_name)
 
-    outfile_index = open(index_name, "w")
+    outfile_index = IndexWriter(index_name, binary=binary_index)
     if compression == "dictzip":
         if random_access_points is None or random_access_points <= 0:
             raise ValueError(
@@ -459,6 +643,13 @@ def createDatabase(db, iterator,
         outfile_fasta = dictzip.open(
             db_name, "wb", buffersize=1000000, chunksize=random_access_points)
         compression = None
+    elif write_chunks:
+        outfile_fasta = open(db_name, "wb")
+        chunk_writer = ChunkWriter(outfile_fasta,
+                                   outfile_index,
+                                   mangler,
+                                   random_access_points,
+                                   threads=threads)
     else:
         outfile_fasta = open(db_name, "w")
 
@@ -471,10 +662,9 @@ def createDatabase(db, iterator,
     else:
         translation = string.maketrans("xX", "nN")
 
-    fragments = []
-    lfragment = 0
-
     last_identifier = None
+    nsequences, nresidues = 0, 0
+    start_time = time.time()
 
     while 1:
 
@@ -512,32 +702,25 @@ def createDatabase(db, iterator,
 
             if last_identifier:
                 if write_chunks:
-                    writeFragments(outfile_fasta, outfile_index,
-                                   fragments, mangler,
-                                   size=random_access_points,
-                                   write_all=True)
-
-                    fragments = []
-                    lfragment = 0
+                    chunk_writer.finish(lsequence)
                 else:
                     outfile_fasta.write("\n")
+                    outfile_index.add(last_identifier,
+                                      identifier_pos,
+                                      sequence_pos,
+                                      lsequence)
+                nresidues += lsequence
 
-                outfile_index.write("\t%i\n" % lsequence)
-
-            identifier_pos = outfile_fasta.tell()
-            outfile_fasta.write(mangler(">%s\n" % out_identifier))
-            sequence_pos = outfile_fasta.tell()
-
-            outfile_index.write("%s\t%i" % (out_identifier,
-                                            identifier_pos))
             if write_chunks:
-                outfile_index.write("\t%i" % random_access_points)
+                chunk_writer.start(out_identifier)
             else:
-                outfile_index.write("\t%i" % sequence_pos)
+                identifier_pos = outfile_fasta.tell()
+                outfile_fasta.write(mangler(">%s\n" % out_identifier))
+                sequence_pos = outfile_fasta.tell()
 
-            fragments = []
             lsequence = 0
-            last_identifier = identifier
+            last_identifier = out_identifier
+            nsequences += 1
 
         if translator:
             s = translator(fragment)
@@ -549,33 +732,38 @@ def createDatabase(db, iterator,
         lsequence += len(s)
 
         if write_chunks:
-            fragments.append(s)
-            lfragment += len(s)
-            if lfragment > random_access_points:
-                rest = writeFragments(outfile_fasta,
-                                      outfile_index,
-                                      fragments,
-                                      mangler,
-                                      size=random_access_points,
-                                      write_all=False)
-                fragments = [rest]
-                lfragment = len(rest)
+            chunk_writer.write(s)
         else:
             outfile_fasta.write(mangler(s))
 
-    if write_chunks:
-        writeFragments(outfile_fasta, outfile_index, fragments, mangler,
-                       size=random_access_points, write_all=True)
-    else:
-        outfile_fasta.write("\n")
+    if last_identifier:
+        if write_chunks:
+            chunk_writer.finish(lsequence)
+        else:
+            outfile_fasta.write("\n")
+            outfile_index.add(last_identifier,
+                              identifier_pos,
+                              sequence_pos,
+                              lsequence)
+        nresidues += lsequence
 
-    outfile_index.write("\t%i\n" % lsequence)
+    if write_chunks:
+        chunk_writer.close()
 
     # add synonyms for the table
     if synonyms:
         for key, vals in list(synonyms.items()):
             for val in vals:
-                outfile_index.write("%s\t%s\n" % (key, val))
+                outfile_index.addSynonym(key, val)
+
+    outfile_fasta.close()
+    outfile_index.close()
+
+    elapsed = max(time.time() - start_time, 1e-6)
+    E.info("indexed %i sequences with %i residues in %.2f seconds: "
+           "%.2f Mb/s" % (nsequences, nresidues, elapsed,
+                          nresidues / elapsed / 1e6))
+
 
 NAME_MAP = {
     'uncompressed': ('fasta', 'idx', False),
@@ -690,13 +878,17 @@ class cgatIndexedFasta:
                     (identifier, pos_id, block_size, lsequence) = data[
                         0], int(data[1]), int(data[2]), int(data[-1])
                     points = list(map(int, data[3:-1]))
-                    self.mIndex[identifier] = (
-                        pos_id, block_size, lsequence, points)
+                    if compress:
+                        self.mIndex[identifier] = pack_index_entry(
+                            pos_id, block_size, lsequence, points)
+                    else:
+                        self.mIndex[identifier] = (
+                            pos_id, block_size, lsequence, points)
                 else:
                     (identifier, pos_id, pos_seq, lsequence) = data[
                         0], int(data[1]), int(data[2]), int(data[-1])
-                    self.mIndex[identifier] = struct.pack(
-                        "QQi", pos_id, pos_seq, lsequence)
+                    self.mIndex[identifier] = pack_index_entry(
+                        pos_id, pos_seq, lsequence)
 
         self._addSynonyms()
         self.mIsLoaded = True
@@ -775,11 +967,8 @@ class cgatIndexedFasta:
         """return sequence length for sbjct_token."""
         if not self.mIsLoaded:
             self._loadIndex()
-        data = self.mIndex[self.getToken(contig)]
-        try:
-            pos_id, pos_seq, lcontig = struct.unpack("QQi", data)
-        except struct.error:
-            pos_id, pos_seq, lcontig, points = data
+        pos_id, pos_seq, lcontig, points = unpack_index_entry(
+            self.mIndex[self.getToken(contig)])
         return lcontig
 
     def getLengths(self):
@@ -788,11 +977,8 @@ class cgatIndexedFasta:
             self._loadIndex()
         results = []
         for contig in list(self.mIndex.values()):
-            data = self.mIndex[self.getToken(contig)]
-            try:
-                pos_id, pos_seq, lcontig = struct.unpack("QQi", data)
-            except struct.error:
-                pos_id, pos_seq, lcontig, points = data
+            pos_id, pos_seq, lcontig, points = unpack_index_entry(
+                self.mIndex[self.getToken(contig)])
             results.append(lcontig)
         return results
 
@@ -853,14 +1039,11 @@ class cgatIndexedFasta:
 
         contig = self.getToken(contig)
 
-        data = self.mIndex[contig]
         # dummy is
         # -> pos_seq for seekable streams
         # -> block_size for unseekable streams
-        try:
-            pos_id, dummy, lsequence = struct.unpack("QQi", data)
-        except (struct.error, TypeError):
-            pos_id, dummy, lsequence, points = data
+        pos_id, dummy, lsequence, points = unpack_index_entry(
+            self.mIndex[contig])
 
         pos_seq = dummy
         block_size = dummy
@@ -903,7 +1086,7 @@ class cgatIndexedFasta:
         if self.mNoSeek:
             # read directly from position
             p.fromstring(
-                self.mDatabaseFile.read(block_size, data[3],
+                self.mDatabaseFile.read(block_size, points,
                                         first_pos, last_pos))
         else:
             first_pos += pos_seq
@@ -938,11 +1121,8 @@ class cgatIndexedFasta:
 
         token = random.choice(list(self.mIndex.keys()))
         strand = random.choice(("+", "-"))
-        data = self.mIndex[token]
-        try:
-            pos_id, pos_seq, lcontig = struct.unpack("QQi", data)
-        except (struct.error, TypeError):
-            pos_id, pos_seq, lcontig, points = data
+        pos_id, pos_seq, lcontig, points = unpack_index_entry(
+            self.mIndex[token])
 
         start, end = 0, 0
         if size >= lcontig:
@@ -1021,11 +1201,8 @@ class PysamIndexedFasta(cgatIndexedFasta):
 
         contig = self.getToken(contig)
 
-        data = self.mIndex[contig]
-        try:
-            pos_id, pos_seq, lsequence = struct.unpack("QQi", data)
-        except struct.error:
-            pos_id, pos_seq, lsequence, points = data
+        pos_id, pos_seq, lsequence, points = unpack_index_entry(
+            self.mIndex[contig])
 
         # convert to 0-based positive strand coordinates
         if converter:
@@ -1057,6 +1234,98 @@ class PysamIndexedFasta(cgatIndexedFasta):
         return sequence
 
 
+class SequenceCache:
+
+    """cache sequence of a region of an indexed fasta file.
+
+    The cache wraps an :class:`IndexedFasta` object. After a
+    region has been set with :meth:`setRegion`, the first request
+    for sequence within the region fetches the complete region
+    from *fasta*. Subsequent requests within the region on the
+    same strand are sliced from the cached sequence. Setting a new
+    region evicts the cache.
+
+    Requests outside the region, requests using a converter or
+    a translator and regions longer than *max_size* are passed
+    on to *fasta*. All other methods are passed on to *fasta*
+    as well.
+    """
+
+    def __init__(self, fasta, max_size=10000000):
+        self.fasta = fasta
+        self.max_size = max_size
+        self.region = None
+        self.sequences = {}
+        self.nhits = 0
+        self.nmisses = 0
+
+    def __getattr__(self, key):
+        return getattr(self.fasta, key)
+
+    def __contains__(self, contig):
+        return contig in self.fasta
+
+    def __len__(self):
+        return len(self.fasta)
+
+    def __getitem__(self, key):
+        return self.fasta[key]
+
+    def setRegion(self, contig, start, end):
+        """set region to *contig*:*start*-*end* and evict the cache."""
+        self.region = None
+        self.sequences = {}
+        if end - start > self.max_size:
+            return
+        try:
+            self.region = (self.fasta.getToken(contig), start, end)
+        except KeyError:
+            pass
+
+    def getSequence(self,
+                    contig,
+                    strand="+",
+                    start=0,
+                    end=0,
+                    converter=None,
+                    as_array=False):
+        """get a genomic fragment.
+
+        See :meth:`cgatIndexedFasta.getSequence`.
+        """
+
+        if self.region is None or converter or as_array or \
+           self.fasta.mConverter or self.fasta.mTranslator:
+            return self.fasta.getSequence(
+                contig, strand, start, end, converter, as_array)
+
+        region_contig, region_start, region_end = self.region
+        if contig != region_contig or not \
+           region_start <= start < end <= region_end:
+            self.nmisses += 1
+            return self.fasta.getSequence(contig, strand, start, end)
+
+        # slicing is applied in the coordinates of the request, thus
+        # negative strand sequence is cached separately.
+        is_negative = str(strand) in ("-", "0", "-1")
+        try:
+            sequence = self.sequences[is_negative]
+        except KeyError:
+            try:
+                sequence = self.fasta.getSequence(
+                    contig, strand, region_start, region_end)
+            except (ValueError, KeyError):
+                sequence = None
+            self.sequences[is_negative] = sequence
+
+        if sequence is None:
+            self.nmisses += 1
+            return self.fasta.getSequence(contig, strand, start, end)
+
+        self.nhits += 1
+        return sequence[start - region_start:end - region_start]
+
+
 def IndexedFasta(dbname, *args, **kwargs):
     '''factory function for IndexedFasta objects.'''
 
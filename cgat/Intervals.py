@@ -244,9 +244,29 @@ def calculateOverlap(intervals1, intervals2):
     if not intervals1 or not intervals2:
         return 0
 
+    intervals1.sort()
+    intervals2.sort()
+
+    # inlined version of joined_iterator
     overlap = 0
-    for start, end in joined_iterator(intervals1, intervals2):
-        overlap += end - start
+    x, y = 0, 0
+    nx, ny = len(intervals1), len(intervals2)
+    while x < nx and y < ny:
+        xfrom, xto = intervals1[x]
+        yfrom, yto = intervals2[y]
+        if xto <= yfrom:
+            x += 1
+        elif yto <= xfrom:
+            y += 1
+        else:
+            overlap += min(xto, yto) - max(xfrom, yfrom)
+            if xto < yto:
+                x += 1
+            elif yto < xto:
+                y += 1
+            else:
+                x += 1
+                y += 1
 
     return overlap
 
@@ -1,3 +1,77 @@
+'''LCA.py - parse output of lcamapper
+===================================
+
+This module parses the output of the lowest common ancestor (LCA)
+mapping in mtools lcamapper.sh. Each line contains the read
+identifier followed by ``[level] taxon; score;`` entries.
+
+Eukaryotes have a lot of sub-taxa e.g. Phylum+++++++. Superkingdom
+is taken as the domain and then kingdom and so on. Only up to two
+sub-levels per global level are considered, see :data:`LEVELS`.
+
+There are two ways to access the taxonomy of a read:
+
+1. :func:`iterate` returns an :class:`LCA` object for each read
+   with one attribute for each level.
+
+2. :func:`iterate_blocks` encodes taxon names as integer codes in
+   a :class:`TaxonDictionary` and returns the taxonomy of blocks
+   of reads as integer arrays with one column per level. These
+   arrays can be summarised with numpy, see :func:`count_taxa`.
+
+Reference
+---------
+
+'''
+
+import numpy
+
+# taxonomic levels in lcamapper output that are recognized
+LEVELS = ("SuperKingdom", "SuperKingdom+", "SuperKingdom++",
+          "Kingdom", "Kingdom+", "Kingdom++",
+          "Phylum", "Phylum+", "Phylum++",
+          "Class", "Class+", "Class++",
+          "Order", "Order+", "Order++",
+          "Family", "Family+", "Family++",
+          "Genus", "Genus+", "Genus++",
+          "Species", "Species+", "Species++")
+
+# attribute of an LCA object for each level
+ATTRIBUTES = ("domain", "superkingdom_plus", "superkingdom_plus_plus",
+              "kingdom", "kingdom_plus", "kingdom_plus_plus",
+              "phylum", "phylum_plus", "phylum_plus_plus",
+              "_class", "_class_plus", "_class_plus_plus",
+              "order", "order_plus", "order_plus_plus",
+              "family", "family_plus", "family_plus_plus",
+              "genus", "genus_plus", "genus_plus_plus",
+              "species", "species_plus", "species_plus_plus")
+
+# map of level name to column
+LEVEL_INDEX = dict((y, x) for x, y in enumerate(LEVELS))
+
+# value for levels without assignment
+MISSING = "NA"
+
+
+def parse_taxa(line):
+    '''parse a line of lcamapper output.
+
+    returns a tuple of the identifier and a list of tuples
+    (column, taxon) for each recognized level. Spaces in taxon names
+    are replaced by underscores.
+    '''
+    data = line.split(";")
+    taxa = []
+    for entry in data[2:]:
+        # ignore root and scores
+        if "[" not in entry or "[root" in entry:
+            continue
+        fields = entry.strip().split(" ")
+        column = LEVEL_INDEX.get(fields[0].replace("[", "").replace("]", ""))
+        if column is None:
+            continue
+        taxa.append((column, "_".join(fields[1:])))
+    return data[0], taxa
 
 
 class LCA(object):
@@ -8,166 +82,122 @@ class LCA(object):
     def __init__(self):
 
         self.identifier = None
-        self.domain = None
-        self.superkingdom_plus = None
-        self.superkingdom_plus_plus = None
-        self.kingdom = None
-        self.kingdom_plus = None
-        self.kingdom_plus_plus = None
-        self.phylum = None
-        self.phylum_plus = None
-        self.phylum_plus_plus = None
-        self._class = None
-        self._class_plus = None
-        self._class_plus_plus = None
-        self.order = None
-        self.order_plus = None
-        self.order_plus_plus = None
-        self.family = None
-        self.family_plus = None
-        self.family_plus_plus = None
-        self.genus = None
-        self.genus_plus = None
-        self.genus_plus_plus = None
-        self.species = None
-        self.species_plus = None
-        self.species_plus_plus = None
+        for attribute in ATTRIBUTES:
+            setattr(self, attribute, None)
         self.level = None
 
     def parse(self, line):
         '''
         parse the line
         '''
-        data = line.split(";")
-        self.identifier = data[0]
-        for taxa in data[2:]:
-            taxa = taxa.strip()
-            # ignore root
-            if "[root" in taxa:
-                continue
-            if "[" not in taxa:
-                continue
-            taxa = taxa.split(" ")
-
-            level, tax = taxa[0], taxa[1:]
-            level = level.replace("[", "").replace("]", "")
-
-            if len(tax) > 1:
-                tax = "_".join(tax)
-            else:
-                tax = tax[0]
-
-            # Eukaryotes have a lot of sub-taxa e.g. Phylum+++++++.
-            # Superkingdom is taken as the Domain and then kingdom
-            # and so on. At the moment we are only going to consider
-            # up to two sub-levels per global level
-            if level == "SuperKingdom":
-                self.domain = tax
-            elif level == "SuperKingdom+":
-                self.superkingdom_plus = tax
-            elif level == "SuperKingdom++":
-                self.superkingdom_plus_plus = tax
-            elif level == "Kingdom":
-                self.kingdom = tax
-            elif level == "Kingdom+":
-                self.kingdom_plus = tax
-            elif level == "Kingdom++":
-                self.kingdom_plus_plus = tax
-            elif level == "Phylum":
-                self.phylum = tax
-            elif level == "Phylum+":
-                self.phylum_plus = tax
-            elif level == "Phylum++":
-                self.phylum_plus_plus = tax
-            elif level == "Class":
-                self._class = tax
-            elif level == "Class+":
-                self._class_plus = tax
-            elif level == "Class++":
-                self._class_plus_plus = tax
-            elif level == "Order":
-                self.order = tax
-            elif level == "Order+":
-                self.order_plus = tax
-            elif level == "Order++":
-                self.order_plus_plus = tax
-            elif level == "Family":
-                self.family = tax
-            elif level == "Family+":
-                self.family_plus = tax
-            elif level == "Family++":
-                self.family_plus_plus = tax
-            elif level == "Genus":
-                self.genus = tax
-            elif level == "Genus+":
-                self.genus_plus = tax
-            elif level == "Genus++":
-                self.genus_plus_plus = tax
-            elif level == "Species":
-                self.species = tax
-            elif level == "Species+":
-                self.species_plus = tax
-            elif level == "Species++":
-                self.species_plus_plus = tax
-
-        # make NA id doesn't exist in taxonomy
-        if not self.domain:
-            self.domain = "NA"
-        if not self.superkingdom_plus:
-            self.superkingdom_plus = "NA"
-        if not self.superkingdom_plus_plus:
-            self.superkingdom_plus_plus = "NA"
-        if not self.kingdom:
-            self.kingdom = "NA"
-        if not self.kingdom_plus:
-            self.kingdom_plus = "NA"
-        if not self.kingdom_plus_plus:
-            self.kingdom_plus_plus = "NA"
-        if not self.phylum:
-            self.phylum = "NA"
-        if not self.phylum_plus:
-            self.phylum_plus = "NA"
-        if not self.phylum_plus_plus:
-            self.phylum_plus_plus = "NA"
-        if not self._class:
-            self._class = "NA"
-        if not self._class_plus:
-            self._class_plus = "NA"
-        if not self._class_plus_plus:
-            self._class_plus_plus = "NA"
-        if not self.order:
-            self.order = "NA"
-        if not self.order_plus:
-            self.order_plus = "NA"
-        if not self.order_plus_plus:
-            self.order_plus_plus = "NA"
-        if not self.family:
-            self.family = "NA"
-        if not self.family_plus:
-            self.family_plus = "NA"
-        if not self.family_plus_plus:
-            self.family_plus_plus = "NA"
-        if not self.genus:
-            self.genus = "NA"
-        if not self.genus_plus:
-            self.genus_plus = "NA"
-        if not self.genus_plus_plus:
-            self.genus_plus_plus = "NA"
-        if not self.species:
-            self.species = "NA"
-        if not self.species_plus:
-            self.species_plus = "NA"
-        if not self.species_plus_plus:
-            self.species_plus_plus = "NA"
-
+        self.identifier, taxa = parse_taxa(line)
+        values = [MISSING] * len(LEVELS)
+        for column, taxon in taxa:
+            # make NA if doesn't exist in taxonomy
+            values[column] = taxon or MISSING
+        for attribute, value in zip(ATTRIBUTES, values):
+            setattr(self, attribute, value)
         return self
 
 
+class TaxonDictionary(object):
+    '''intern taxon names as integer codes.
+
+    Code 0 is reserved for missing assignments. A single dictionary
+    can be shared between samples so that codes are comparable.
+    '''
+
+    def __init__(self):
+        self.names = [MISSING]
+        self.codes = {MISSING: 0, "": 0}
+
+    def __len__(self):
+        return len(self.names)
+
+    def encode(self, name):
+        '''return code for taxon *name*, adding it if necessary.'''
+        try:
+            return self.codes[name]
+        except KeyError:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+            return code
+
+    def decode(self, code):
+        '''return name of taxon with *code*.'''
+        return self.names[code]
+
+
 def iterate(infile):
     '''
     LCA results iterator
     '''
-    for line in infile.readlines():
+    for line in infile:
         lca = LCA()
         lca = lca.parse(line)
         yield lca
+
+
+def iterate_blocks(infile, taxa, block_size=100000):
+    '''iterate over lcamapper output in *infile* in blocks of
+    *block_size* reads.
+
+    Taxon names are encoded with the :class:`TaxonDictionary`
+    *taxa*.
+
+    returns tuples of a list of identifiers and an integer array of
+    shape (number of reads, number of levels) with the taxon codes
+    of each read.
+    '''
+    encode = taxa.encode
+    width = len(LEVELS)
+    identifiers, rows = [], []
+    for line in infile:
+        identifier, assigned = parse_taxa(line)
+        row = [0] * width
+        for column, taxon in assigned:
+            row[column] = encode(taxon)
+        identifiers.append(identifier)
+        rows.extend(row)
+        if len(identifiers) == block_size:
+            yield identifiers, numpy.array(
+                rows, dtype=numpy.int64).reshape(-1, width)
+            identifiers, rows = [], []
+
+    if identifiers:
+        yield identifiers, numpy.array(
+            rows, dtype=numpy.int64).reshape(-1, width)
+
+
+def count_taxa(infile, taxa, levels=LEVELS, block_size=100000):
+    '''count reads per taxon in lcamapper output in *infile*.
+
+    Taxon names are encoded with the :class:`TaxonDictionary`
+    *taxa*. Counts are collected for each level in *levels*.
+
+    returns a tuple of the number of reads and an array of counts of
+    shape (number of levels, number of taxa). Reads without an
+    assignment at a level are counted in column 0.
+    '''
+    columns = [LEVEL_INDEX[x] for x in levels]
+    counts = numpy.zeros((len(columns), len(taxa)), dtype=numpy.int64)
+    nreads = 0
+    for identifiers, block in iterate_blocks(infile, taxa, block_size):
+        nreads += len(block)
+        ntaxa = len(taxa)
+        if counts.shape[1] < ntaxa:
+            counts = resize_counts(counts, ntaxa)
+        # count all levels with a single bincount by offsetting
+        # the codes of each level
+        codes = block[:, columns] + numpy.arange(len(columns)) * ntaxa
+        counts += numpy.bincount(
+            codes.ravel(),
+            minlength=len(columns) * ntaxa).reshape(len(columns), ntaxa)
+    return nreads, counts
+
+
+def resize_counts(counts, ntaxa):
+    '''pad *counts* with zeros to *ntaxa* columns.'''
+    result = numpy.zeros((counts.shape[0], ntaxa), dtype=counts.dtype)
+    result[:, :counts.shape[1]] = counts
+    return result
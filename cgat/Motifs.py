@@ -9,6 +9,7 @@ Code
 
 '''
 import collections
+import numpy
 from cgat import Genomics as Genomics
 from cgat import FastaIterator as FastaIterator
 
@@ -104,3 +105,180 @@ def regex2iupac(pattern):
     for x in _split(pattern):
         a.append(regexdict[x])
     return "".join(a)
+
+
+# complement of IUPAC codes
+iupac_complement = {
+    'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A',
+    'M': 'K', 'R': 'Y', 'W': 'W', 'S': 'S', 'Y': 'R', 'K': 'M',
+    'V': 'B', 'H': 'D', 'D': 'H', 'B': 'V',
+    'X': 'X', 'N': 'N'}
+
+
+def reverse_complement_iupac(pattern):
+    '''return reverse complement of iupac *pattern*.'''
+    return "".join(iupac_complement[x] for x in reversed(pattern.upper()))
+
+
+def read_motifs(infile):
+    '''read motifs from *infile*.
+
+    Each line contains a motif name and an iupac pattern separated by
+    a tab. If there is only a single column, the pattern is used as
+    the name. Empty lines and lines starting with ``#`` are ignored.
+
+    returns a list of tuples (name, pattern).
+    '''
+    motifs = []
+    for line in infile:
+        if line.startswith("#") or not line.strip():
+            continue
+        fields = line.strip().split("\t")
+        if len(fields) == 1:
+            motifs.append((fields[0], fields[0]))
+        else:
+            motifs.append((fields[0], fields[1]))
+    return motifs
+
+
+class MotifScanner(object):
+    '''count occurrences of a set of iupac *motifs* in sequences.
+
+    *motifs* is a list of tuples (name, pattern). The motifs are
+    compiled into tables of bit masks, one for each motif position
+    and nucleotide, with one bit per motif. A position in a sequence
+    matches a motif if the bit of the motif is set in the masks of
+    all subsequent characters. The masks of blocks of four positions
+    are combined so that a single lookup checks four characters.
+    Sequences are scanned for up to 64 motifs at a time.
+
+    If *both_strands* is set, the reverse complement of each motif is
+    scanned as well and matches on either strand are counted. Motifs
+    that are their own reverse complement are counted once.
+
+    Matching is case-insensitive. Ambiguous characters in sequences
+    do not match any motif.
+    '''
+
+    def __init__(self, motifs, both_strands=True):
+
+        self.names = [x[0] for x in motifs]
+        if not self.names:
+            raise ValueError("no motifs given")
+
+        patterns, motif_index = [], []
+        for index, (name, pattern) in enumerate(motifs):
+            pattern = pattern.upper()
+            if not pattern:
+                raise ValueError("empty pattern for motif %s" % name)
+            invalid = set(pattern).difference(iupacdict)
+            if invalid:
+                raise ValueError(
+                    "motif %s contains invalid characters: %s" %
+                    (name, "".join(sorted(invalid))))
+            patterns.append(pattern)
+            motif_index.append(index)
+            if both_strands:
+                reverse = reverse_complement_iupac(pattern)
+                if reverse != pattern:
+                    patterns.append(reverse)
+                    motif_index.append(index)
+
+        self.patterns = patterns
+        self.motif_index = numpy.array(motif_index, dtype=numpy.int64)
+        self.max_length = max(len(x) for x in patterns)
+        nwords = (len(patterns) + 63) // 64
+
+        # map characters to codes, 4 is any other character
+        self.lookup = numpy.empty(256, dtype=numpy.uint8)
+        self.lookup.fill(4)
+        for code, c in enumerate("ACGT"):
+            self.lookup[ord(c)] = code
+            self.lookup[ord(c.lower())] = code
+
+        # masks[word, position, code]
+        masks = numpy.zeros((nwords, self.max_length, 5),
+                            dtype=numpy.uint64)
+        for x, pattern in enumerate(patterns):
+            word, bit = divmod(x, 64)
+            bit = numpy.uint64(1) << numpy.uint64(bit)
+            for position in range(self.max_length):
+                if position < len(pattern):
+                    codes = ["ACGT".index(c)
+                             for c in iupacdict[pattern[position]]]
+                else:
+                    # shorter patterns accept any character
+                    codes = list(range(5))
+                masks[word, position, codes] |= bit
+
+        # combine the masks of blocks of consecutive positions so
+        # that a single table lookup checks several characters.
+        # block_masks[word, block, code of block]
+        self.block_size = min(self.max_length, 4)
+        nblocks = (self.max_length + self.block_size - 1) // self.block_size
+        self.block_masks = numpy.empty(
+            (nwords, nblocks, 5 ** self.block_size), dtype=numpy.uint64)
+        self.block_masks.fill(numpy.iinfo(numpy.uint64).max)
+        for block in range(nblocks):
+            for offset in range(self.block_size):
+                position = block * self.block_size + offset
+                if position >= self.max_length:
+                    break
+                # code of character at offset within the block code
+                code = (numpy.arange(5 ** self.block_size) //
+                        5 ** (self.block_size - offset - 1)) % 5
+                self.block_masks[:, block] &= masks[:, position, code]
+
+    def count(self, sequences):
+        '''count motifs in *sequences*.
+
+        returns a matrix of counts with a row for each sequence and a
+        column for each motif.
+        '''
+        counts = numpy.zeros((len(sequences), len(self.names)),
+                             dtype=numpy.int64)
+        if len(sequences) == 0:
+            return counts
+
+        # concatenate sequences, separated by a character that
+        # does not match, and pad the end
+        nblocks = self.block_masks.shape[1]
+        padding = nblocks * self.block_size
+        buf = "\x00".join(sequences) + "\x00" * padding
+        codes = self.lookup[numpy.frombuffer(
+            buf.encode("ascii", "replace"), dtype=numpy.uint8)]
+        starts = numpy.zeros(len(sequences), dtype=numpy.int64)
+        starts[1:] = numpy.cumsum([len(x) + 1 for x in sequences[:-1]])
+        npositions = len(codes) - padding
+
+        # code of the block of characters starting at each position
+        ncodes = len(codes) - self.block_size + 1
+        block_codes = numpy.zeros(ncodes, dtype=numpy.int64)
+        for offset in range(self.block_size):
+            block_codes *= 5
+            block_codes += codes[offset:offset + ncodes]
+
+        for word, masks in enumerate(self.block_masks):
+            matches = masks[0][block_codes[:npositions]]
+            for block in range(1, nblocks):
+                start = block * self.block_size
+                matches &= masks[block][
+                    block_codes[start:start + npositions]]
+
+            positions = numpy.flatnonzero(matches)
+            if len(positions) == 0:
+                continue
+
+            # expand the bits of matching positions to pattern indices
+            bits = numpy.unpackbits(
+                matches[positions].astype("<u8").view(numpy.uint8),
+                bitorder="little").reshape(len(positions), 64)
+            rows, columns = numpy.nonzero(bits)
+            sequence_index = numpy.searchsorted(
+                starts, positions[rows], side="right") - 1
+            motif_index = self.motif_index[word * 64 + columns]
+            counts += numpy.bincount(
+                sequence_index * len(self.names) + motif_index,
+                minlength=counts.size).reshape(counts.shape)
+
+        return counts
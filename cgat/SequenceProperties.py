@@ -42,6 +42,7 @@ import math
 import hashlib
 import base64
 import itertools
+import numpy
 import six
 
 from cgat import Genomics as Genomics
@@ -49,6 +50,48 @@ from cgat import Genomics as Genomics
 import Bio.Alphabet.IUPAC
 
 
+def as_array(sequence):
+    '''return *sequence* as an array of bytes.
+
+    *sequence* can be a string, bytes or a numpy array of bytes.
+    Characters that are not ASCII are replaced with ``?``.
+    '''
+    if isinstance(sequence, numpy.ndarray):
+        return sequence.view(numpy.uint8)
+    if isinstance(sequence, str):
+        sequence = sequence.encode("ascii", "replace")
+    return numpy.frombuffer(sequence, dtype=numpy.uint8)
+
+
+def build_lookup(alphabet):
+    '''return a table mapping each byte to its index in *alphabet*.
+
+    Bytes not in *alphabet* map to ``len(alphabet)``.
+    '''
+    lookup = numpy.empty(256, dtype=numpy.int64)
+    lookup.fill(len(alphabet))
+    for x, c in enumerate(alphabet):
+        lookup[ord(c)] = x
+    return lookup
+
+
+def count_dinucleotides(sequence, alphabet="ACGT"):
+    '''count overlapping dinucleotides in *sequence*.
+
+    Counting is case-sensitive.
+
+    returns a matrix of counts of dimension ``len(alphabet)`` x
+    ``len(alphabet)``. Rows are the first, columns the second
+    character of a dinucleotide. Dinucleotides with characters
+    outside of *alphabet* are not counted.
+    '''
+    n = len(alphabet) + 1
+    codes = build_lookup(alphabet)[as_array(sequence)]
+    counts = numpy.bincount(codes[:-1] * n + codes[1:],
+                            minlength=n * n).reshape(n, n)
+    return counts[:-1, :-1]
+
+
 class SequenceProperties(object):
     """Base class.
 
@@ -239,19 +282,14 @@ class SequencePropertiesNA(SequenceProperties):
         """load sequence properties from a sequence."""
         SequenceProperties.loadSequence(self, sequence, seqtype)
         # counts of nucleotides
+        sequence = sequence.upper()
         self.mCountsNA = {}
         for x in self.mAlphabet:
-            self.mCountsNA[x] = 0
+            self.mCountsNA[x] = sequence.count(x)
 
-        for na in sequence.upper():
-            if na in ('G', 'C'):
-                self.mCountsGC += 1
-            elif na in ('A', 'T'):
-                self.mCountsAT += 1
-            try:
-                self.mCountsNA[na] += 1
-            except KeyError:
-                self.mCountsOthers += 1
+        self.mCountsGC += self.mCountsNA["G"] + self.mCountsNA["C"]
+        self.mCountsAT += self.mCountsNA["A"] + self.mCountsNA["T"]
+        self.mCountsOthers += len(sequence) - sum(self.mCountsNA.values())
 
     def getFields(self):
         fields = SequenceProperties.getFields(self)
@@ -327,14 +365,11 @@ class SequencePropertiesDN(SequenceProperties):
         """load sequence properties from a sequence."""
         SequenceProperties.loadSequence(self, sequence, seqtype)
 
-        # IMS: generator rather than list
-        # to save memory for might be a neater way of doing this.
-        for dinuc in (sequence[x - 2:x]
-                      for x in range(2, len(sequence) + 1, 1)):
-            try:
-                self.mCountsDinuc[dinuc] += 1
-            except KeyError:
-                self.mCountsOthers += 1
+        counts = count_dinucleotides(sequence, self.mAlphabet)
+        for x, y in itertools.product(range(len(self.mAlphabet)), repeat=2):
+            self.mCountsDinuc[self.mAlphabet[x] + self.mAlphabet[y]] += \
+                int(counts[x, y])
+        self.mCountsOthers += max(0, len(sequence) - 1) - int(counts.sum())
 
     def getFields(self):
 
@@ -476,6 +476,62 @@ class Summary(Result):
                           ))
 
 
+def _iterateChunks(values, chunk_size):
+    """iterate over slices of *values* with at most *chunk_size* elements.
+
+    If *chunk_size* is None, the whole array is returned as a single
+    chunk.
+    """
+    if chunk_size is None:
+        yield values
+    else:
+        for start in range(0, len(values), chunk_size):
+            yield values[start:start + chunk_size]
+
+
+def estimatePi0(sorted_pvalues, vlambda):
+    """estimate the proportion of true null hypotheses.
+
+    The estimate for each threshold lambda is the fraction of
+    p-values >= lambda divided by 1 - lambda. *sorted_pvalues*
+    need to be sorted in ascending order so that all thresholds
+    can be evaluated with a single call to numpy.searchsorted.
+
+    Returns an array with an estimate for each value in *vlambda*.
+    """
+    vlambda = numpy.asarray(vlambda, dtype=numpy.float64)
+    m = len(sorted_pvalues)
+    nlarger = m - numpy.searchsorted(sorted_pvalues, vlambda, side="left")
+    return nlarger / float(m) / (1.0 - vlambda)
+
+
+def getQValues(sorted_pvalues, pi0, robust=False):
+    """compute q-values for p-values sorted in ascending order.
+
+    Each q-value is pi0 * m * p / v, where v is the number of
+    p-values less than or equal to p. The q-values are bounded
+    by 1 and made monotonic by a cumulative minimum from the
+    largest p-value downwards.
+
+    Returns an array of q-values in the order of *sorted_pvalues*.
+    Tied p-values receive the same q-value, so that the q-value of
+    any p-value can be looked up with numpy.searchsorted.
+    """
+    m = len(sorted_pvalues)
+
+    # number of observations less than or equal to each p-value
+    v = numpy.searchsorted(sorted_pvalues, sorted_pvalues, side="right")
+
+    qvalues = sorted_pvalues * float(pi0) * m
+    qvalues /= v
+    if robust:
+        qvalues /= (1.0 - (1.0 - sorted_pvalues) ** m)
+
+    # bound qvalues by 1 and make them monotonic
+    qvalues = numpy.minimum.accumulate(qvalues[::-1])[::-1]
+    return numpy.minimum(qvalues, 1.0, out=qvalues)
+
+
 def doFDRPython(pvalues,
                 vlambda=None,
                 pi0_method="smoother",
@@ -484,7 +540,9 @@ def doFDRPython(pvalues,
                 smooth_df=3,
                 smooth_log_pi0=False,
                 pi0=None,
-                plot=False):
+                plot=False,
+                dtype=numpy.float64,
+                chunk_size=None):
     """modeled after code taken from
     http://genomics.princeton.edu/storeylab/qvalue/linux.html.
 
@@ -492,17 +550,34 @@ def doFDRPython(pvalues,
 
     Compute FDR after method by Storey et al. (2002).
 
-    """
+    The p-values are sorted once and all further computations
+    work on the sorted array. Set *dtype* to numpy.float32 to
+    halve the memory requirements for large numbers of p-values.
 
-    if min(pvalues) < 0 or max(pvalues) > 1:
-        raise ValueError("p-values out of range")
+    If *chunk_size* is given, *pvalues* are read in chunks, for
+    example from a numpy.memmap, and only the sorted p-values and
+    the q-values are held in memory.
+    """
 
     # set to default of qvalue method
     if vlambda is None:
         vlambda = numpy.arange(0, 0.95, 0.05)
 
     m = len(pvalues)
-    pvalues = numpy.array(pvalues, dtype=numpy.float)
+    if chunk_size is None:
+        pvalues = numpy.array(pvalues, dtype=dtype)
+        idx = numpy.argsort(pvalues)
+        sorted_pvalues = pvalues[idx]
+    else:
+        sorted_pvalues = numpy.empty(m, dtype=dtype)
+        x = 0
+        for chunk in _iterateChunks(pvalues, chunk_size):
+            sorted_pvalues[x:x + len(chunk)] = chunk
+            x += len(chunk)
+        sorted_pvalues.sort()
+
+    if sorted_pvalues[0] < 0 or sorted_pvalues[-1] > 1:
+        raise ValueError("p-values out of range")
 
     if pi0 is None:
         if type(vlambda) == float:
@@ -521,20 +596,16 @@ def doFDRPython(pvalues,
             if vlambda < 0 or vlambda >= 1:
                 raise ValueError("vlambda must be within [0, 1).")
 
-            pi0 = numpy.mean([x >= vlambda for x in pvalues]) / (1.0 - vlambda)
+            pi0 = float(estimatePi0(sorted_pvalues, vlambda))
             pi0 = min(pi0, 1.0)
         else:
 
-            pi0 = numpy.zeros(len(vlambda), numpy.float)
-
-            for i in range(len(vlambda)):
-                pi0[i] = numpy.mean([x >= vlambda[i]
-                                     for x in pvalues]) / (1.0 - vlambda[i])
+            pi0 = estimatePi0(sorted_pvalues, vlambda)
 
             if pi0_method == "smoother":
 
                 if smooth_log_pi0:
-                    pi0 = math.log(pi0)
+                    pi0 = numpy.log(pi0)
 
                 tck = scipy.interpolate.splrep(vlambda,
                                                pi0,
@@ -558,18 +629,25 @@ def doFDRPython(pvalues,
 
                 minpi0 = min(pi0)
 
-                mse = numpy.zeros(len(vlambda), numpy.float)
-                pi0_boot = numpy.zeros(len(vlambda), numpy.float)
+                mse = numpy.zeros(len(vlambda), numpy.float64)
+
+                # The number of p-values of a bootstrap sample that fall
+                # between successive lambdas is multinomially distributed,
+                # so samples can be drawn without resampling p-values.
+                vlambda = numpy.asarray(vlambda, dtype=numpy.float64)
+                order = numpy.argsort(vlambda)
+                bounds = numpy.searchsorted(sorted_pvalues, vlambda[order],
+                                            side="right")
+                counts = numpy.diff(numpy.concatenate(([0], bounds, [m])))
+                fractions = counts / float(m)
+                nlarger = numpy.zeros(len(vlambda), numpy.int64)
 
                 for i in range(100):
                     # sample pvalues
-                    idx_boot = numpy.random.random_integers(0, m - 1, m)
-                    pvalues_boot = pvalues[idx_boot]
-
-                    for x in range(len(vlambda)):
-                        # compute number of pvalues larger than lambda[x]
-                        pi0_boot[x] = numpy.mean(
-                            pvalues_boot > vlambda[x]) / (1.0 - vlambda[x])
+                    counts_boot = numpy.random.multinomial(m, fractions)
+                    # compute number of pvalues larger than lambda[x]
+                    nlarger[order] = numpy.cumsum(counts_boot[::-1])[::-1][1:]
+                    pi0_boot = nlarger / float(m) / (1.0 - vlambda)
                     mse += (pi0_boot - minpi0) ** 2
                 pi0 = min(pi0[mse == min(mse)])
             else:
@@ -586,39 +664,31 @@ def doFDRPython(pvalues,
     if fdr_level is not None and (fdr_level <= 0 or fdr_level > 1):
         raise ValueError("'fdr_level' must be within (0, 1].")
 
-    # compute qvalues
-    idx = numpy.argsort(pvalues)
-    # monotonically decreasing bins, so that bins[i-1] > x >=  bins[i]
-    bins = numpy.unique(pvalues)[::-1]
-
-    # v[i] = number of observations less than or equal to pvalue[i]
-    # could this be done more elegantly?
-    val2bin = len(bins) - numpy.digitize(pvalues, bins)
-    v = numpy.zeros(m, dtype=numpy.int)
-    lastbin = None
-    for x in range(m - 1, -1, -1):
-        bin = val2bin[idx[x]]
-        if bin != lastbin:
-            c = x
-        v[idx[x]] = c + 1
-        lastbin = bin
-
-    qvalues = pvalues * pi0 * m / v
-    if robust:
-        qvalues /= (1.0 - (1.0 - pvalues) ** m)
-
-    # bound qvalues by 1 and make them monotonic
-    qvalues[idx[m - 1]] = min(qvalues[idx[m - 1]], 1.0)
-    for i in range(m - 2, -1, -1):
-        qvalues[idx[i]] = min(min(qvalues[idx[i]], qvalues[idx[i + 1]]), 1.0)
+    # compute qvalues on sorted p-values and map them back
+    # to input order
+    sorted_qvalues = getQValues(sorted_pvalues, pi0, robust=robust)
+    qvalues = numpy.empty(m, dtype=sorted_qvalues.dtype)
+    if chunk_size is None:
+        qvalues[idx] = sorted_qvalues
+    else:
+        # look up q-values by p-value, sorting each chunk first
+        # to speed up the binary search
+        x = 0
+        for chunk in _iterateChunks(pvalues, chunk_size):
+            chunk = numpy.asarray(chunk, dtype=dtype)
+            order = numpy.argsort(chunk)
+            pos = numpy.searchsorted(sorted_pvalues, chunk[order],
+                                     side="right") - 1
+            qvalues[x + order] = sorted_qvalues[pos]
+            x += len(chunk)
 
     result = FDRResult()
     result.mQValues = qvalues
 
     if fdr_level is not None:
-        result.mPassed = [x <= fdr_level for x in result.mQValues]
+        result.mPassed = qvalues <= fdr_level
     else:
-        result.mPassed = [False for x in result.mQValues]
+        result.mPassed = numpy.zeros(m, dtype=bool)
 
     result.mPValues = pvalues
     result.mPi0 = pi0
@@ -674,7 +744,7 @@ class CorrelationTest:
 
 
 def filterMasked(xvals, yvals, missing=("na", "Nan", None, ""),
-                 dtype=numpy.float):
+                 dtype=numpy.float64):
     """convert xvals and yvals to numpy array skipping pairs with
     one or more missing values."""
     xmask = [i in missing for i in xvals]
@@ -1017,7 +1087,7 @@ def doMannWhitneyUTest(xvals, yvals):
     raise NotImplementedError()
 
 
-def adjustPValues(pvalues, method='fdr', n=None):
+def adjustPValues(pvalues, method='fdr', n=None, dtype=numpy.float64):
     '''returns an array of adjusted pvalues
 
     Reimplementation of p.adjust in the R package.
@@ -1030,6 +1100,12 @@ def adjustPValues(pvalues, method='fdr', n=None):
     n: number of comparisons, must be at least 'length(p)'; only set
     this (to non-default) when you know what you are doing
 
+    dtype: floating point type of the adjusted p-values. Set to
+    numpy.float32 to halve the memory requirements.
+
+    The p-values are sorted once and the adjusted values are
+    computed with cumulative minima/maxima over the sorted array.
+
     For more information, see the documentation of the
     p.adjust method in R.
     '''
@@ -1041,7 +1117,7 @@ def adjustPValues(pvalues, method='fdr', n=None):
         method = "BH"
 
     # optional, remove NA values
-    p = numpy.array(pvalues, dtype=numpy.float)
+    p = numpy.array(pvalues, dtype=dtype)
     lp = len(p)
 
     assert n <= lp
@@ -1053,11 +1129,10 @@ def adjustPValues(pvalues, method='fdr', n=None):
     if method == "bonferroni":
         p0 = n * p
     elif method == "holm":
-        i = numpy.arange(lp)
+        i = numpy.arange(lp, dtype=dtype)
         o = numpy.argsort(p)
-        ro = numpy.argsort(o)
-        m = numpy.maximum.accumulate((n - i) * p[o])
-        p0 = m[ro]
+        p0 = numpy.empty_like(p)
+        p0[o] = numpy.maximum.accumulate((n - i) * p[o])
     elif method == "hommel":
         raise NotImplementedError("hommel method not implemented")
     # if (n > lp) p <- c(p, rep.int(1, n - lp))
@@ -1076,29 +1151,23 @@ def adjustPValues(pvalues, method='fdr', n=None):
     #         pa <- pmax(pa, q)
     #     }
     #     pmax(pa, p)[if (lp < n) ro[1:lp] else ro]
-    elif method == "hochberg":
-        i = numpy.arange(0, lp)[::-1]
-        o = numpy.argsort(1 - p)
-        ro = numpy.argsort(o)
-        m = numpy.minimum.accumulate((n - i) * p[o])
-        p0 = m[ro]
-    elif method == "BH":
-        i = numpy.arange(1, lp + 1)[::-1]
-        o = numpy.argsort(1 - p)
-        ro = numpy.argsort(o)
-        m = numpy.minimum.accumulate(float(n) / i * p[o])
-        p0 = m[ro]
-    elif method == "BY":
-        i = numpy.arange(1, lp + 1)[::-1]
-        o = numpy.argsort(1 - p)
-        ro = numpy.argsort(o)
-        q = numpy.sum(1.0 / numpy.arange(1, n + 1))
-        m = numpy.minimum.accumulate(q * float(n) / i * p[o])
-        p0 = m[ro]
+    elif method in ("hochberg", "BH", "BY"):
+        # p-values in decreasing order
+        i = numpy.arange(lp, 0, -1, dtype=dtype)
+        o = numpy.argsort(p)[::-1]
+        if method == "hochberg":
+            m = numpy.minimum.accumulate((n - i + 1) * p[o])
+        elif method == "BH":
+            m = numpy.minimum.accumulate(float(n) / i * p[o])
+        else:
+            q = float(numpy.sum(1.0 / numpy.arange(1, n + 1)))
+            m = numpy.minimum.accumulate(q * float(n) / i * p[o])
+        p0 = numpy.empty_like(p)
+        p0[o] = m
     elif method == "none":
         p0 = p
 
-    return numpy.minimum(p0, numpy.ones(len(p0)))
+    return numpy.minimum(p0, 1.0)
 
 
 def savitzky_golay(y, window_size, order, deriv=0, rate=1):
@@ -1155,8 +1224,8 @@ def savitzky_golay(y, window_size, order, deriv=0, rate=1):
     """
 
     try:
-        window_size = numpy.abs(numpy.int(window_size))
-        order = numpy.abs(numpy.int(order))
+        window_size = numpy.abs(int(window_size))
+        order = numpy.abs(int(order))
     except ValueError:
         raise ValueError("window_size and order have to be of type int")
     if window_size % 2 != 1 or window_size < 1:
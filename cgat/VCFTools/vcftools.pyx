@@ -16,6 +16,7 @@ import collections
 import hashlib
 import itertools
 import math
+import multiprocessing
 import numpy
 import pandas
 import re
@@ -50,12 +51,94 @@ def generate_from_region(vcf_file, region):
 ACGT = str.maketrans("ACGT", "TGCA")
 
 
+cdef class ReferenceCache(object):
+    '''serve windows of a reference sequence from large chunks.
+
+    Sequence is fetched from *fasta* in chunks of at least
+    *chunk_size* bases and converted to upper case. Prefix sums of
+    G+C and A+T bases permit computing the base composition of a
+    window in constant time. The cache is efficient if windows are
+    requested in sorted order.
+    '''
+
+    cdef FastaFile fasta
+    cdef int chunk_size
+    cdef object contig
+    cdef int contig_length
+    cdef int start
+    cdef int end
+    cdef object sequence
+    cdef numpy.ndarray gc_prefix
+    cdef numpy.ndarray at_prefix
+
+    def __init__(self, FastaFile fasta, int chunk_size=1000000):
+        self.fasta = fasta
+        self.chunk_size = chunk_size
+        self.contig = None
+        self.contig_length = 0
+        self.start = 0
+        self.end = 0
+
+    cdef load(self, contig, int start, int end):
+        if contig != self.contig:
+            self.contig = contig
+            self.contig_length = self.fasta.get_reference_length(contig)
+
+        self.start = start
+        self.end = min(self.contig_length, max(end, start + self.chunk_size))
+        self.sequence = self.fasta.fetch(contig, self.start, self.end).upper()
+
+        bases = numpy.frombuffer(self.sequence.encode("ascii"),
+                                 dtype=numpy.uint8)
+        self.gc_prefix = numpy.zeros(len(bases) + 1, dtype=numpy.int64)
+        numpy.cumsum((bases == ord("G")) | (bases == ord("C")),
+                     out=self.gc_prefix[1:])
+        self.at_prefix = numpy.zeros(len(bases) + 1, dtype=numpy.int64)
+        numpy.cumsum((bases == ord("A")) | (bases == ord("T")),
+                     out=self.at_prefix[1:])
+
+    cdef bint update(self, contig, int start, int end):
+        '''make sure that *start* to *end* is in the cache.
+
+        return False if the region can not be cached.
+        '''
+        if start < 0:
+            return False
+        if contig != self.contig or start < self.start or \
+           min(end, self.contig_length) > self.end:
+            self.load(contig, start, end)
+        return True
+
+    def fetch(self, contig, int start, int end):
+        '''return upper case sequence of *contig* from *start* to *end*.'''
+        if not self.update(contig, start, end):
+            return self.fasta.fetch(contig, start, end).upper()
+        return self.sequence[start - self.start:end - self.start]
+
+    def composition(self, contig, int start, int end):
+        '''return the number of G+C and A+T bases in *contig*
+        from *start* to *end*.'''
+        if not self.update(contig, start, end):
+            counts = collections.Counter(self.fetch(contig, start, end))
+            return counts["G"] + counts["C"], counts["A"] + counts["T"]
+        cdef int x = start - self.start
+        cdef int y = min(end, self.end) - self.start
+        return (self.gc_prefix[y] - self.gc_prefix[x],
+                self.at_prefix[y] - self.at_prefix[x])
+
+
 cdef class Counter(object):
 
     cdef int nsamples
     cdef object samples
     cdef bint only_variant_positions
 
+    # buffers for bulk extraction of FORMAT fields
+    cdef int32_t * gt_ptr
+    cdef int gt_size
+    cdef int32_t * format_ptr
+    cdef int format_size
+
     def __init__(self, samples, only_variant_positions=False):
         self.nsamples = len(samples)
         self.samples = samples
@@ -64,25 +147,116 @@ cdef class Counter(object):
     cdef process_record(self, VariantRecord record, bint is_snp):
         raise NotImplementedError("base class must implement process_record")
 
+    def get_state(self):
+        '''return the accumulated counts as a tuple of numpy arrays.'''
+        raise NotImplementedError("base class must implement get_state")
+
+    def merge(self, other):
+        '''add the counts of *other* to this counter.
+
+        *other* is a counter of the same type and with the same samples
+        or the result of its :meth:`get_state` method.
+        '''
+        if isinstance(other, Counter):
+            other = other.get_state()
+        for x, y in zip(self.get_state(), other):
+            x += y
+
+    cdef get_allele_indices(self, VariantRecord record):
+        '''return allele indices of all samples in *record*.
+
+        returns an array of shape (nsamples, ploidy). Missing alleles
+        are set to -1 and padding for samples with lower ploidy to -2.
+        If there is no GT field, the array has 0 columns.
+        '''
+        cdef int n = bcf_get_genotypes(
+            record.header.ptr, record.ptr, &self.gt_ptr, &self.gt_size)
+        if n <= 0:
+            return numpy.zeros((self.nsamples, 0), dtype=numpy.int32)
+
+        cdef int ploidy = n // self.nsamples
+        result = numpy.empty((self.nsamples, ploidy), dtype=numpy.int32)
+        cdef int32_t [:, :] result_view = result
+        cdef int32_t * ptr = self.gt_ptr
+        cdef int _i, _j
+        for _i from 0 <= _i < self.nsamples:
+            for _j from 0 <= _j < ploidy:
+                if ptr[_j] == bcf_int32_vector_end:
+                    result_view[_i, _j] = -2
+                elif bcf_gt_is_missing(ptr[_j]):
+                    result_view[_i, _j] = -1
+                else:
+                    result_view[_i, _j] = bcf_gt_allele(ptr[_j])
+            ptr += ploidy
+        return result
+
+    cdef get_format_int32(self, VariantRecord record, tag):
+        '''return first value of integer FORMAT field *tag* for all
+        samples in *record*.
+
+        Missing values are set to -1. Returns None if the field is
+        not present.
+        '''
+        cdef bytes btag = tag.encode("ascii")
+        cdef int n = bcf_get_format_int32(
+            record.header.ptr, record.ptr, btag,
+            &self.format_ptr, &self.format_size)
+        if n <= 0:
+            return None
+
+        cdef int nvalues = n // self.nsamples
+        result = numpy.empty(self.nsamples, dtype=numpy.int32)
+        cdef int32_t [:] result_view = result
+        cdef int _i
+        cdef int32_t value
+        for _i from 0 <= _i < self.nsamples:
+            value = self.format_ptr[_i * nvalues]
+            if value == bcf_int32_missing or value == bcf_int32_vector_end:
+                result_view[_i] = -1
+            else:
+                result_view[_i] = value
+        return result
+
+    def __dealloc__(self):
+        if self.gt_ptr is not NULL:
+            free(self.gt_ptr)
+        if self.format_ptr is not NULL:
+            free(self.format_ptr)
+
     
 cdef class CounterKinship(Counter):
+    '''count genotype configurations between pairs of samples
+    to estimate kinship.
+
+    Genotypes are collected into blocks of *block_size* SNPs.
+    For each block, pairwise counts are obtained by multiplying
+    indicator matrices of heterozygous and homozygous genotypes.
+    Pairwise counts are stored for the lower triangle only.
+    '''
 
     cdef int32_t * data_genotype_ptr
 
     cdef numpy.ndarray n_Aa
     cdef numpy.ndarray n_AAaa
     cdef numpy.ndarray n_AaAa
-    cdef numpy.ndarray genotype_values
-    
-    def __init__(self, *args, **kwargs):
+    cdef numpy.ndarray block
+    cdef object tril
+    cdef int block_size
+    cdef int block_idx
+
+    def __init__(self, *args, block_size=4096, **kwargs):
         Counter.__init__(self, *args, **kwargs)
 
         self.data_genotype_ptr = NULL
+        self.block_size = block_size
+        self.block_idx = 0
         self.n_Aa = numpy.zeros(self.nsamples, dtype=numpy.int64)
-        # if memory becomes an issue, use triangular matrices
-        self.n_AAaa = numpy.zeros((self.nsamples, self.nsamples), dtype=numpy.int64)
-        self.n_AaAa = numpy.zeros((self.nsamples, self.nsamples), dtype=numpy.int64)
-        self.genotype_values = numpy.zeros(self.nsamples, dtype=numpy.int8)
+        # pairwise counts for i > j in the order of
+        # numpy.tril_indices
+        self.tril = numpy.tril_indices(self.nsamples, -1)
+        self.n_AAaa = numpy.zeros(len(self.tril[0]), dtype=numpy.int64)
+        self.n_AaAa = numpy.zeros(len(self.tril[0]), dtype=numpy.int64)
+        self.block = numpy.zeros((block_size, self.nsamples), dtype=numpy.int8)
 
     cdef process_record(self, VariantRecord record, bint is_snp):
 
@@ -92,11 +266,11 @@ cdef class CounterKinship(Counter):
         cdef int mdat = 0
         cdef int32_t * ptr = NULL
         cdef int allele
-        cdef bint is_het_i, is_het_j
         cdef int nret
         cdef int _i, _j
 
-        cdef int8_t [:] genotype_values_view = self.genotype_values
+        cdef int8_t [:, :] block_view = self.block
+        cdef int8_t [:] genotype_values_view = block_view[self.block_idx]
 
         nret = bcf_get_genotypes(
             record.header.ptr,
@@ -125,56 +299,72 @@ cdef class CounterKinship(Counter):
                 genotype_values_view[_i] += allele
             ptr += nret
 
-        for _i from 0 <= _i < self.nsamples:
-            if genotype_values_view[_i] < 0:
-                continue
-            is_het_i = genotype_values_view[_i] == 1
-            if is_het_i:
-                self.n_Aa[_i] += 1
-            for _j from 0 <= _j < _i:
-                if genotype_values_view[_j] < 0:
-                    continue
-                is_het_j = genotype_values_view[_j] == 1
-                if is_het_i and is_het_j:
-                    self.n_AaAa[_i][_j] += 1
-                elif (not is_het_i and
-                      not is_het_j and
-                      genotype_values_view[_i] != genotype_values_view[_j]):
-                    self.n_AAaa[_i][_j] += 1
+        self.block_idx += 1
+        if self.block_idx == self.block_size:
+            self.flush()
+
+    def flush(self):
+        '''add counts for genotypes in the current block.'''
+        if self.block_idx == 0:
+            return
+
+        genotypes = self.block[:self.block_idx]
+        self.block_idx = 0
+
+        # Indicator matrices are multiplied as float32, which is
+        # exact for counts up to 2^24 and uses an optimized BLAS.
+        is_valid = genotypes >= 0
+        is_het = genotypes == 1
+        self.n_Aa += is_het.sum(axis=0)
+        het = is_het.astype(numpy.float32)
+        self.n_AaAa += numpy.dot(het.T, het)[self.tril].astype(numpy.int64)
+
+        # homozygous pairs with a different genotype: all
+        # homozygous pairs minus those with the same genotype
+        is_hom = is_valid & ~is_het
+        hom = is_hom.astype(numpy.float32)
+        n_homhom = numpy.dot(hom.T, hom)
+        for value in numpy.unique(genotypes[is_hom]):
+            same = (genotypes == value).astype(numpy.float32)
+            n_homhom -= numpy.dot(same.T, same)
+        self.n_AAaa += n_homhom[self.tril].astype(numpy.int64)
+
+    def get_state(self):
+        self.flush()
+        return self.n_Aa, self.n_AAaa, self.n_AaAa
 
     def output(self):
 
-        cdef int _i, _j
+        self.flush()
+
+        n_Aa_i = self.n_Aa[self.tril[0]]
+        n_Aa_j = self.n_Aa[self.tril[1]]
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            between_kinship = (self.n_AaAa - 2.0 * self.n_AAaa) \
+                / (2.0 * n_Aa_i) \
+                + 0.5 - 0.25 * (n_Aa_i + n_Aa_j) / n_Aa_i
+            within_kinship = (self.n_AaAa - 2.0 * self.n_AAaa) \
+                / (n_Aa_i + n_Aa_j)
+
+        samples = self.samples
         with E.open_output_file("kinship") as outf:
             outf.write("sample_i\tsample_j\twithin_kinship\t"
                        "between_kinship\tn_het_i\tn_het_j\tn_homhom\tn_hethet\n")
-            for _i from 0 <= _i < self.nsamples:
-                for _j from 0 <= _j < _i:
-                    try:
-                        between_kinship = (self.n_AaAa[_i][_j] - 2.0 * self.n_AAaa[_i][_j]) \
-                            / (2.0 * self.n_Aa[_i]) \
-                            + 0.5 - 0.25 * (self.n_Aa[_i] + self.n_Aa[_j]) / self.n_Aa[_i]
-                        between_kinship_f = "{:6.4f}".format(between_kinship)
-                    except ZeroDivisionError:
-                        between_kinship_f = ""
-
-                    try:
-                        within_kinship = (self.n_AaAa[_i][_j] - 2.0 * self.n_AAaa[_i][_j]) \
-                            / (self.n_Aa[_i] + self.n_Aa[_j])
-                        within_kinship_f = "{:6.4f}".format(within_kinship)
-                    except ZeroDivisionError:
-                        within_kinship_f = ""
-
-                    outf.write("\t".join(map(
-                        str,
-                        (self.samples[_i],
-                         self.samples[_j],
-                         within_kinship_f,
-                         between_kinship_f,
-                         self.n_Aa[_i],
-                         self.n_Aa[_j],
-                         self.n_AAaa[_i][_j],
-                         self.n_AaAa[_i][_j]))) + "\n")
+            for _i, _j, within, between, n_i, n_j, n_AAaa, n_AaAa in zip(
+                    self.tril[0], self.tril[1],
+                    within_kinship, between_kinship,
+                    n_Aa_i, n_Aa_j,
+                    self.n_AAaa, self.n_AaAa):
+                outf.write("\t".join(map(
+                    str,
+                    (samples[_i],
+                     samples[_j],
+                     "{:6.4f}".format(within),
+                     "{:6.4f}".format(between),
+                     n_i,
+                     n_j,
+                     n_AAaa,
+                     n_AaAa))) + "\n")
 
     def __dealloc__(self):
         if self.data_genotype_ptr is not NULL:
@@ -258,6 +448,9 @@ cdef class CounterFormatDistributions(Counter):
         for code_idx, ival in enumerate(unset_view):
             unset_sites_view[code_idx][ival] += 1
 
+    def get_state(self):
+        return self.counts, self.unset_samples, self.unset_sites
+
     def output(self):
 
         str_codes = [x.decode("ascii") for x in self.codes]
@@ -306,12 +499,17 @@ cdef class CounterMutationalSignature(Counter):
 
     cdef object signatures
     cdef object profile
+    cdef object classes
+    cdef object contexts
+    cdef numpy.ndarray counts
 
     cdef FastaFile fasta_in
+    cdef ReferenceCache reference
 
     def __init__(self, fasta_in, *args, **kwargs):
         Counter.__init__(self, *args, **kwargs)
         self.fasta_in = fasta_in
+        self.reference = ReferenceCache(fasta_in)
 
         # Mutation profile
         #
@@ -349,9 +547,14 @@ cdef class CounterMutationalSignature(Counter):
         }
         assert len(self.profile.keys()) == 12
 
-        self.signatures = collections.defaultdict(
-            lambda: collections.defaultdict(
-                lambda: collections.defaultdict(int)))
+        self.classes = sorted(set(x[0] for x in self.profile.values()))
+        self.contexts = ["{}.{}".format(x, y) for x in "ACGT" for y in "ACGT"]
+
+        # counts per sample, class and context. The last row
+        # counts variants not shared by all samples.
+        self.counts = numpy.zeros(
+            (self.nsamples + 1, len(self.classes), len(self.contexts)),
+            dtype=numpy.int64)
 
     cdef process_record(self, VariantRecord record, bint is_snp):
 
@@ -360,9 +563,9 @@ cdef class CounterMutationalSignature(Counter):
             return
 
         alt = record.alts[0]
-        context = self.fasta_in.fetch(record.chrom,
-                                      record.pos - 2,
-                                      record.pos + 1).upper()
+        context = self.reference.fetch(record.chrom,
+                                       record.pos - 2,
+                                       record.pos + 1)
 
         assert context[1] == record.ref, \
             "reference sequence mismatch? expected {} at {}:{}, got {}".format(
@@ -379,49 +582,46 @@ cdef class CounterMutationalSignature(Counter):
             context = context.translate(ACGT)[::-1]
 
         c = "{}.{}".format(context[0], context[2])
+        class_idx = self.classes.index(profile_class)
+        context_idx = self.contexts.index(c)
 
-        all_alleles = collections.defaultdict(int)
-        first_variants = None
-        is_unique = False
-        for s in self.samples:
-            ai = list(record.samples[s].allele_indices)
-            variants = [x for x in ai if x and x > 0]
-
-            if len(variants) > 0:
-                self.signatures[s][profile_class][c] += 1
-                for v in variants:
-                    all_alleles[v] += 1
+        allele_indices = self.get_allele_indices(record)
+        variants = numpy.where(allele_indices > 0, allele_indices, 0)
+        self.counts[:-1, class_idx, context_idx] += (variants > 0).any(axis=1)
 
-            if first_variants is None:
-                first_variants = tuple(sorted(variants))
-            else:
-                if tuple(sorted(variants)) != first_variants:
-                    is_unique = True
+        # variants are unique if the alternative alleles in any
+        # sample differ from those in the first sample
+        if self.nsamples > 0:
+            variants.sort(axis=1)
+            if (variants != variants[0]).any():
+                self.counts[-1, class_idx, context_idx] += 1
 
-        if is_unique:
-            self.signatures["unique"][profile_class][c] += 1
+    def get_state(self):
+        return (self.counts,)
 
     def output(self):
 
+        names = list(self.samples) + ["unique"]
         with E.open_output_file("mutation_profile") as outf:
             outf.write("sample\tsignature\tcontext\tcount\t"
                        "percent_sample\tpercent_context\n")
-            for s, dd in sorted(self.signatures.items()):
-                total_class = collections.defaultdict(int)
-                for cls, d in dd.items():
-                    t = 0
-                    for alt, count in d.items():
-                        t += count
-                    total_class[cls] = float(t)
-                total_sample = sum(total_class.values())
-
-                for cls, d in sorted(dd.items()):
-                    for context, count in sorted(d.items()):
+            for idx in sorted(range(len(names)), key=lambda x: names[x]):
+                counts = self.counts[idx]
+                total_sample = float(counts.sum())
+                if total_sample == 0:
+                    continue
+                total_class = counts.sum(axis=1)
+
+                for class_idx, cls in enumerate(self.classes):
+                    for context_idx, context in enumerate(self.contexts):
+                        count = int(counts[class_idx, context_idx])
+                        if count == 0:
+                            continue
                         outf.write("\t".join(map(
                             str,
-                            (s, cls, context, count,
+                            (names[idx], cls, context, count,
                              100.0 * count / total_sample,
-                             100.0 * count / total_class[cls])
+                             100.0 * count / float(total_class[class_idx]))
                         )) + "\n")
 
 
@@ -513,6 +713,7 @@ cdef class CounterMutationalSignatureProfile(CounterMutationalSignature):
 cdef class CounterGCContext(Counter):
 
     cdef FastaFile fasta_in
+    cdef ReferenceCache reference
     cdef int nbins
     cdef int window_size
     cdef numpy.ndarray counts
@@ -520,6 +721,7 @@ cdef class CounterGCContext(Counter):
     def __init__(self, fasta_in, *args, **kwargs):
         Counter.__init__(self, *args, **kwargs)
         self.fasta_in = fasta_in
+        self.reference = ReferenceCache(fasta_in)
         self.nbins = 100
         self.counts = numpy.zeros((self.nsamples, self.nbins + 1))
         self.window_size = 50
@@ -528,26 +730,24 @@ cdef class CounterGCContext(Counter):
 
         if not is_snp:
             return
-        context = self.fasta_in.fetch(record.chrom,
-                                      max(0, record.pos - self.window_size),
-                                      record.pos + self.window_size).upper()
-        counts = collections.Counter(context)
-        gc = counts["G"] + counts["C"]
-        at = counts["A"] + counts["T"]
+        gc, at = self.reference.composition(
+            record.chrom,
+            max(0, record.pos - self.window_size),
+            record.pos + self.window_size)
+        # skip windows without any A, C, G or T
+        if gc + at == 0:
+            return
         gc_content = int(math.floor(100.0 * gc / (gc + at)))
-        c = "{}.{}".format(context[0], context[2])
-        for idx, s in enumerate(self.samples):
-            try:
-                ai = list(record.samples[s].allele_indices)
-            except TypeError:
-                # no GT field
-                continue
 
-            if self.only_variant_positions:
-                if len([x for x in ai if x > 0]):
-                    continue
+        # skip samples without a genotype
+        allele_indices = self.get_allele_indices(record)
+        take = (allele_indices >= 0).any(axis=1)
+        if self.only_variant_positions:
+            take &= ~(allele_indices > 0).any(axis=1)
+        self.counts[:, gc_content] += take
 
-            self.counts[idx][gc_content] += 1
+    def get_state(self):
+        return (self.counts,)
 
     def output(self):
         with E.open_output_file("gc_context") as outf:
@@ -564,6 +764,7 @@ cdef class CounterGCContext(Counter):
 cdef class CounterGCDepthProfile(Counter):
 
     cdef FastaFile fasta_in
+    cdef ReferenceCache reference
     cdef int nbins_gc
     cdef int nbins_dp
     cdef int window_size
@@ -572,6 +773,7 @@ cdef class CounterGCDepthProfile(Counter):
     def __init__(self, fasta_in, gc_window_size=50, *args, **kwargs):
         Counter.__init__(self, *args, **kwargs)
         self.fasta_in = fasta_in
+        self.reference = ReferenceCache(fasta_in)
         self.nbins_gc = 100
         self.nbins_dp = 1000
         self.counts = numpy.zeros(
@@ -583,32 +785,32 @@ cdef class CounterGCDepthProfile(Counter):
         if not is_snp:
             return
 
-        context = self.fasta_in.fetch(record.chrom,
-                                      max(0, record.pos - self.window_size),
-                                      record.pos + self.window_size).upper()
-
-        counts = collections.Counter(context)
-        gc = counts["G"] + counts["C"]
-        at = counts["A"] + counts["T"]
+        gc, at = self.reference.composition(
+            record.chrom,
+            max(0, record.pos - self.window_size),
+            record.pos + self.window_size)
+        # skip windows without any A, C, G or T
+        if gc + at == 0:
+            return
         gc_content = int(math.floor(100.0 * gc / (gc + at)))
 
-        c = "{}.{}".format(context[0], context[2])
+        depth = self.get_format_int32(record, "DP")
+        if depth is None:
+            return
 
-        for idx, s in enumerate(self.samples):
-            try:
-                ai = list(record.samples[s].allele_indices)
-            except TypeError:
-                # no GT field
-                continue
+        take = depth >= 0
+        if self.only_variant_positions:
+            allele_indices = self.get_allele_indices(record)
+            take &= ~(allele_indices > 0).any(axis=1)
 
-            if self.only_variant_positions:
-                if len([x for x in ai if x > 0]):
-                    continue
-                    
-            depth = record.samples[s]["DP"]
-            if depth != None:
-                depth = min(depth, self.nbins_dp)
-                self.counts[idx][depth][gc_content] += 1
+        numpy.add.at(self.counts,
+                     (numpy.flatnonzero(take),
+                      numpy.minimum(depth[take], self.nbins_dp),
+                      gc_content),
+                     1)
+
+    def get_state(self):
+        return (self.counts,)
 
     def output(self):
         with E.open_output_file("gc_dp_prof") as outf:
@@ -648,23 +850,18 @@ cdef class CounterGCDepthProfile(Counter):
                     outf.write("{}\t{}\t{:.2f}\n".format(sample, gc_bin, mean))
 
 
-def vcf2stats_count(VariantFile vcf_in,
-                    FastaFile fasta_in,
-                    TabixFile bed_in,
-                    options):
-
-    if options.region is not None:
-        vcf_records = generate_from_region(vcf_in, options.region)
-    elif bed_in is not None:
-        vcf_records = generate_from_bed(vcf_in, bed_in)
-    else:
-        vcf_records = generate_from_vcf(vcf_in)
-
-    samples = list(vcf_in.header.samples)
+def build_counters(samples,
+                   fasta_in,
+                   methods,
+                   format_distributions=None,
+                   format_distribution_nbins=1000,
+                   gc_window_size=50,
+                   only_variant_positions=False):
+    '''return a list of counters for each method in *methods*.'''
 
     counters = []
 
-    for method in options.methods:
+    for method in methods:
         if method == "mutational-signature":
             counters.append(CounterMutationalSignature(
                 fasta_in=fasta_in,
@@ -678,8 +875,8 @@ def vcf2stats_count(VariantFile vcf_in,
                 samples=samples))
         elif method == "format-distribution":
             counters.append(CounterFormatDistributions(
-                nbins=options.format_distribution_nbins,
-                codes=options.format_distributions,
+                nbins=format_distribution_nbins,
+                codes=format_distributions,
                 samples=samples))
         elif method == "gc-context":
             counters.append(CounterGCContext(
@@ -689,19 +886,23 @@ def vcf2stats_count(VariantFile vcf_in,
             counters.append(CounterGCDepthProfile(
                 fasta_in=fasta_in,
                 samples=samples,
-                gc_window_size=options.gc_window_size,
-                only_variant_positions=options.only_variant_positions))
+                gc_window_size=gc_window_size,
+                only_variant_positions=only_variant_positions))
 
-    cdef bint is_snp
+    return counters
+
+
+def count_records(vcf_records, counters, int report_step=1000000):
+    '''apply *counters* to PASS records in *vcf_records*.'''
 
-    cdef int report_step = options.report_step
+    cdef bint is_snp
     cdef int record_idx
     cdef VariantRecord record
 
     cdef Counter counter
 
     for record_idx, record in enumerate(vcf_records):
-        if (record_idx % options.report_step) == 0:
+        if (record_idx % report_step) == 0:
             E.debug("iteration {}: {}:{}".format(record_idx, record.chrom, record.pos))
 
         if record.filter.values()[0].name != "PASS":
@@ -720,5 +921,141 @@ def vcf2stats_count(VariantFile vcf_in,
         for counter in counters:
             counter.process_record(record, is_snp)
 
+
+def generate_from_regions(vcf_file, regions, only_starting=True):
+    '''iterate over records in *regions*, a list of tuples
+    (contig, start, end).
+
+    If *only_starting* is set, only records starting within
+    a region are returned so that records are not counted twice
+    in adjacent regions.
+    '''
+    for contig, start, end in regions:
+        for v in vcf_file.fetch(contig, start, end):
+            if only_starting and v.start < start:
+                continue
+            yield v
+
+
+def partition_genome(vcf_file, int region_size):
+    '''split contigs in the header of *vcf_file* into regions
+    of *region_size*.'''
+    for contig in vcf_file.header.contigs.values():
+        length = contig.length
+        if length is None:
+            # unknown length, process whole contig
+            yield (contig.name, 0, 2 ** 31 - 1)
+            continue
+        for start in range(0, length, region_size):
+            yield (contig.name, start, min(length, start + region_size))
+
+
+# input files and counter parameters of a worker process
+_worker_state = {}
+
+
+def _init_worker(vcf_filename, fasta_filename, counter_kwargs, report_step):
+    '''open input files in a worker process.'''
+    vcf_in = pysam.VariantFile(vcf_filename)
+    if fasta_filename:
+        fasta_in = pysam.FastaFile(fasta_filename)
+    else:
+        fasta_in = None
+    _worker_state.update({"vcf_in": vcf_in,
+                          "fasta_in": fasta_in,
+                          "samples": list(vcf_in.header.samples),
+                          "counter_kwargs": counter_kwargs,
+                          "report_step": report_step})
+
+
+def _count_regions(args):
+    '''count records in a set of regions in a worker process.
+
+    returns the state of each counter.
+    '''
+    regions, only_starting = args
+    counters = build_counters(_worker_state["samples"],
+                              _worker_state["fasta_in"],
+                              **_worker_state["counter_kwargs"])
+    count_records(generate_from_regions(_worker_state["vcf_in"],
+                                        regions,
+                                        only_starting=only_starting),
+                  counters,
+                  _worker_state["report_step"])
+    return [counter.get_state() for counter in counters]
+
+
+def vcf2stats_count_parallel(VariantFile vcf_in,
+                             TabixFile bed_in,
+                             counters,
+                             vcf_filename,
+                             fasta_filename,
+                             counter_kwargs,
+                             options):
+    '''count records in parallel and merge results into *counters*.
+
+    The genome is split into regions of ``options.region_size``
+    or, if *bed_in* is given, into groups of intervals. Each region
+    is processed by a worker process with its own input files.
+    '''
+    if bed_in is not None:
+        intervals = [(bed.contig, bed.start, bed.end)
+                     for bed in bed_in.fetch(parser=pysam.asBed())]
+        tasks = [(intervals[x:x + 1000], False)
+                 for x in range(0, len(intervals), 1000)]
+    else:
+        tasks = [([region], True)
+                 for region in partition_genome(vcf_in, options.region_size)]
+
+    E.info("counting in {} regions with {} processes".format(
+        len(tasks), options.num_processes))
+
+    pool = multiprocessing.Pool(
+        options.num_processes,
+        initializer=_init_worker,
+        initargs=(vcf_filename, fasta_filename,
+                  counter_kwargs, options.report_step))
+    try:
+        for states in pool.imap_unordered(_count_regions, tasks):
+            for counter, state in zip(counters, states):
+                counter.merge(state)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def vcf2stats_count(VariantFile vcf_in,
+                    FastaFile fasta_in,
+                    TabixFile bed_in,
+                    options):
+
+    samples = list(vcf_in.header.samples)
+
+    counter_kwargs = dict(
+        methods=options.methods,
+        format_distributions=options.format_distributions,
+        format_distribution_nbins=options.format_distribution_nbins,
+        gc_window_size=options.gc_window_size,
+        only_variant_positions=options.only_variant_positions)
+
+    counters = build_counters(samples, fasta_in, **counter_kwargs)
+
+    if options.num_processes > 1 and options.region is None:
+        vcf2stats_count_parallel(
+            vcf_in, bed_in, counters,
+            options.input_vcf_file,
+            options.input_fasta_file,
+            counter_kwargs,
+            options)
+    else:
+        if options.region is not None:
+            vcf_records = generate_from_region(vcf_in, options.region)
+        elif bed_in is not None:
+            vcf_records = generate_from_bed(vcf_in, bed_in)
+        else:
+            vcf_records = generate_from_vcf(vcf_in)
+
+        count_records(vcf_records, counters, options.report_step)
+
     for counter in counters:
         counter.output()
@@ -28,6 +28,36 @@ below will create the same two output files::
 
    cat in.bam cgat bam2fastq --output-filename-pattern=out.%s.fastq.gz
 
+Methods
+-------
+
+The following methods are available to pair reads (``--method``):
+
+sort
+   write reads to temporary files and sort them by read name
+   using the unix ``sort`` command. This is the default. Output
+   is sorted by read name.
+
+collated
+   pair reads on the fly. The input needs to be sorted by name
+   or collated such that the two mates of a pair are next to each
+   other, for example by ``samtools collate``.
+
+mate-buffer
+   keep unpaired mates in memory until their mate has been seen.
+   This method is suitable for coordinate sorted input. If more
+   than ``--max-buffer-size`` reads are waiting for their mate,
+   the buffer is spilled into ``--num-buckets`` temporary files
+   by read name. Mates in these files are paired at the end.
+
+The methods ``collated`` and ``mate-buffer`` write pairs in the
+order in which they are completed and ignore secondary and
+supplementary alignments. Missing mates are output as a
+sequence of ``N`` of the same length as the mate that is present.
+For paired data, unpaired reads are output with such a mate in
+the second file as well.
+Output is compressed in blocks by ``--threads`` threads.
+
 Type::
 
    python bam2fastq.py --help
@@ -41,6 +71,10 @@ Command line options
 
 import os
 import sys
+import gzip
+import zlib
+import collections
+import concurrent.futures
 import tempfile
 import shutil
 import cgatcore.experiment as E
@@ -49,6 +83,239 @@ import cgatcore.iotools as iotools
 import pysam
 
 
+class BlockGzipWriter(object):
+    """write gzip compressed text in blocks.
+
+    Each block of *block_size* bytes is compressed into an
+    independent gzip member by one of *threads* threads. The
+    members are written in order, the resulting file can be read
+    by gunzip and other gzip readers.
+    """
+
+    def __init__(self, filename, threads=1, block_size=4 * 1024 * 1024,
+                 compresslevel=6):
+        self.outf = open(filename, "wb")
+        self.threads = max(1, threads)
+        self.block_size = block_size
+        self.compresslevel = compresslevel
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.threads)
+        self.pending = collections.deque()
+        self.buffer = []
+        self.buffer_size = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= self.block_size:
+            self.submit()
+
+    def submit(self):
+        if self.buffer_size == 0:
+            return
+        data = "".join(self.buffer).encode("ascii")
+        self.buffer, self.buffer_size = [], 0
+        self.pending.append(
+            self.pool.submit(gzip.compress, data, self.compresslevel))
+        # limit the number of blocks held in memory
+        while len(self.pending) > 2 * self.threads:
+            self.outf.write(self.pending.popleft().result())
+
+    def close(self):
+        self.submit()
+        while self.pending:
+            self.outf.write(self.pending.popleft().result())
+        self.pool.shutdown()
+        self.outf.close()
+
+
+class FastqPairWriter(object):
+    """write read pairs into two fastq files.
+
+    The file for second reads is only opened once a paired
+    read is written. Unpaired reads are written to the first
+    file and, as for the ``sort`` method, a placeholder mate is
+    written to the second file so that both files stay in sync.
+    Placeholders for unpaired reads seen before the first pair are
+    kept in a temporary file and discarded if the input contains
+    no pairs.
+    """
+
+    def __init__(self, filename1, filename2, counter, threads=1,
+                 tmpdir=None):
+        self.filename2 = filename2
+        self.threads = threads
+        self.outf1 = BlockGzipWriter(filename1, threads=threads)
+        self.outf2 = None
+        self.pending = tempfile.TemporaryFile(mode="w+", dir=tmpdir)
+        self.npending = 0
+        self.counter = counter
+
+    def write_unpaired(self, qname, seq, qual):
+        placeholder = "@%s\n%s\n+\n%s\n" % (
+            qname, "N" * len(seq), "B" * len(seq))
+        self.outf1.write("@%s\n%s\n+\n%s\n" % (qname, seq, qual))
+        if self.outf2 is None:
+            self.pending.write(placeholder)
+            self.npending += 1
+        else:
+            self.outf2.write(placeholder)
+            self.counter.extra2 += 1
+        self.counter.unpaired += 1
+
+    def write_pair(self, qname, read1, read2):
+        """write a pair of reads. Reads are tuples of (seq, qual),
+        a missing mate is given as None."""
+
+        if self.outf2 is None:
+            self.outf2 = BlockGzipWriter(self.filename2,
+                                         threads=self.threads)
+            self.pending.seek(0)
+            for data in iter(lambda: self.pending.read(1 << 20), ""):
+                self.outf2.write(data)
+            self.pending.close()
+            self.counter.extra2 += self.npending
+        if read1 is None:
+            read1 = ("N" * len(read2[0]), "B" * len(read2[0]))
+            self.counter.extra1 += 1
+        else:
+            self.counter.output1 += 1
+        if read2 is None:
+            read2 = ("N" * len(read1[0]), "B" * len(read1[0]))
+            self.counter.extra2 += 1
+        else:
+            self.counter.output2 += 1
+
+        self.outf1.write("@%s\n%s\n+\n%s\n" % (qname, read1[0], read1[1]))
+        self.outf2.write("@%s\n%s\n+\n%s\n" % (qname, read2[0], read2[1]))
+
+    def close(self):
+        self.outf1.close()
+        if self.outf2 is not None:
+            self.outf2.close()
+        else:
+            self.pending.close()
+
+
+def iterate_primary_reads(samfile, counter):
+    """iterate over reads in *samfile* ignoring secondary and
+    supplementary alignments.
+
+    yields tuples of (qname, mate, seq, qual) with *mate* being 0
+    for unpaired reads, 1 for first and 2 for second reads in a
+    pair. Reads without base qualities are given a quality of
+    ``B`` for each base.
+    """
+    for read in samfile.fetch(until_eof=True):
+        counter.input += 1
+        if read.flag & 0x900:
+            counter.skipped += 1
+            continue
+        if not read.is_paired:
+            mate = 0
+        elif read.is_read1:
+            mate = 1
+        else:
+            mate = 2
+        seq, qual = read.query_sequence, read.qual
+        if qual is None:
+            qual = "B" * len(seq)
+        yield read.query_name, mate, seq, qual
+
+
+def pair_collated(samfile, writer, counter):
+    """pair reads in name sorted or collated *samfile*."""
+
+    last_qname, mates = None, [None, None]
+    for qname, mate, seq, qual in iterate_primary_reads(samfile, counter):
+        if mate == 0:
+            writer.write_unpaired(qname, seq, qual)
+            continue
+        if qname != last_qname:
+            if last_qname is not None:
+                writer.write_pair(last_qname, mates[0], mates[1])
+            last_qname, mates = qname, [None, None]
+        if mates[mate - 1] is None:
+            mates[mate - 1] = (seq, qual)
+
+    if last_qname is not None:
+        writer.write_pair(last_qname, mates[0], mates[1])
+
+
+def pair_with_buffer(samfile, writer, counter,
+                     max_buffer_size=1000000,
+                     num_buckets=64,
+                     tmpdir=None):
+    """pair reads in *samfile* by keeping unpaired mates in a buffer.
+
+    If the buffer exceeds *max_buffer_size* reads, it is spilled
+    into *num_buckets* temporary files by read name. The reads
+    in each bucket are paired after all input has been read.
+    """
+
+    buffer = {}
+    buckets = None
+    tmpdir = tempfile.mkdtemp(dir=tmpdir)
+
+    def spill():
+        for qname, (mate, seq, qual) in buffer.items():
+            bucket = zlib.crc32(qname.encode("ascii")) % num_buckets
+            buckets[bucket].write(
+                "%s\t%i\t%s\t%s\n" % (qname, mate, seq, qual))
+        counter.spilled += len(buffer)
+        buffer.clear()
+
+    try:
+        for qname, mate, seq, qual in iterate_primary_reads(
+                samfile, counter):
+            if mate == 0:
+                writer.write_unpaired(qname, seq, qual)
+                continue
+            other = buffer.get(qname, None)
+            if other is None:
+                buffer[qname] = (mate, seq, qual)
+                if len(buffer) > max_buffer_size:
+                    if buckets is None:
+                        E.info("spilling mate buffer to %s" % tmpdir)
+                        buckets = [
+                            open(os.path.join(tmpdir, "bucket_%i" % x), "w")
+                            for x in range(num_buckets)]
+                    spill()
+            elif other[0] != mate:
+                del buffer[qname]
+                if mate == 1:
+                    writer.write_pair(qname, (seq, qual), other[1:])
+                else:
+                    writer.write_pair(qname, other[1:], (seq, qual))
+
+        if buckets is None:
+            for qname, (mate, seq, qual) in buffer.items():
+                if mate == 1:
+                    writer.write_pair(qname, (seq, qual), None)
+                else:
+                    writer.write_pair(qname, None, (seq, qual))
+            return
+
+        spill()
+        for bucket in buckets:
+            bucket.close()
+
+        for bucket in buckets:
+            mates = collections.OrderedDict()
+            with open(bucket.name) as inf:
+                for line in inf:
+                    qname, mate, seq, qual = line[:-1].split("\t")
+                    if qname not in mates:
+                        mates[qname] = [None, None]
+                    if mates[qname][int(mate) - 1] is None:
+                        mates[qname][int(mate) - 1] = (seq, qual)
+            os.unlink(bucket.name)
+            for qname, (read1, read2) in mates.items():
+                writer.write_pair(qname, read1, read2)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 def main(argv=None):
     """script main.
 
@@ -62,7 +329,34 @@ def main(argv=None):
     parser = E.OptionParser(version="%prog version: $Id$",
                             usage=globals()["__doc__"])
 
+    parser.add_option("-m", "--method", dest="method", type="choice",
+                      choices=("sort", "collated", "mate-buffer"),
+                      help="method to pair reads. See the documentation "
+                      "for details [%default]")
+
+    parser.add_option("--max-buffer-size", dest="max_buffer_size",
+                      type="int",
+                      help="maximum number of reads waiting for their mate "
+                      "before spilling to disk for method 'mate-buffer' "
+                      "[%default]")
+
+    parser.add_option("--num-buckets", dest="num_buckets", type="int",
+                      help="number of temporary files to spill to for "
+                      "method 'mate-buffer' [%default]")
+
+    parser.add_option("--tmpdir", dest="tmpdir", type="string",
+                      help="directory for temporary files [%default]")
+
+    parser.add_option("--threads", dest="threads", type="int",
+                      help="number of threads used for compressing output "
+                      "for methods 'collated' and 'mate-buffer' [%default]")
+
     parser.set_defaults(
+        method="sort",
+        max_buffer_size=1000000,
+        num_buckets=64,
+        tmpdir=None,
+        threads=1,
     )
 
     # add common options (-h/--help, ...) and parse command line
@@ -89,7 +383,28 @@ def main(argv=None):
     else:
         samfile = pysam.AlignmentFile("-", "rb")
 
-    tmpdir = tempfile.mkdtemp()
+    if options.method in ("collated", "mate-buffer"):
+        c = E.Counter()
+        writer = FastqPairWriter(fastqfile1, fastqfile2, c,
+                                 threads=options.threads,
+                                 tmpdir=options.tmpdir)
+        if options.method == "collated":
+            pair_collated(samfile, writer, c)
+        else:
+            pair_with_buffer(samfile, writer, c,
+                             max_buffer_size=options.max_buffer_size,
+                             num_buckets=options.num_buckets,
+                             tmpdir=options.tmpdir)
+        writer.close()
+
+        if c.unpaired == 0 and c.output1 == 0 and c.output2 == 0:
+            E.warn("no reads were found")
+
+        E.info("%s" % str(c))
+        E.stop()
+        return
+
+    tmpdir = tempfile.mkdtemp(dir=options.tmpdir)
 
     outtemp1 = os.path.join(tmpdir, "pair1.gz")
     outtemp2 = os.path.join(tmpdir, "pair2.gz")
@@ -145,6 +145,22 @@ exactly 1000000.
 The detail normalization algorithm as follows: norm = sum(all counts
 in all features)/1000000.0 normalized count = normalized count / norm
 
+Option: parallel processing
++++++++++++++++++++++++++++
+
+With ``--num-processes`` intervals are split by contig into shards
+of at most ``--shard-size`` intervals which are processed by a pool
+of worker processes. Each worker opens its own copy of the input
+files. Results are output in the order of the input intervals.
+
+The densities of all intervals are collected into one matrix per
+track. Sorting and normalization operate on these matrices, which
+can be kept in memory-mapped files with ``--matrix-tmpdir``.
+
+If intervals are sorted by position, ``--sorted-intervals`` will
+fetch reads from :term:`bam` files in blocks that are shared
+between neighbouring intervals.
+
 .. todo::
 
    paired-endedness is not fully implemented.
@@ -157,6 +173,10 @@ Command line options
 import sys
 import os
 import re
+import random
+import shutil
+import tempfile
+import multiprocessing
 import cgatcore.experiment as E
 import cgatcore.iotools as iotools
 import pysam
@@ -264,7 +284,41 @@ def buildOptionParser(argv):
         "reads will be shifted upstream/downstream by this amount. "
         "[%default]")
 
+    parser.add_option(
+        "--sorted-intervals", dest="sorted_intervals", action="store_true",
+        help="intervals are sorted by position. Reads are fetched "
+        "in blocks (see --fetch-block-size) that are shared between "
+        "neighbouring intervals. Only applies to bam files "
+        "[%default]")
+
+    parser.add_option(
+        "--fetch-block-size", dest="fetch_block_size", type="int",
+        help="minimum size of blocks in bp when fetching reads "
+        "with --sorted-intervals [%default]")
+
+    parser.add_option(
+        "--num-processes", dest="num_processes", type="int",
+        help="number of worker processes. Intervals are split into "
+        "shards by contig (see --shard-size) and processed in "
+        "parallel. Each worker opens its own input files "
+        "[%default]")
+
+    parser.add_option(
+        "--shard-size", dest="shard_size", type="int",
+        help="maximum number of intervals in a shard "
+        "processed by a worker [%default]")
+
+    parser.add_option(
+        "--matrix-tmpdir", dest="matrix_tmpdir", type="string",
+        help="if given, keep density matrices in memory-mapped files "
+        "in a temporary directory within this directory [%default]")
+
     parser.set_defaults(
+        num_processes=1,
+        shard_size=1000,
+        matrix_tmpdir=None,
+        sorted_intervals=False,
+        fetch_block_size=1000000,
         bin_size=10,
         shift=0,
         window_size=1000,
@@ -288,19 +342,27 @@ IntervalData = collections.namedtuple(
 
 
 def outputFeatureTable(outfile, features_per_interval, bins):
-    '''ouput results from density profiles.'''
+    '''ouput results from density profiles.
 
-    outfile.write("\t".join(
-        ("contig",
-         "start",
-         "end",
-         "name",
-         "\t".join(bam2peakshape.PeakShapeResult._fields))) + "\n")
+    This is a generator that writes a row for each interval
+    in *features_per_interval* and then passes the interval on,
+    so that the table can be written while the matrices are built.
+    The header is only written if there is at least one interval.
+    '''
 
     # output principal table
     n = 0
-    for foreground, bed, controls, shifted in features_per_interval:
+    for data in features_per_interval:
+        foreground, bed, controls, shifted = data
         n += 1
+        if n == 1:
+            outfile.write("\t".join(
+                ("contig",
+                 "start",
+                 "end",
+                 "name",
+                 "\t".join(bam2peakshape.PeakShapeResult._fields))) + "\n")
+
         if "name" in bed:
             name = bed.name
         else:
@@ -313,9 +375,12 @@ def outputFeatureTable(outfile, features_per_interval, bins):
         outfile.write("\t%s" % ",".join(map(str, bins)))
         outfile.write("\t%s" % ",".join(map(str, counts)))
         outfile.write("\n")
+        yield data
 
 
-def writeMatricesForSortOrder(features_per_interval,
+def writeMatricesForSortOrder(names,
+                              matrices,
+                              order,
                               bins,
                               foreground_track,
                               control_tracks,
@@ -325,16 +390,17 @@ def writeMatricesForSortOrder(features_per_interval,
 
     For each sort order output the forerground. If there
     are additional controls and shifted section, output
-    these as well
+    these as well. Rows are output in the order given
+    by the index array *order*.
 
     The files will named:
     matrix_<track>_<sortorder>
 
     '''
-    if "name" in features_per_interval[0].interval:
-        names = [x.interval.name for x in features_per_interval]
+    if names is None:
+        names = list(map(str, list(range(1, len(order) + 1))))
     else:
-        names = list(map(str, list(range(1, len(features_per_interval) + 1))))
+        names = [names[x] for x in order]
 
     bins = ["%i" % x for x in bins]
     sort_order = re.sub("-", "_", sort_order)
@@ -342,7 +408,7 @@ def writeMatricesForSortOrder(features_per_interval,
     # write foreground
     iotools.write_matrix(
         E.open_output_file("matrix_%s_%s.gz" % (foreground_track, sort_order)),
-        [x.foreground.counts for x in features_per_interval],
+        (matrices[0][x] for x in order),
         row_headers=names,
         col_headers=bins,
         row_header="name")
@@ -351,7 +417,7 @@ def writeMatricesForSortOrder(features_per_interval,
     for idx, track in enumerate(control_tracks):
         iotools.write_matrix(
             E.open_output_file("matrix_%s_%s.gz" % (track, sort_order)),
-            [x.controls[idx].counts for x in features_per_interval],
+            (matrices[idx + 1][x] for x in order),
             row_headers=names,
             col_headers=bins,
             row_header="name")
@@ -360,25 +426,14 @@ def writeMatricesForSortOrder(features_per_interval,
     if shifted:
         iotools.write_matrix(
             E.open_output_file("matrix_shift_%s.gz" % (sort_order)),
-            [x.shifted.counts for x in features_per_interval],
+            (matrices[-1][x] for x in order),
             row_headers=names,
             col_headers=bins,
             row_header="name")
 
     # output a combined matrix
     if len(control_tracks) > 0 or shifted:
-        rows = []
-        for row in features_per_interval:
-            l = [row.foreground.counts]
-            l.extend([row.controls[x].counts for x in
-                      range(len(control_tracks))])
-            if shifted:
-                l.append(row.shifted.counts)
-            rows.append(numpy.concatenate(l))
-
-        n = 1 + len(control_tracks)
-        if shifted:
-            n += 1
+        n = len(matrices)
 
         # make column names unique and make sure they can be sorted
         # lexicographically
@@ -388,13 +443,88 @@ def writeMatricesForSortOrder(features_per_interval,
 
         iotools.write_matrix(
             E.open_output_file("matrix_sidebyside_%s.gz" % (sort_order)),
-            rows,
+            (numpy.concatenate([m[x] for m in matrices]) for x in order),
             row_headers=names,
             col_headers=all_bins,
             row_header="name")
 
 
+def buildMatrices(features_per_interval,
+                  ncontrols=0,
+                  shifted=False,
+                  dtype=numpy.int64,
+                  tmpdir=None):
+    '''collect the binned counts of all intervals into matrices.
+
+    The matrices have one row per interval: the foreground, one for
+    each control and, if *shifted* is set, one for the shifted
+    intervals.
+
+    If *tmpdir* is given, the matrices are memory-mapped files in
+    this directory. The counts of each interval in
+    *features_per_interval* are appended to these files as the
+    interval is produced, so that only the counts of a single
+    interval are kept in memory.
+
+    Returns a tuple of the intervals without their counts and the
+    list of matrices.
+    '''
+    nmatrices = 1 + ncontrols
+    if shifted:
+        nmatrices += 1
+
+    filenames = []
+    if tmpdir:
+        filenames = [os.path.join(tmpdir, "matrix_%i.dat" % idx)
+                     for idx in range(nmatrices)]
+        outfiles = [open(x, "wb") for x in filenames]
+    else:
+        rows = [[] for idx in range(nmatrices)]
+
+    result = []
+    ncols = 0
+    try:
+        for foreground, bed, controls, shifted_counts in features_per_interval:
+            counts = [foreground.counts]
+            for idx in range(ncontrols):
+                counts.append(controls[idx].counts)
+            if shifted:
+                counts.append(shifted_counts.counts)
+
+            ncols = len(foreground.counts)
+            for idx, row in enumerate(counts):
+                row = numpy.asarray(row, dtype=dtype)
+                if tmpdir:
+                    outfiles[idx].write(row.tobytes())
+                else:
+                    rows[idx].append(row)
+
+            # only the peak shape parameters are needed for sorting
+            result.append(IntervalData._make((
+                foreground._replace(bins=None, counts=None),
+                bed, None, None)))
+    finally:
+        if tmpdir:
+            for outfile in outfiles:
+                outfile.close()
+
+    if len(result) == 0:
+        return result, []
+
+    if tmpdir:
+        matrices = [numpy.memmap(x,
+                                 dtype=dtype,
+                                 mode="r+",
+                                 shape=(len(result), ncols))
+                    for x in filenames]
+    else:
+        matrices = [numpy.array(x, dtype=dtype) for x in rows]
+
+    return result, matrices
+
+
 def outputMatrices(features_per_interval,
+                   matrices,
                    bins,
                    foreground_track,
                    control_tracks=None,
@@ -402,11 +532,29 @@ def outputMatrices(features_per_interval,
                    sort_orders=None):
     '''ouput matrices from density profiles
     in one or more sort_orders.
+
+    Rows in *matrices* correspond to the intervals in
+    *features_per_interval*. Sorting permutes an index
+    array, the matrices themselves are not copied.
     '''
 
+    if "name" in features_per_interval[0].interval:
+        names = [x.interval.name for x in features_per_interval]
+    else:
+        names = None
+
+    order = numpy.arange(len(features_per_interval))
+
+    def _sort(key):
+        # stable sort of the current order by key
+        return order[numpy.argsort(
+            numpy.asarray(key)[order], kind="stable")]
+
     # output sorted matrices
     if not sort_orders:
-        writeMatricesForSortOrder(features_per_interval,
+        writeMatricesForSortOrder(names,
+                                  matrices,
+                                  order,
                                   bins,
                                   foreground_track,
                                   control_tracks,
@@ -416,21 +564,22 @@ def outputMatrices(features_per_interval,
     for sort_order in sort_orders:
 
         if sort_order == "peak-height":
-            features_per_interval.sort(
-                key=lambda x: x.foreground.peak_height)
+            order = _sort(
+                [x.foreground.peak_height for x in features_per_interval])
 
         elif sort_order == "peak-width":
-            features_per_interval.sort(
-                key=lambda x: x.foreground.peak_width)
+            order = _sort(
+                [x.foreground.peak_width for x in features_per_interval])
 
         elif sort_order == "interval-width":
-            features_per_interval.sort(
-                key=lambda x: x.interval.end - x.interval.start)
+            order = _sort(
+                [x.interval.end - x.interval.start
+                 for x in features_per_interval])
 
         elif sort_order == "interval-score":
             try:
-                features_per_interval.sort(
-                    key=lambda x: float(x.interval.score))
+                order = _sort(
+                    [float(x.interval.score) for x in features_per_interval])
             except IndexError:
                 E.warn("score field not present - no output")
                 continue
@@ -438,7 +587,9 @@ def outputMatrices(features_per_interval,
                 E.warn("score field not a valid number - no output")
                 continue
 
-        writeMatricesForSortOrder(features_per_interval,
+        writeMatricesForSortOrder(names,
+                                  matrices,
+                                  order,
                                   bins,
                                   foreground_track,
                                   control_tracks,
@@ -446,37 +597,49 @@ def outputMatrices(features_per_interval,
                                   sort_order)
 
 
-def buildDensityMatrices(bedfile,
-                         fg_file,
-                         control_files,
-                         counter,
-                         window_size=1000,
-                         bin_size=10,
-                         strand_specific=False,
-                         centring_method="reads",
-                         use_interval=False,
-                         random_shift=False,
-                         smooth_method="none",
-                         report_step=1000):
+def buildBins(window_size=1000, bin_size=10):
+    '''return the bins centered at the peak-center and then
+    stretching outwards.'''
+    return numpy.arange(-window_size + bin_size // 2,
+                        +window_size,
+                        bin_size)
+
+
+def iterateDensities(bedfile,
+                     fg_file,
+                     control_files,
+                     counter,
+                     window_size=1000,
+                     bin_size=10,
+                     strand_specific=False,
+                     centring_method="reads",
+                     use_interval=False,
+                     random_shift=False,
+                     smooth_method="none",
+                     report_step=1000,
+                     stats=None):
     '''compute densities and peakshape parameters
     in intervals given by *bedfile* using reads in *fg_file*.
 
     If *control_files* are given, densities are produced for
     these as well.
 
-    Returns a list of results for each interval in *bedfile* of
-    type IntervalData and an array of bin-values.
+    Yields a result of type IntervalData for each interval
+    in *bedfile*.
+
+    If *stats* is given, interval counts are added to this
+    :class:`E.Counter` and nothing is logged, so that the
+    caller can report progress.
     '''
 
-    if window_size:
-        # bins are centered at peak-center and then stretching outwards.
-        bins = numpy.arange(-window_size + bin_size // 2,
-                            +window_size,
-                            bin_size)
+    bins = buildBins(window_size, bin_size)
 
-    result = []
-    c = E.Counter()
-    c.input = 0
+    if stats is None:
+        c = E.Counter()
+        log = True
+    else:
+        c = stats
+        log = False
 
     for bed in bedfile:
         c.input += 1
@@ -485,7 +648,7 @@ def buildDensityMatrices(bedfile,
         #    c.skipped += 1
         #    continue
 
-        if c.input % report_step == 0:
+        if log and c.input % report_step == 0:
             E.info("iteration: %i" % c.input)
 
         features = counter.countInInterval(
@@ -533,12 +696,173 @@ def buildDensityMatrices(bedfile,
             if shifted:
                 shifted._replace(hist=shifted.hist[::-1])
 
-        result.append(IntervalData._make((features, bed, control, shifted)))
         c.added += 1
+        yield IntervalData._make((features, bed, control, shifted))
 
-    E.info("interval processing: %s" % c)
+    if log:
+        E.info("interval processing: %s" % c)
 
-    return result, bins
+
+def buildDensityMatrices(bedfile,
+                         fg_file,
+                         control_files,
+                         counter,
+                         window_size=1000,
+                         bin_size=10,
+                         **kwargs):
+    '''compute densities and peakshape parameters, see
+    :func:`iterateDensities`.
+
+    Returns a list of results for each interval in *bedfile* of
+    type IntervalData and an array of bin-values.
+    '''
+    result = list(iterateDensities(bedfile,
+                                   fg_file,
+                                   control_files,
+                                   counter,
+                                   window_size=window_size,
+                                   bin_size=bin_size,
+                                   **kwargs))
+    return result, buildBins(window_size, bin_size)
+
+
+def openInputFiles(infile,
+                   control_filenames,
+                   file_format="bam",
+                   shift=0,
+                   block_size=0,
+                   smooth_method=None):
+    '''open the foreground and control files and build a counter.
+
+    returns a tuple (fg_file, control_files, counter).
+    '''
+    control_files = []
+
+    if file_format == "bigwig":
+        fg_file = pyBigWig.open(infile)
+        for control_file in control_filenames:
+            control_files.append(pyBigWig.open(control_file))
+        counter = bam2peakshape.CounterBigwig(
+            smooth_method=smooth_method)
+
+    elif file_format == "bam":
+        fg_file = pysam.AlignmentFile(infile, "rb")
+        for control_file in control_filenames:
+            control_files.append(pysam.AlignmentFile(control_file, "rb"))
+        counter = bam2peakshape.CounterBam(
+            shift=shift,
+            block_size=block_size,
+            smooth_method=smooth_method)
+
+    return fg_file, control_files, counter
+
+
+# light-weight interval passed to worker processes
+Interval = collections.namedtuple(
+    "Interval",
+    "index contig start end strand")
+
+# input files and parameters of a worker process
+_worker_state = {}
+
+
+def _initWorker(infile, control_filenames, open_kwargs, count_kwargs):
+    '''open input files in a worker process.'''
+    fg_file, control_files, counter = openInputFiles(
+        infile, control_filenames, **open_kwargs)
+    _worker_state.update({"fg_file": fg_file,
+                          "control_files": control_files,
+                          "counter": counter,
+                          "count_kwargs": count_kwargs})
+
+
+def _processShard(shard):
+    '''compute densities for a shard of intervals in a worker process.
+
+    The random number generator is reseeded for each shard, as forked
+    workers otherwise share the random state of the parent process.
+
+    Workers do not log, as their output would be interleaved with
+    the output of the parent. The interval counts are returned
+    instead and reported by the parent.
+
+    returns a tuple of the results and a dictionary of counts.
+    '''
+    seed, intervals = shard
+    numpy.random.seed(seed)
+    stats = E.Counter()
+    result = list(iterateDensities(
+        intervals,
+        _worker_state["fg_file"],
+        _worker_state["control_files"],
+        _worker_state["counter"],
+        stats=stats,
+        **_worker_state["count_kwargs"]))
+    return result, dict(stats.items())
+
+
+def iterateDensitiesParallel(bedfile,
+                             infile,
+                             control_filenames,
+                             num_processes=2,
+                             shard_size=1000,
+                             open_kwargs=None,
+                             **kwargs):
+    '''compute densities and peakshape parameters in parallel.
+
+    Intervals in *bedfile* are split into shards of at most
+    *shard_size* consecutive intervals on the same contig. Each shard
+    is processed by one of *num_processes* worker processes that open
+    *infile* and *control_filenames* themselves. *open_kwargs* are
+    passed to :func:`openInputFiles` and other keyword arguments to
+    :func:`iterateDensities`.
+
+    Yields the same as :func:`iterateDensities` in the order of the
+    intervals in *bedfile*.
+    '''
+
+    beds = list(bedfile)
+    strand_specific = kwargs.get("strand_specific", False)
+
+    shards = []
+    shard = []
+    for index, bed in enumerate(beds):
+        if shard and (len(shard) == shard_size or
+                      shard[-1].contig != bed.contig):
+            shards.append(shard)
+            shard = []
+        if strand_specific:
+            strand = bed.strand
+        else:
+            strand = "."
+        shard.append(
+            Interval._make((index, bed.contig, bed.start, bed.end, strand)))
+    if shard:
+        shards.append(shard)
+
+    E.info("processing %i intervals in %i shards with %i processes" %
+           (len(beds), len(shards), num_processes))
+
+    # one seed per shard so that results do not depend on
+    # which worker processes a shard
+    shards = [(random.randint(0, 2 ** 31 - 1), x) for x in shards]
+
+    pool = multiprocessing.Pool(
+        num_processes,
+        initializer=_initWorker,
+        initargs=(infile, control_filenames, open_kwargs or {}, kwargs))
+    c = E.Counter()
+    try:
+        # shards are returned in input order
+        for result, counts in pool.imap(_processShard, shards):
+            c += counts
+            for x in result:
+                yield x._replace(interval=beds[x.interval.index])
+    finally:
+        pool.close()
+        pool.join()
+
+    E.info("interval processing: %s" % c)
 
 
 def main(argv=None):
@@ -560,94 +884,109 @@ def main(argv=None):
         E.info("using control files: %s" % ",".join(options.control_files))
 
     infile, bedfile = args
-    control_files = []
-
-    if options.format == "bigwig":
-        fg_file = pyBigWig.open(infile)
-        for control_file in options.control_files:
-            control_files.append(pyBigWig.open(control_file))
-        counter = bam2peakshape.CounterBigwig(
-            smooth_method=options.smooth_method)
 
-    elif options.format == "bam":
-        fg_file = pysam.AlignmentFile(infile, "rb")
-        for control_file in options.control_files:
-            control_files.append(pysam.AlignmentFile(control_file, "rb"))
-        counter = bam2peakshape.CounterBam(
-            shift=options.shift,
-            smooth_method=options.smooth_method)
-
-    features_per_interval, bins = buildDensityMatrices(
-        Bed.iterator(iotools.open_file(bedfile)),
-        fg_file,
-        control_files,
-        counter,
-        window_size=options.window_size,
-        bin_size=options.bin_size,
-        strand_specific=options.strand_specific,
-        centring_method=options.centring_method,
-        use_interval=options.use_interval,
-        random_shift=options.random_shift,
-        smooth_method=options.smooth_method,
-        report_step=options.report_step)
-
-    if len(features_per_interval) == 0:
-        E.warn("no data - no output")
-        E.stop()
-        return
-
-    outputFeatureTable(options.stdout, features_per_interval, bins)
-
-    # apply normalization
-    # Note: does not normalize control?
-    # Needs reworking, currently it does not normalize across
-    # all samples nor does the work "sum" reflect the per million
-    # normalization.
-    if options.normalization == "sum":
-        E.info("starting sum normalization")
-        # get total counts across all intervals
-        norm = 0.0
-        for foreground, bed, controls, shifted in features_per_interval:
-            norm += sum(foreground.counts)
-        # per million
-        norm /= float(1000000)
-        E.info("sum/million normalization with %f" % norm)
-
-        # normalise
-        new_data = []
-        for foreground, bed, controls, shifted in features_per_interval:
-            foreground = foreground._replace(
-                counts=numpy.array(foreground.counts,
-                                   dtype=numpy.float) / norm)
-            new_controls = []
-            for control in controls:
-                new_controls.append(
-                    control._replace(
-                        counts=numpy.array(control.counts,
-                                           dtype=numpy.float) / norm))
-            if shifted:
-                shifted = shifted._replace(
-                    counts=numpy.array(shifted.counts,
-                                       dtype=numpy.float) / norm)
-            new_data.append(IntervalData._make((
-                foreground, bed, new_controls, shifted)))
-        features_per_interval = new_data
+    if options.sorted_intervals:
+        block_size = options.fetch_block_size
     else:
-        E.info("no normalization performed")
+        block_size = 0
+
+    open_kwargs = dict(file_format=options.format,
+                       shift=options.shift,
+                       block_size=block_size,
+                       smooth_method=options.smooth_method)
+
+    count_kwargs = dict(window_size=options.window_size,
+                        bin_size=options.bin_size,
+                        strand_specific=options.strand_specific,
+                        centring_method=options.centring_method,
+                        use_interval=options.use_interval,
+                        random_shift=options.random_shift,
+                        smooth_method=options.smooth_method,
+                        report_step=options.report_step)
+
+    if options.num_processes > 1:
+        features_per_interval = iterateDensitiesParallel(
+            Bed.iterator(iotools.open_file(bedfile)),
+            infile,
+            options.control_files,
+            num_processes=options.num_processes,
+            shard_size=options.shard_size,
+            open_kwargs=open_kwargs,
+            **count_kwargs)
+    else:
+        fg_file, control_files, counter = openInputFiles(
+            infile, options.control_files, **open_kwargs)
 
-    # center bins
-    out_bins = bins[:-1] + options.bin_size
+        features_per_interval = iterateDensities(
+            Bed.iterator(iotools.open_file(bedfile)),
+            fg_file,
+            control_files,
+            counter,
+            **count_kwargs)
 
-    # build tracks
-    def _toTrack(filename):
-        return os.path.splitext(os.path.basename(filename))[0]
+    bins = buildBins(options.window_size, options.bin_size)
 
-    outputMatrices(features_per_interval,
-                   out_bins,
-                   foreground_track=_toTrack(infile),
-                   control_tracks=[_toTrack(x) for x in options.control_files],
-                   shifted=options.random_shift,
-                   sort_orders=options.sort_orders)
+    if options.normalization == "sum":
+        dtype = numpy.float64
+    else:
+        dtype = numpy.int64
+
+    if options.matrix_tmpdir:
+        tmpdir = tempfile.mkdtemp(dir=options.matrix_tmpdir)
+        E.info("writing matrices to temporary directory %s" % tmpdir)
+    else:
+        tmpdir = None
+
+    try:
+        # the feature table is output while the matrices are built
+        features_per_interval, matrices = buildMatrices(
+            outputFeatureTable(options.stdout, features_per_interval, bins),
+            ncontrols=len(options.control_files),
+            shifted=options.random_shift,
+            dtype=dtype,
+            tmpdir=tmpdir)
+
+        if len(features_per_interval) == 0:
+            E.warn("no data - no output")
+            E.stop()
+            return
+
+        # apply normalization
+        # Note: does not normalize control?
+        # Needs reworking, currently it does not normalize across
+        # all samples nor does the work "sum" reflect the per million
+        # normalization.
+        if options.normalization == "sum":
+            E.info("starting sum normalization")
+            # get total counts across all intervals, per million
+            norm = matrices[0].sum() / float(1000000)
+            E.info("sum/million normalization with %f" % norm)
+
+            # normalise in place
+            for matrix in matrices:
+                matrix /= norm
+        else:
+            E.info("no normalization performed")
+
+        # center bins
+        out_bins = bins[:-1] + options.bin_size
+
+        # build tracks
+        def _toTrack(filename):
+            return os.path.splitext(os.path.basename(filename))[0]
+
+        outputMatrices(features_per_interval,
+                       matrices,
+                       out_bins,
+                       foreground_track=_toTrack(infile),
+                       control_tracks=[_toTrack(x) for x in options.control_files],
+                       shifted=options.random_shift,
+                       sort_orders=options.sort_orders)
+    finally:
+        if tmpdir:
+            # release the memory-mapped files before removing them
+            matrices = None
+            shutil.rmtree(tmpdir)
 
     # write footer and output benchmark information.
     E.stop()
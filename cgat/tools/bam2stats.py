@@ -297,6 +297,13 @@ With CINS: Insertion into the reference (consumes read, but not
 reference) and CDEL=Deletion from the reference (consumes reference,
 but not read).
 
+Per-read details can be written in a columnar format (npz, feather
+or parquet, determined by the filename extension, see
+:mod:`cgat.ColumnarOutput`) with ``--details-columnar-file``. This
+is faster to write and to load than the tab-separated details table
+(``--output-details``) and can be used instead of or in addition to
+it.
+
 Command line options
 --------------------
 
@@ -418,6 +425,12 @@ def main(argv=None):
         help="add alignment details to per-read details. Implies --output-details "
         "[%default]")
 
+    parser.add_option(
+        "--details-columnar-file", dest="details_columnar_file", type="string",
+        help="write per-read details to this file in a columnar format. "
+        "The format is determined by the extension (npz, feather or "
+        "parquet) [%default]")
+
     parser.add_option(
         "-q", "--fastq-file", dest="filename_fastq",
         help="filename with sequences and quality scores. This file is only "
@@ -440,6 +453,7 @@ def main(argv=None):
         output_details=False,
         output_readmap=False,
         add_alignment_details=False,
+        details_columnar_file=None,
     )
 
     # add common options (-h/--help, ...) and parse command line
@@ -489,7 +503,8 @@ def main(argv=None):
                         outfile_details=outfile_details,
                         add_alignment_details=options.add_alignment_details,
                         outfile_readmap=outfile_readmap,
-                        detailed_count=options.detailed_count)
+                        detailed_count=options.detailed_count,
+                        details_columnar_file=options.details_columnar_file)
 
     if max_hi > 0 and max_hi != max(nh_all.keys()):
         E.warn("max_hi(%i) is inconsistent with max_nh (%i) "
@@ -33,7 +33,17 @@ This tools allows users to compare the per base coverage between
 two BAM files. The output includes all bases in the supplied reference
 fasta except those with no coverage in the input BAMs.
 
-At present the --interval or -i option has not been implemented.
+Coverage is computed in windows of ``--window-size`` bases. For each
+window, the depth in all BAM files is collected in a matrix of
+positions by files, so memory usage is bounded by the window size and
+the number of files. Reads are counted over their aligned span
+including deletions and skipped regions. Unmapped, secondary,
+QC-failed and duplicate reads are ignored as well as paired reads
+that are not properly paired.
+
+If ``--intervals-bed-file`` is given, only positions within the
+intervals in the :term:`bed` formatted file are output. Overlapping
+intervals are merged.
 
 Command line options
 --------------------
@@ -46,8 +56,53 @@ Command line options
 
 import sys
 import re
+import collections
+import numpy
 import pysam
 import cgatcore.experiment as E
+import cgatcore.iotools as iotools
+import cgat.Bed as Bed
+import cgat.Intervals as Intervals
+
+# reads with any of these flags are not counted, as in pysam's
+# default pileup: unmapped, secondary, qc-fail, duplicate
+FILTER_FLAGS = 0x4 | 0x100 | 0x200 | 0x400
+
+
+def getWindowCoverage(samfile, contig, start, end):
+    """return an array with the read depth at each position
+    of the window *start* to *end* on *contig*."""
+
+    starts, ends = [], []
+    for read in samfile.fetch(contig, start, end):
+        flag = read.flag
+        if flag & FILTER_FLAGS:
+            continue
+        # skip orphans, paired reads that are not properly paired
+        if flag & 0x1 and not flag & 0x2:
+            continue
+        read_end = read.reference_end
+        if read_end is None:
+            continue
+        starts.append(read.reference_start)
+        ends.append(read_end)
+
+    size = end - start
+    starts = numpy.clip(numpy.array(starts, dtype=numpy.int64) - start,
+                        0, size)
+    ends = numpy.clip(numpy.array(ends, dtype=numpy.int64) - start,
+                      0, size)
+    diff = (numpy.bincount(starts, minlength=size + 1) -
+            numpy.bincount(ends, minlength=size + 1))
+    return numpy.cumsum(diff[:size], dtype=numpy.int32)
+
+
+def iterateWindows(regions, window_size):
+    """split *regions*, a list of (start, end) tuples, into
+    windows of at most *window_size* bases."""
+    for start, end in regions:
+        for window_start in range(start, end, window_size):
+            yield window_start, min(end, window_start + window_size)
 
 
 def main(argv=None):
@@ -74,9 +129,15 @@ def main(argv=None):
                       help="regular expression to extract identifier from "
                       "filename [%default].")
 
+    parser.add_option("-w", "--window-size", dest="window_size",
+                      type="int",
+                      help="size of windows in which coverage is "
+                      "computed [%default].")
+
     parser.set_defaults(
         filename_intervals=None,
         regex_identifier="(.*)",
+        window_size=1000000,
     )
 
     # add common options (-h/--help, ...) and parse command line
@@ -89,10 +150,8 @@ def main(argv=None):
     for f in args:
         samfiles.append(pysam.AlignmentFile(f, "rb"))
 
-    if options.filename_intervals:
-        raise NotImplementedError(
-            "It is not yet possible to specify intervals of interest.\
-            Repeat command without intervals option.")
+    if options.window_size <= 0:
+        raise ValueError("--window-size needs to be positive")
 
     titles = [re.search(options.regex_identifier, x).groups()[0] for x in args]
 
@@ -100,42 +159,49 @@ def main(argv=None):
 
     ninput, nskipped, noutput = 0, 0, 0
     contigs = samfiles[0].references
+    contig_lengths = dict(zip(contigs, samfiles[0].lengths))
 
+    if options.filename_intervals:
+        intervals = collections.defaultdict(list)
+        for bed in Bed.iterator(iotools.open_file(options.filename_intervals)):
+            intervals[bed.contig].append((bed.start, bed.end))
+        regions = {}
+        for contig, ii in intervals.items():
+            if contig not in contig_lengths:
+                continue
+            length = contig_lengths[contig]
+            regions[contig] = [(max(0, start), min(length, end))
+                               for start, end in Intervals.combine(ii)
+                               if start < length]
+    else:
+        regions = dict([(contig, [(0, length)])
+                        for contig, length in contig_lengths.items()])
+
+    outf = options.stdout
     for contig in contigs:
+        ninput += 1
 
-        missing_contig = False
-
-        positions = {}
-
-        # lazy way: use dictionary
-        for x, f in enumerate(samfiles):
-            try:
-                i = f.pileup(contig)
-            except ValueError:
-                missing_contig = True
-                break
-
-            for v in i:
-                vp = v.pos
-                if vp in positions:
-                    positions[vp].append(v.n)
-                else:
-                    positions[vp] = [0] * x + [v.n]
-
-            # fill with 0 those not touched in this file
-            for p in list(positions.keys()):
-                if len(positions[p]) <= x:
-                    positions[p].append(0)
+        if contig not in regions:
+            continue
 
-        if missing_contig:
+        if any([contig not in f.references for f in samfiles]):
             nskipped += 1
             continue
 
         noutput += 1
-        for pos in sorted(positions.keys()):
-            vals = positions[pos]
-            options.stdout.write("%s\t%i\t%s\n" % (contig, pos,
-                                                   "\t".join(map(str, vals))))
+        for start, end in iterateWindows(regions[contig],
+                                         options.window_size):
+            depths = numpy.column_stack(
+                [getWindowCoverage(f, contig, start, end) for f in samfiles])
+            covered = numpy.flatnonzero(depths.any(axis=1))
+            if len(covered) == 0:
+                continue
+
+            outf.write("".join(
+                ["%s\t%i\t%s\n" % (contig, start + pos,
+                                   "\t".join(map(str, row)))
+                 for pos, row in zip(covered.tolist(),
+                                     depths[covered].tolist())]))
 
     E.info("ninput=%i, noutput=%i, nskipped=%i" % (ninput, noutput, nskipped))
 
@@ -322,7 +322,6 @@ def merge(iterator,
 
             a = to_join[0]
             a.end = max([entry.end for entry in to_join])
-            a.score = len(to_join)
             yield a
             c.output += 1
 
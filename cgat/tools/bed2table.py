@@ -37,6 +37,16 @@ motif
 
    Search for a specified motif e.g. using --motif-sequence=TTTT.
 
+motifs
+
+   Count occurrences of a set of motifs given in iupac notation in
+   ``--motifs-file``. The file contains one motif per line with the
+   motif name and the pattern separated by a tab. Matches on both
+   strands are counted (see ``--motif-strand``) and matching is
+   case-insensitive. The output contains one column per motif.
+   Intervals are processed in batches of ``--batch-size`` intervals
+   and all motifs are counted in a single pass over each sequence.
+
 
 Usage
 -----
@@ -92,6 +102,7 @@ Command line options
 import re
 import sys
 import collections
+import itertools
 import cgat.GTF as GTF
 import cgat.Bed as Bed
 import cgatcore.iotools as iotools
@@ -99,6 +110,7 @@ import cgatcore.experiment as E
 import cgat.IndexedFasta as IndexedFasta
 import cgat.SequenceProperties as SequenceProperties
 import cgat.Intervals as Intervals
+import cgat.Motifs as Motifs
 import numpy
 import pysam
 
@@ -110,6 +122,11 @@ class Counter(object):
     def __init__(self, fasta=None, *args, **kwargs):
         self.fasta = fasta
 
+    def prepare(self, beds):
+        '''called with a batch of intervals before each interval in
+        the batch is counted.'''
+        pass
+
     def update(self, bed):
         self.bed = bed
         self.count(bed)
@@ -355,6 +372,33 @@ class CounterMotif(Counter):
         return str(self.result)
 
 
+class CounterMotifs(Counter):
+
+    '''count occurrences of several iupac motifs.
+
+    Motifs are counted for a batch of intervals at a time.
+    '''
+
+    def __init__(self, motifs, both_strands=True, *args, **kwargs):
+        Counter.__init__(self, *args, **kwargs)
+        assert self.fasta, "Counter requires a genomic sequence"
+        self.scanner = Motifs.MotifScanner(motifs, both_strands=both_strands)
+        self.headers = ["%s_counts" % x for x in self.scanner.names]
+        self.results = iter([])
+
+    def prepare(self, beds):
+        sequences = [self.fasta.getSequence(bed.contig, "+",
+                                            bed.start, bed.end)
+                     for bed in beds]
+        self.results = iter(self.scanner.count(sequences))
+
+    def count(self, bed):
+        self.result = next(self.results)
+
+    def __str__(self):
+        return "\t".join(map(str, self.result))
+
+
 class CounterCompositionCpG(CounterCompositionNucleotides):
 
     '''compute CpG frequencies as well as nucleotide frequencies.
@@ -511,6 +555,23 @@ class ClassifierChIPSeq(GeneModelAnalysis.Classifier):
         return "\t".join(h)
 
 
+def iterate_batches(iterator, counters, batch_size):
+    '''iterate over intervals in *iterator*.
+
+    Intervals are read in batches of *batch_size*. Each batch is
+    passed to the :meth:`prepare` method of all *counters* before its
+    intervals are returned.
+    '''
+    while True:
+        beds = list(itertools.islice(iterator, batch_size))
+        if not beds:
+            break
+        for counter in counters:
+            counter.prepare(beds)
+        for bed in beds:
+            yield bed
+
+
 def main(argv=None):
 
     if argv is None:
@@ -547,7 +608,8 @@ def main(argv=None):
                  "composition-na",
                  "composition-cpg",
                  "classifier-chipseq",
-                 "motif"),
+                 "motif",
+                 "motifs"),
         help="select counters to apply [default=%default].")
 
     parser.add_option(
@@ -555,6 +617,22 @@ def main(argv=None):
         help="specify a sequence to search for"
         "[default=%default].")
 
+    parser.add_option(
+        "--motifs-file", dest="motifs_file", type="string",
+        help="filename with motif names and iupac patterns for counter "
+        "motifs [default=%default].")
+
+    parser.add_option(
+        "--motif-strand", dest="motif_strand", type="choice",
+        choices=("both", "forward"),
+        help="strands to count motifs on for counter motifs "
+        "[default=%default].")
+
+    parser.add_option(
+        "--batch-size", dest="batch_size", type="int",
+        help="number of intervals to process at a time "
+        "[default=%default].")
+
     parser.add_option(
         "-o", "--offset", dest="offsets", type="int", action="append",
         help="tag offsets for tag counting - supply as many as there "
@@ -599,7 +677,10 @@ def main(argv=None):
         bed_headers=None,
         filename_gff=[],
         has_header=False,
-        motif_sequence=None
+        motif_sequence=None,
+        motifs_file=None,
+        motif_strand="both",
+        batch_size=10000
     )
 
     (options, args) = E.start(parser)
@@ -625,6 +706,9 @@ def main(argv=None):
     if "motif" in options.counters and not options.motif_sequence:
         raise ValueError("if using motif must specify a motif-sequence")
 
+    if "motifs" in options.counters and not options.motifs_file:
+        raise ValueError("if using motifs must specify a motifs-file")
+
     # get files
     if options.genome_file:
         fasta = IndexedFasta.IndexedFasta(options.genome_file)
@@ -681,9 +765,21 @@ def main(argv=None):
             counters.append(CounterMotif(fasta=fasta,
                                          motif=options.motif_sequence))
 
+        elif c == "motifs":
+            with iotools.open_file(options.motifs_file) as inf:
+                motifs = Motifs.read_motifs(inf)
+            E.info("read %i motifs from %s" %
+                   (len(motifs), options.motifs_file))
+            counters.append(CounterMotifs(
+                motifs,
+                both_strands=options.motif_strand == "both",
+                fasta=fasta))
+
     extra_fields = None
 
-    for bed in Bed.iterator(options.stdin):
+    for bed in iterate_batches(Bed.iterator(options.stdin),
+                               counters,
+                               options.batch_size):
 
         if extra_fields is None:
 
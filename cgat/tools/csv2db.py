@@ -14,17 +14,26 @@ auto-detected.
 Read a table from stdin and create an sqlite3 database. By default,
 the database will reside in a file called csvdb and in a table csv.
 
-.. todo::
+The following loading methods are available (``--load-method``):
 
-   Use file import where appropriate to speed up loading. Currently, this is
-   not always the case.
+pandas
+   load the table through pandas in chunks of ``--chunk-size`` rows.
+   This is the default and works with all backends.
+
+chunked
+   bulk loader for sqlite. Column types are inferred from the first
+   ``--sample-size`` rows. The rows are then inserted in batches of
+   ``--chunk-size`` rows within a single transaction. Journaling and
+   synchronous writes are turned off during the load and indices are
+   created once all rows have been inserted. Values are passed on as
+   text and converted by sqlite according to the column type.
 
 Usage
 -----
 
 Example::
 
-   python csv2db.py -b sqlite < stdin 
+   python csv2db.py -b sqlite < stdin
 
 Type::
 
@@ -38,11 +47,261 @@ Command line options
 '''
 
 import sys
-from cgatcore.csv2db import main
-
+import re
 import csv
+import operator
+import itertools
+import sqlite3
+
+import cgatcore.experiment as E
+import cgatcore.database as database
+from cgatcore.csv2db import buildParser, run, get_flavour, quote_tablename
+
 csv.field_size_limit(sys.maxsize)
 
 
+def infer_column_types(rows, ncolumns, missing_values=("na", "NA", "")):
+    '''infer sqlite column types from *rows*.
+
+    A column is INTEGER if all values that are not missing are
+    integers, REAL if they are numbers and TEXT otherwise. Columns
+    without values are TEXT.
+
+    return a list of column types.
+    '''
+    missing_values = set(missing_values)
+    types = []
+    for x in range(ncolumns):
+        values = [row[x] for row in rows
+                  if x < len(row) and row[x] not in missing_values]
+        column_type = "TEXT"
+        if values:
+            for t, f in (("INTEGER", int), ("REAL", float)):
+                try:
+                    for value in values:
+                        f(value)
+                except ValueError:
+                    continue
+                column_type = t
+                break
+        types.append(column_type)
+    return types
+
+
+def iterate_csv(infile, separator="\t"):
+    '''iterate over rows in *infile*, skipping comment lines.'''
+    return csv.reader(
+        (line for line in infile if not line.startswith("#")),
+        delimiter=separator)
+
+
+def load_chunked(infile, options):
+    '''load table from *infile* into an sqlite database in batches.
+
+    Column types are inferred from a sample of rows and the rows are
+    inserted with `executemany` in a single transaction with
+    journaling and synchronous writes turned off. Indices are
+    created after loading.
+
+    return a counter.
+    '''
+    counter = E.Counter()
+
+    flavour = get_flavour(options.database_url)
+    if flavour != "sqlite":
+        raise ValueError(
+            "load method 'chunked' requires an sqlite database, "
+            "got {}".format(options.database_url))
+
+    tablename = quote_tablename(options.tablename, flavour=flavour)
+
+    if "tab" in options.dialect:
+        separator = "\t"
+    else:
+        separator = ","
+
+    reader = iterate_csv(infile, separator)
+
+    # handle header logic up-front
+    if options.header_names is None or options.replace_header:
+        try:
+            header = next(reader)
+        except StopIteration:
+            header = None
+        if options.replace_header:
+            if options.header_names is None:
+                raise ValueError("No replacement headers provided")
+            header = options.header_names
+    else:
+        header = options.header_names
+
+    if header is None:
+        if options.allow_empty:
+            E.warn("table is empty")
+            return counter
+        raise ValueError("table is empty")
+
+    columns = list(header)
+    if options.lowercase_columns:
+        columns = [x.lower() for x in columns]
+    if options.first_column:
+        columns[0] = options.first_column
+
+    take = [x for x, column in enumerate(header)
+            if column not in options.ignore_columns]
+    columns = [quote_tablename(columns[x], flavour=flavour) for x in take]
+    if not columns:
+        raise ValueError("all columns have been ignored")
+
+    sample = list(itertools.islice(reader, options.sample_size))
+    if len(sample) == 0 and not options.allow_empty:
+        raise ValueError("table is empty")
+
+    # empty fields are loaded as NULL as well
+    missing_values = set(options.missing_values)
+    missing_values.add("")
+    ncolumns = len(header)
+    types = infer_column_types(
+        [[row[x] for x in take] for row in sample if len(row) == ncolumns],
+        len(take),
+        missing_values=missing_values)
+
+    for column, column_type in zip(columns, types):
+        E.debug("column {}: {}".format(column, column_type))
+
+    dbhandle = database.connect(url=options.database_url).raw_connection()
+    cc = dbhandle.cursor()
+
+    cc.execute("PRAGMA journal_mode=OFF")
+    cc.execute("PRAGMA synchronous=OFF")
+    cc.execute("PRAGMA temp_store=MEMORY")
+
+    fields = ["{} {}".format(x, y) for x, y in zip(columns, types)]
+    if options.keys:
+        fields.append("PRIMARY KEY ({})".format(",".join(options.keys)))
+
+    if not options.append:
+        cc.execute("DROP TABLE IF EXISTS {}".format(tablename))
+    cc.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(
+        tablename, ", ".join(fields)))
+
+    # missing values are converted to NULL by sqlite
+    value = "?"
+    for missing_value in sorted(missing_values):
+        value = "NULLIF({}, '{}')".format(value,
+                                          missing_value.replace("'", "''"))
+    statement = "INSERT INTO {} ({}) VALUES ({})".format(
+        tablename, ",".join(columns), ",".join([value] * len(columns)))
+
+    # select columns with itemgetter to avoid a python loop per row
+    if len(take) == ncolumns:
+        select = None
+    elif len(take) == 1:
+        getter = operator.itemgetter(take[0])
+        select = lambda row: (getter(row),)
+    else:
+        select = operator.itemgetter(*take)
+
+    if select is None:
+        rows = itertools.chain(sample, reader)
+    else:
+        rows = map(select, itertools.chain(sample, reader))
+
+    cc.execute("BEGIN")
+    while True:
+        batch = list(itertools.islice(rows, options.chunk_size))
+        if not batch:
+            break
+        try:
+            cc.executemany(statement, batch)
+        except sqlite3.ProgrammingError as ex:
+            raise ValueError(
+                "error loading rows {} to {}, check the number of fields "
+                "in each row: {}".format(
+                    counter.input + 1, counter.input + len(batch), ex))
+        counter.input += len(batch)
+        E.debug("inserted {} rows".format(counter.input))
+    dbhandle.commit()
+
+    cc.execute("PRAGMA synchronous=FULL")
+    cc.execute("PRAGMA journal_mode=DELETE")
+
+    for nindex, index in enumerate(options.indices):
+        try:
+            cc.execute("CREATE INDEX %s_index%i ON %s (%s)" % (
+                tablename, nindex + 1, tablename, index))
+            E.info("added index on column %s" % (index))
+            counter.indexes_created += 1
+        except Exception as ex:
+            E.info("adding index on column %s failed: %s" % (index, ex))
+
+    if options.ignore_empty:
+        for column in columns:
+            cc.execute("SELECT COUNT({}) FROM {}".format(column, tablename))
+            if cc.fetchone()[0] > 0:
+                continue
+            counter.empty_columns += 1
+            try:
+                cc.execute("ALTER TABLE {} DROP COLUMN {}".format(
+                    tablename, column))
+                E.info("removed empty column %s" % (column))
+                counter.empty_columns_removed += 1
+            except Exception as ex:
+                E.info("removing empty column {} failed: {}".format(
+                    column, ex))
+
+    dbhandle.commit()
+
+    cc.execute("SELECT COUNT(*) FROM %s" % (tablename))
+    counter.output = cc.fetchone()[0]
+    cc.close()
+    dbhandle.close()
+
+    return counter
+
+
+def main(argv=sys.argv):
+
+    parser = buildParser()
+
+    parser.add_argument("--load-method", dest="load_method", type=str,
+                        choices=("pandas", "chunked"),
+                        help="method to load table, see documentation ")
+
+    parser.add_argument("--sample-size", dest="sample_size", type=int,
+                        help="number of rows to infer column types from for "
+                        "load method 'chunked' ")
+
+    parser.set_defaults(load_method="pandas",
+                        sample_size=10000)
+
+    args = E.start(parser, argv=argv,
+                   add_database_options=True)
+
+    if args.from_zipped:
+        import gzip
+        infile = gzip.GzipFile(fileobj=args.stdin, mode='r')
+    else:
+        infile = args.stdin
+
+    if args.header_names:
+        if "," in args.header_names:
+            # sqlalchemy.exc.ArgumentError:
+            #     Column must be constructed with a non-blank
+            #     name or assign a non-blank .name before adding to a Table.
+            args.header_names = [x if x else "-" for x in
+                                 args.header_names.split(",")]
+        else:
+            args.header_names = re.split(r"\s+",
+                                         args.header_names.strip())
+
+    if args.load_method == "chunked":
+        E.info(load_chunked(infile, args))
+    else:
+        run(infile, args)
+
+    E.stop()
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -121,10 +121,15 @@ def main(argv=None):
             raise ValueError("please supply columns, min-value, max-value and "
                              "bin-size for on-the-fly computation.")
 
+        if options.columns == "all" and not options.titles:
+            raise ValueError("please supply columns for on-the-fly "
+                             "computation without column titles.")
+
         # try to glean titles from table:
         if options.titles:
+            data = []
             while 1:
-                line = sys.stdin.readline()
+                line = options.stdin.readline()
                 if not line:
                     break
                 if line[0] == "#":
@@ -141,15 +146,16 @@ def main(argv=None):
         bins = numpy.arange(
             options.min_value, options.max_value, float(options.bin_size))
         hh = Histogram.fillHistograms(
-            sys.stdin, options.columns, [bins for x in range(len(options.columns))])
+            options.stdin, options.columns,
+            [bins for x in range(len(options.columns))])
         n = len(hh)
 
         titles = ['bin']
 
         if options.headers:
-            titles.append(options.headers[x])
+            titles.extend(options.headers)
         elif options.titles:
-            titles.append(options.titles[x])
+            titles.extend(options.titles)
         else:
             for x in options.columns:
                 titles.append("col%i" % (x + 1))
@@ -168,72 +174,97 @@ def main(argv=None):
     else:
         # in-situ computation of histograms
         # retrieve data
-        first = True
-        vals = []
-
-        # parse data, convert to floats
-        for l in options.stdin:
+        data = None
 
-            if l[0] == "#":
+        while 1:
+            line = options.stdin.readline()
+            if not line:
+                break
+            if line[0] == "#":
                 continue
+            data = line[:-1].split("\t")
+            break
 
-            data = l[:-1].split("\t")
-
-            if first:
-                first = False
-                ncols = len(data)
-                if options.columns == "all":
-                    options.columns = list(range(ncols))
-
-                vals = [[] for x in options.columns]
-
-                if options.titles:
-                    try:
-                        options.titles = [data[x] for x in options.columns]
-                    except IndexError:
-                        raise IndexError("not all columns %s found in data %s" % (
-                            str(options.columns), str(data)))
-                    continue
+        if data is None:
+            if options.loglevel >= 1:
+                options.stdlog.write("# no data\n")
+            E.stop()
+            sys.exit(0)
 
-            for x in range(len(options.columns)):
+        ncols = len(data)
+        if options.columns == "all":
+            options.columns = list(range(ncols))
+
+        # with a fixed range and bin size, histograms are accumulated
+        # chunk by chunk. Otherwise all values are kept in memory.
+        if options.min_value is not None and \
+           options.max_value is not None and \
+           options.bin_size is not None and \
+           not options.dynamic_bins:
+            bins = Histogram.make_bins(options.min_value,
+                                       options.max_value,
+                                       bin_size=options.bin_size)
+            histograms = [Histogram.ArrayHistogram(bins)
+                          for x in options.columns]
+        else:
+            histograms = None
+
+        chunks = [[] for x in options.columns]
+        nvalues = [0] * len(options.columns)
+
+        def add_values(x, values):
+            nvalues[x] += len(values)
+            if histograms is None:
+                chunks[x].append(values)
+                return
+            if not options.ignore_out_of_range:
+                values = numpy.clip(values,
+                                    options.min_value,
+                                    options.max_value)
+            histograms[x].add(values)
 
+        if options.titles:
+            try:
+                options.titles = [data[x] for x in options.columns]
+            except IndexError:
+                raise IndexError("not all columns %s found in data %s" % (
+                    str(options.columns), str(data)))
+        else:
+            for x, column in enumerate(options.columns):
                 try:
-                    v = float(data[options.columns[x]])
-                except IndexError:
-                    print("# IndexError in line:", l[:-1])
+                    add_values(x, numpy.array([float(data[column])]))
+                except (IndexError, ValueError):
                     continue
-                except ValueError:
-                    continue
-
-                vals[x].append(v)
 
-        lines = None
+        # parse remaining data in chunks, ignoring missing values
+        for chunk in Histogram.iterate_columns(options.stdin,
+                                               options.columns):
+            for x, values in enumerate(chunk):
+                add_values(x, values[~numpy.isnan(values)])
 
         hists = []
         titles = []
 
-        if not vals:
-            if options.loglevel >= 1:
-                options.stdlog.write("# no data\n")
-            E.stop()
-            sys.exit(0)
-
         for x in range(len(options.columns)):
 
             if options.loglevel >= 1:
                 options.stdlog.write(
-                    "# column=%i, num_values=%i\n" % (options.columns[x], len(vals[x])))
+                    "# column=%i, num_values=%i\n" % (options.columns[x], nvalues[x]))
 
-            if len(vals[x]) < options.min_data:
+            if nvalues[x] < options.min_data:
                 continue
 
-            h = Histogram.Calculate(vals[x],
-                                    no_empty_bins=options.no_empty_bins,
-                                    increment=options.bin_size,
-                                    min_value=options.min_value,
-                                    max_value=options.max_value,
-                                    dynamic_bins=options.dynamic_bins,
-                                    ignore_out_of_range=options.ignore_out_of_range)
+            if histograms is not None:
+                h = histograms[x].tolist(no_empty_bins=options.no_empty_bins)
+            else:
+                h = Histogram.Calculate(
+                    numpy.concatenate([numpy.zeros(0)] + chunks[x]),
+                    no_empty_bins=options.no_empty_bins,
+                    increment=options.bin_size,
+                    min_value=options.min_value,
+                    max_value=options.max_value,
+                    dynamic_bins=options.dynamic_bins,
+                    ignore_out_of_range=options.ignore_out_of_range)
 
             if options.normalize:
                 h = Histogram.Normalize(h)
@@ -12,10 +12,15 @@ Count the number of alignments to each reference in outfmt6.
 Counts are based on various options specified by --method.
 
 best       This will take the best alignment as judged by the highest
-           bitscore.
-
-
+           bitscore. Ties are broken randomly, use ``--random-seed``
+           for reproducible counts.
 
+Alignments are read in blocks of ``--block-size`` lines. Within each
+block, the best alignment per query is found with array operations
+and references and COGs are counted through integer codes, so memory
+usage does not grow with the number of alignments. Alignments of a
+query need to be consecutive in the input, as is the case for DIAMOND
+output.
 
 TODO::
 Add additional options
@@ -39,10 +44,11 @@ Command line options
 '''
 
 import sys
+import random
 
+import numpy
 import cgatcore.experiment as E
-from cgat.Diamond import *
-import collections
+import cgat.Diamond as Diamond
 import cgatcore.iotools as iotools
 
 
@@ -57,6 +63,18 @@ def readCogMap(cog_map):
     return gene2cog
 
 
+def add_counts(counts, codes, size):
+    '''add the number of occurances of *codes* to *counts*.
+
+    *counts* is extended to *size* entries if necessary.
+    '''
+    if len(counts) < size:
+        counts = numpy.concatenate(
+            [counts, numpy.zeros(size - len(counts), dtype=numpy.int64)])
+    counts += numpy.bincount(codes, minlength=len(counts))
+    return counts
+
+
 def main(argv=None):
     """script main.
 
@@ -90,15 +108,24 @@ def main(argv=None):
                       help="""number of queries to evaluate-
                               will take the first n in the file""")
 
+    parser.add_option("--block-size", dest="block_size", type="int",
+                      help="number of alignments to process "
+                      "at a time [%default]")
+
     parser.set_defaults(method=None,
                         sum_cog=False,
                         evaluate_cog=False,
                         cog_map=None,
-                        nsamples=10000)
+                        nsamples=10000,
+                        block_size=1000000)
 
     # add common options (-h/--help, ...) and parse command line
     (options, args) = E.start(parser, argv=argv)
 
+    # seeded through --random-seed
+    rng = numpy.random.RandomState(random.randint(0, 2 ** 32 - 1))
+    refs = Diamond.CodeTable()
+
     if options.evaluate_cog:
         assert options.cog_map, """must specify an annotation
                                    mapping gene to function (COG)"""
@@ -106,43 +133,37 @@ def main(argv=None):
                                       in the absence of counting"""
 
         E.info("reading gene to function (COG) map %s" % options.cog_map)
-        gene2cog = readCogMap(options.cog_map)
+        cog_map = Diamond.CogMap(readCogMap(options.cog_map))
         E.info("loaded gene to function (COG) map")
 
         E.info("retrieving alignment data")
         options.stdout.write("query\tpbest\tnalignments\n")
 
-        c = 0
-        for alignments in query_iterator(alignment_iterator(options.stdin)):
-            c += 1
-            scores = []
-            if c <= options.nsamples:
-                for alignment in alignments:
-                    scores.append(alignment.score)
-                    best = max(scores)
-                    best_alignments = [
-                        x for x in alignments if x.score == best]
-                    if len(best_alignments) > 1:
-                        best_alignments = random.sample(best_alignments, 1)
-                    best_alignment = best_alignments[0]
-                    best_cog = gene2cog[best_alignment.ref]
-                pbest = float(len(
-                    [gene2cog[x.ref]
-                     for x in alignments
-                     if gene2cog[x.ref] == best_cog])) / len(alignments) * 100
-                nalignments = len(alignments)
-                options.stdout.write(
-                    "\t".join(map(
-                        str, [alignments[0].qid,
-                              pbest,
-                              nalignments])) + "\n"
-                )
-            else:
+        nqueries = 0
+        for block in Diamond.alignment_block_iterator(
+                options.stdin, options.block_size):
+            groups, best = Diamond.best_alignments(block, rng)
+            cogs = cog_map.lookup(
+                refs, refs.encode(block["ref"].values,
+                                  transform=Diamond.parse_ref))
+            # fraction of alignments with the same COG as the best
+            is_best_cog = cogs == cogs[best][groups]
+            nalignments = numpy.bincount(groups)
+            nbest = numpy.bincount(groups, weights=is_best_cog)
+            pbest = nbest / nalignments * 100
+            qids = block["qid"].values[best]
+
+            n = min(len(best), options.nsamples - nqueries)
+            for x in range(n):
+                options.stdout.write("{}\t{}\t{}\n".format(
+                    qids[x], float(pbest[x]), nalignments[x]))
+            nqueries += n
+            if nqueries >= options.nsamples:
                 break
         return
 
     # container for counts
-    counts = collections.defaultdict(int)
+    counts = numpy.zeros(0, dtype=numpy.int64)
     E.info("counting alignments")
     assert options.method, "required option --method"
     if options.method == "best":
@@ -155,27 +176,35 @@ def main(argv=None):
 
             E.info("""reading gene to function (COG) mapping from %s"""
                    % options.cog_map)
-            gene2cog = readCogMap(options.cog_map)
+            cog_map = Diamond.CogMap(readCogMap(options.cog_map))
             E.info("loaded gene to function (COG) mapping")
-
             E.info("summing functional assignments")
-            query_it = query_iterator(alignment_iterator(options.stdin))
-            for best in best_alignment_iterator(query_it):
-                cog = gene2cog[best.ref]
-                # removing uassigned or multiple assignments
-                if cog == "unknown" or cog.find(";") != -1:
-                    continue
-                counts[cog] += 1
         else:
             E.info("counting best alignments")
-            query_it = query_iterator(alignment_iterator(options.stdin))
-            for best in best_alignment_iterator(query_it):
-                counts[best.ref] += 1
+
+        for block in Diamond.alignment_block_iterator(
+                options.stdin, options.block_size):
+            groups, best = Diamond.best_alignments(block, rng)
+            codes = refs.encode(block["ref"].values[best],
+                                transform=Diamond.parse_ref)
+            if options.sum_cog:
+                codes = cog_map.lookup(refs, codes)
+                counts = add_counts(counts, codes, len(cog_map.cogs))
+            else:
+                counts = add_counts(counts, codes, len(refs))
         E.info("finished counting")
 
+        if options.sum_cog:
+            names = cog_map.cogs.names
+        else:
+            names = refs.names
+
         E.info("writing results")
         options.stdout.write("ref\tcount\n")
-        for ref, count in sorted(counts.items()):
+        for ref, count in sorted(zip(names, counts)):
+            # removing uassigned or multiple assignments
+            if options.sum_cog and (ref == "unknown" or ref.find(";") != -1):
+                continue
             options.stdout.write("\t".join([ref, str(count)]) + "\n")
 
     # write footer and output benchmark information.
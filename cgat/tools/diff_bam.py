@@ -68,76 +68,25 @@ Documentation
 
 For read counts to be correct the NH flag to be set correctly.
 
+Alignments of a read are grouped into the same location if their
+alignment spans overlap. Use ``--max-distance`` to group alignments
+whose start positions are within a fixed distance instead.
+
+With ``--output-concordance``, a concordance matrix is written to the
+file ``concordance`` (see ``--output-filename-pattern``). For each
+pair of files it contains the number of reads that map to the same
+locations in both files. The diagonal contains the number of reads
+mapped in each file.
+
 Command line options
 --------------------
 
 '''
 
 import sys
-import itertools
 import pysam
 import cgatcore.experiment as E
-
-
-class multiway_groupby(object):
-    # [k for k, g in groupby('AAAABBBCCDAABBB')] --> A B C D A B
-    # [list(g) for k, g in groupby('AAAABBBCCD')] --> AAAA BBB CC D
-
-    def __init__(self, iterables, key=None):
-        # set up iterators
-        self.it = [itertools.groupby(iterable, key) for iterable in iterables]
-
-        # todo: catch StopIterator for empty iterables
-        self.current = [next(self.it[x]) for x in range(len(iterables))]
-
-        # decide on target key
-        self.targetkey = min([x[0] for x in self.current if x[0] is not None])
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-
-        # check if all iterators exhausted
-        if not any(self.it):
-            raise StopIteration
-
-        # yield all that correspond to target key and update
-        result = []
-        targetkey = self.targetkey
-        updated = 0
-
-        for x, y in enumerate(self.current):
-            key, val = y
-            if key and key == targetkey:
-                # save result (instantiate to prevent overwriting)
-                # in next method
-                result.append(list(val))
-                # advance
-                try:
-                    self.current[x] = next(self.it[x])
-                except StopIteration:
-                    self.it[x] = None
-                    self.current[x] = (None, None)
-                updated += 1
-            else:
-                # return empty result
-                result.append([])
-
-        assert updated > 0, "no updates - infinite loop"
-
-        # decide which is target key
-        try:
-            self.targetkey = min([x[0]
-                                  for x in self.current if x[0] is not None])
-        except ValueError:
-            # if all are None, sequence is empty
-            self.targetkey = None
-
-        return targetkey, result
-
-    def next(self):
-        return self.__next__()
+from cgat.BamTools.bamtools import bams2diff
 
 
 def main(argv=None):
@@ -158,16 +107,27 @@ def main(argv=None):
         help="',' separated list of labels used as headers. "
         " Should correspond in order to command line arguments [%default]")
 
+    parser.add_option(
+        "--max-distance", dest="max_distance", type="int",
+        help="group alignments within this distance into the same "
+        "location. If not given, alignments are grouped if their "
+        "alignment spans overlap [%default]")
+
+    parser.add_option(
+        "--output-concordance", dest="output_concordance",
+        action="store_true",
+        help="output a matrix with the number of reads mapped to the "
+        "same locations for each pair of files [%default]")
+
     parser.set_defaults(
         headers=None,
+        max_distance=None,
+        output_concordance=False,
     )
 
     # add common options (-h/--help, ...) and parse command line
     (options, args) = E.start(parser, argv=argv, add_output_options=True)
 
-    read_length = 50
-    max_distance = read_length
-
     if len(args) < 2:
         raise ValueError("please specify at least two BAM files")
 
@@ -182,59 +142,28 @@ def main(argv=None):
     else:
         headers = ["file%i" % x for x in range(1, len(infiles) + 1)]
 
+    # open the concordance file first so that an existing file is
+    # reported before any output is written
+    if options.output_concordance:
+        concordance_file = E.open_output_file("concordance")
+    else:
+        concordance_file = None
+
     options.stdout.write("read\tnlocations\tnmatched\t%s\t%s\n" %
                          ("\t".join(["%s_nh" % x for x in headers]),
                           "\t".join(["%s_loc" % x for x in headers])))
 
-    ninput, noutput = 0, 0
-    for readname, result in multiway_groupby(infiles, key=lambda x: x.qname):
-        ninput += 1
-        nmatches = 0
-        locations = set()
-
-        # build location directory
-        for r in result:
-            for rr in r:
-                if rr.is_unmapped:
-                    continue
-                locations.add((rr.tid, rr.pos))
-
-        # permit a certain fuzzyness in locations
-        # as some mappers clip and others don't.
-        locations = list(locations)
-        locations.sort()
-        pos2loc = {}
-        last_tid, last_pos, nlocations = None, 0, -1
-        for tid, pos in locations:
-            if tid != last_tid or pos - last_pos > max_distance:
-                nlocations += 1
-            pos2loc[(tid, pos)] = nlocations
-            last_tid, last_pos = tid, pos
-        nlocations += 1
-
-        # code locations
-        codes, nh = [], []
-        for r in result:
-            c = []
-            for rr in r:
-                if rr.is_unmapped:
-                    continue
-                c.append(pos2loc[(rr.tid, rr.pos)])
-            codes.append(",".join(map(str, sorted(c))))
-            nh.append(len(c))
-            if len(c):
-                nmatches += 1
-
-        noutput += 1
-        options.stdout.write("%s\t%i\t%i\t%s\t%s\n" % (
-            readname,
-            nlocations,
-            nmatches,
-            "\t".join(
-                ["%i" % x for x in nh]),
-            "\t".join(codes)))
-
-    E.info("ninput=%i, noutput=%i" % (ninput, noutput))
+    c, concordance = bams2diff(infiles,
+                               options.stdout,
+                               max_distance=options.max_distance)
+
+    if concordance_file is not None:
+        with concordance_file as outf:
+            outf.write("file\t%s\n" % "\t".join(headers))
+            for header, row in zip(headers, concordance):
+                outf.write("%s\t%s\n" % (header, "\t".join(map(str, row))))
+
+    E.info(c)
 
     # write footer and output benchmark information.
     E.stop()
@@ -118,6 +118,7 @@ import string
 import re
 import random
 from itertools import zip_longest
+import numpy
 import pysam
 
 import cgatcore.experiment as E
@@ -371,8 +372,6 @@ def main(argv=None):
 
             if method == "translate":
                 # translate such that gaps are preserved
-                seq = []
-
                 ls = len(re.sub('[%s]' % options.gap_chars, sequence, ""))
 
                 if ls % 3 != 0:
@@ -385,11 +384,8 @@ def main(argv=None):
                     else:
                         raise ValueError(msg)
 
-                for codon in [sequence[x:x + 3] for x in range(0, l, 3)]:
-                    aa = Genomics.MapCodon2AA(codon)
-                    seq.append(aa)
-
-                sequence = "".join(seq)
+                sequence = Genomics.translate(sequence[:l],
+                                              ignore_n=True).upper()
 
             elif method == "back-translate":
                 # translate from an amino acid alignment to codon alignment
@@ -536,17 +532,15 @@ def main(argv=None):
                 sequence = " ".join(seq)
 
             elif method == "translate-to-stop":
-                seq = []
-
-                for codon in [sequence[x:x + 3] for x in range(0, l, 3)]:
-
-                    if Genomics.IsStopCodon(codon):
-                        break
-
-                    aa = Genomics.MapCodon2AA(codon)
-                    seq.append(aa)
-
-                sequence = "".join(seq)
+                sequence = sequence[:l]
+                stops = numpy.flatnonzero(numpy.isin(
+                    Genomics.encodeCodons(sequence, ignore_case=False),
+                    Genomics.STOP_CODON_INDICES))
+                if len(stops) > 0:
+                    sequence = sequence[:3 * stops[0]]
+
+                sequence = Genomics.translate(sequence,
+                                              ignore_n=True).upper()
 
             elif method == "truncate-at-stop":
                 seq = []
@@ -156,20 +156,27 @@ def main(argv=None):
     parser.add_option(
         "--filtering-kmer-size",
         dest="filtering_kmer_size", type="int",
-        help="kmer size for method 'filter-by-sequence' [default=%default].")
+        help="kmer size for method 'filter-by-sequence', at most 21 "
+        "[default=%default].")
 
     parser.add_option(
         "--filtering-min-kmer-matches",
         dest="filtering_min_kmer_matches", type="int",
         help="minimum number of matches 'filter-by-sequence' [default=%default].")
 
+    parser.add_option(
+        "--threads", dest="threads", type="int",
+        help="number of threads to use for method 'filter-by-sequence' "
+        "[default=%default].")
+
     parser.set_defaults(
         method="reconcile",
         chop=False,
         unpaired=False,
         input_filename_fasta=None,
         filtering_kmer_size=10,
-        filtering_min_kmer_matches=20
+        filtering_min_kmer_matches=20,
+        threads=1
     )
 
     # add common options (-h/--help, ...) and parse command line
@@ -293,7 +300,8 @@ def main(argv=None):
                 outf_unmatched1,
                 outf_unmatched2,
                 kmer_size=options.filtering_kmer_size,
-                min_kmer_matches=options.filtering_min_kmer_matches)
+                min_kmer_matches=options.filtering_min_kmer_matches,
+                threads=options.threads)
         options.stdout.write(
             "\t".join(("input", "matched", "unmatched", "percent_matched")) + "\n")
 
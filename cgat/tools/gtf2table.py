@@ -444,6 +444,18 @@ convention. A summary is `here
 For unstranded protocols, all reads and pairs are considered to matching
 in the sense direction.
 
+Columnar output
+---------------
+
+With ``--columnar-file``, the table is also written in a columnar
+format (npz, feather or parquet, determined by the filename
+extension, see :mod:`cgat.ColumnarOutput`). Rows are collected in
+column buffers, which are written in batches. The gene or transcript
+identifier and the source are stored as strings. The read count and
+position counters declare the types of their columns, the column
+types of other counters are inferred from their formatted values. Use ``--columnar-only`` to skip the tab-separated
+output.
+
 Usage
 -----
 
@@ -465,6 +477,7 @@ import cgatcore.experiment as E
 import cgat.GTF as GTF
 import cgat.IndexedFasta as IndexedFasta
 import cgat.GeneModelAnalysis as GeneModelAnalysis
+import cgat.ColumnarOutput as ColumnarOutput
 
 import pyBigWig
 
@@ -628,7 +641,20 @@ def main(argv=None):
                       "score of less will be ignored. "
                       "[default=%default]")
 
+    parser.add_option("--columnar-file", dest="columnar_file",
+                      type="string",
+                      help="also write the table to this file in a "
+                      "columnar format. The format (npz, feather or parquet) "
+                      "is determined from the extension [%default]")
+
+    parser.add_option("--columnar-only", dest="columnar_only",
+                      action="store_true",
+                      help="only write the table given by --columnar-file, "
+                      "do not output a tab-separated table [%default]")
+
     parser.set_defaults(
+        columnar_file=None,
+        columnar_only=False,
         genome_file=None,
         reporter="genes",
         with_values=True,
@@ -662,7 +688,9 @@ def main(argv=None):
 
     # get files
     if options.genome_file:
-        fasta = IndexedFasta.IndexedFasta(options.genome_file)
+        # sequence is shared between counters for each gene
+        fasta = IndexedFasta.SequenceCache(
+            IndexedFasta.IndexedFasta(options.genome_file))
     else:
         fasta = None
 
@@ -915,12 +943,31 @@ def main(argv=None):
     else:
         ffields = lambda x: []
 
-    options.stdout.write("\t".join(
-        header + [x.getHeader() for x in counters]) + "\n")
+    if options.columnar_only and not options.columnar_file:
+        raise ValueError("--columnar-only requires --columnar-file")
+
+    columns = "\t".join(header + [x.getHeader() for x in counters])
+
+    if options.columnar_file:
+        dtypes = [str] * len(header)
+        for counter in counters:
+            dtypes.extend(counter.getDtypes())
+        columnar_writer = ColumnarOutput.ColumnarWriter(
+            options.columnar_file, columns.split("\t"), dtypes=dtypes)
+    else:
+        columnar_writer = None
+
+    if not options.columnar_only:
+        options.stdout.write(columns + "\n")
 
     for gffs in iterator(GTF.iterator(options.stdin)):
         cc.input += 1
 
+        if fasta is not None:
+            fasta.setRegion(gffs[0].contig,
+                            min(x.start for x in gffs),
+                            max(x.end for x in gffs))
+
         for counter in counters:
             counter.update(gffs)
 
@@ -929,14 +976,27 @@ def main(argv=None):
             cc.skipped += 1
             continue
 
-        options.stdout.write("\t".join(
-            fheader(gffs) +
-            ffields(gffs) +
-            [str(counter) for counter in counters]) + "\n")
+        if columnar_writer:
+            row = fheader(gffs) + ffields(gffs)
+            for counter in counters:
+                row.extend(counter.getValues())
+            columnar_writer.append(row)
+
+        if not options.columnar_only:
+            options.stdout.write("\t".join(
+                fheader(gffs) +
+                ffields(gffs) +
+                [str(counter) for counter in counters]) + "\n")
 
         cc.output += 1
 
+    if columnar_writer:
+        columnar_writer.close()
+
     E.info("%s" % str(cc))
+    if fasta is not None:
+        E.info("sequence cache: hits=%i, misses=%i" %
+               (fasta.nhits, fasta.nmisses))
     for counter in counters:
         E.info("%s\t%s" % (repr(counter), str(counter.counter)))
     E.stop()
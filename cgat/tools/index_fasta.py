@@ -65,7 +65,7 @@ Type::
 
 To create indexed DATABASE from SOURCE. Supply - as SOURCE to read from stdin.
 If the output is to be compressed, a spacing for the random access points must
-be supplied.
+be supplied. Blocks are compressed in parallel with ``--threads``.
 
 Type::
 
@@ -201,7 +201,19 @@ def main(argv=None):
         "--compress-index", dest="compress_index",
         action="store_true",
         help="compress index. The default is to use a plain-text, "
-        "human-readable index [default=%default].")
+        "human-readable index. If SOURCE files are given, the compressed "
+        "index is written alongside the plain-text index while building "
+        "the database [default=%default].")
+
+    group.add_option(
+        "--threads", dest="threads", type="int",
+        help="number of threads to use for block compression "
+        "[default=%default].")
+
+    group.add_option(
+        "--block-size", dest="block_size", type="int",
+        help="number of bytes to read at a time from SOURCE "
+        "[default=%default].")
 
     parser.add_option_group(group)
 
@@ -221,6 +233,8 @@ def main(argv=None):
         allow_duplicates=False,
         regex_identifier=None,
         compress_index=False,
+        threads=1,
+        block_size=1 << 20,
         file_format="auto",
         force=False,
         translator=None)
@@ -291,7 +305,7 @@ def main(argv=None):
                                        options.verify_fragment_size,
                                        stdout=options.stdout)
         options.stdout.write("errors=%i\n" % (nerrors2))
-    elif options.compress_index:
+    elif options.compress_index and len(args) == 1:
         fasta = IndexedFasta.IndexedFasta(args[0])
         fasta.compressIndex()
     else:
@@ -313,7 +327,8 @@ def main(argv=None):
         iterator = IndexedFasta.MultipleFastaIterator(
             args[1:],
             regex_identifier=options.regex_identifier,
-            format=options.file_format)
+            format=options.file_format,
+            block_size=options.block_size)
 
         IndexedFasta.createDatabase(
             args[0],
@@ -324,7 +339,9 @@ def main(argv=None):
             clean_sequence=options.clean_sequence,
             allow_duplicates=options.allow_duplicates,
             translator=options.translator,
-            force=options.force)
+            force=options.force,
+            threads=options.threads,
+            binary_index=options.compress_index)
 
     E.stop()
 
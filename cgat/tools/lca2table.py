@@ -9,6 +9,12 @@ Purpose
 
 Summarise results of LCA analysis - from mtools lcamapper.sh
 
+With ``--summarise=taxa-counts``, several samples can be given as
+input files on the command line. The output is then a matrix of taxa
+against samples. The value in each cell is set by ``--matrix-value``
+and sample names are taken from the filenames with
+``--regex-filename``.
+
 Usage
 -----
 
@@ -16,6 +22,9 @@ Example::
 
    python lca2table.py < infile > outfile
 
+   python lca2table.py --summarise=taxa-counts
+       --regex-filename="(.*).lca.gz" *.lca.gz > matrix.tsv
+
 Type::
 
    python lca2table.py --help
@@ -27,10 +36,102 @@ Command line options
 
 '''
 
+import os
+import re
 import sys
 import cgat.LCA as LCA
 import cgatcore.experiment as E
+import cgatcore.iotools as iotools
 import collections
+import numpy
+
+# levels reported by --summarise=taxa-counts and the
+# corresponding level in lcamapper output
+TAXA_LEVELS = (("domain", "SuperKingdom"),
+               ("kingdom", "Kingdom"),
+               ("kingdom+", "Kingdom+"),
+               ("phylum", "Phylum"),
+               ("phylum+", "Phylum+"),
+               ("class", "Class"),
+               ("class+", "Class+"),
+               ("order", "Order"),
+               ("order+", "Order+"),
+               ("family", "Family"),
+               ("family+", "Family+"),
+               ("genus", "Genus"),
+               ("genus+", "Genus+"),
+               ("species", "Species"),
+               ("species+", "Species+"))
+
+
+def iterate_taxa_counts(taxa, counts):
+    '''iterate over levels in alphabetical order and taxa observed
+    at each level in *counts* in alphabetical order.
+
+    yields tuples of level name, row in *counts* and list of
+    taxon codes.
+    '''
+    names = [x for x, y in TAXA_LEVELS]
+    # code 0 are unmapped reads
+    codes = sorted(range(1, len(taxa)), key=taxa.decode)
+    for level in sorted(names):
+        row = names.index(level)
+        observed = numpy.zeros(len(taxa), dtype=bool)
+        for c in counts:
+            observed |= c[row] > 0
+        yield level, row, [x for x in codes if observed[x]]
+
+
+def write_taxa_counts(outfile, taxa, nreads, counts):
+    '''output counts, proportions and reads per million for each
+    taxon and level in a single sample.
+
+    returns a counter with the number of unmapped reads per level.
+    '''
+    c = E.Counter()
+    outfile.write("level\ttaxa\tcount\tproportion\trpm\n")
+    for level, row, codes in iterate_taxa_counts(taxa, [counts]):
+        c["{}_unmapped".format(level)] = counts[row, 0]
+        total_level = nreads - counts[row, 0]
+        for code in codes:
+            count = counts[row, code]
+            outfile.write("\t".join(
+                [level,
+                 taxa.decode(code),
+                 str(count),
+                 "{:.8}".format(float(count)/total_level),
+                 "{:.8}".format(float(count)/(float(total_level)/1000000))])
+                + "\n")
+    return c
+
+
+def write_taxa_matrix(outfile, taxa, samples, nreads, counts, value="count"):
+    '''output a matrix of taxa and levels against *samples*.
+
+    *value* determines the value in each cell: the read count
+    ``count``, the proportion of reads assigned at a level
+    ``proportion`` or the reads per million assigned at a level
+    ``rpm``.
+    '''
+    outfile.write("\t".join(["level", "taxa"] + samples) + "\n")
+    for level, row, codes in iterate_taxa_counts(taxa, counts):
+        totals = numpy.array([n - c[row, 0] for n, c in zip(nreads, counts)],
+                             dtype=numpy.float64)
+        matrix = numpy.array([c[row, codes] for c in counts]).T
+        if value == "count":
+            values = [list(map(str, x)) for x in matrix]
+        else:
+            if value == "proportion":
+                scale = totals
+            elif value == "rpm":
+                scale = totals / 1000000
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                matrix = numpy.where(scale > 0, matrix / scale, 0)
+            values = [["{:.8}".format(float(y)) for y in x] for x in matrix]
+
+        for code, fields in zip(codes, values):
+            outfile.write("\t".join([level, taxa.decode(code)] + fields)
+                          + "\n")
 
 
 def main(argv=None):
@@ -53,9 +154,35 @@ def main(argv=None):
     parser.add_option("--output-map", dest="output_map", action="store_true",
                       help="ouput map of taxonomy")
 
+    parser.add_option("--matrix-value", dest="matrix_value", type="choice",
+                      choices=("count", "proportion", "rpm"),
+                      help="value to output in taxa-counts matrix for "
+                      "multiple samples [%default]")
+
+    parser.add_option("--regex-filename", dest="regex_filename",
+                      type="string",
+                      help="pattern to extract sample name from filename "
+                      "[%default]")
+
+    parser.add_option("--block-size", dest="block_size", type="int",
+                      help="number of reads to count at a time [%default]")
+
+    parser.set_defaults(matrix_value="count",
+                        regex_filename="(.*)",
+                        block_size=100000)
+
     # add common options (-h/--help, ...) and parse command line
     (options, args) = E.start(parser, argv=argv)
 
+    if args:
+        if options.summarise != "taxa-counts" or options.output_map:
+            raise ValueError(
+                "multiple input files are only supported for "
+                "--summarise=taxa-counts")
+        filenames = args
+    else:
+        filenames = [None]
+
     if options.output_map:
         found = []
         options.stdout.write("""Domain\t \
@@ -282,116 +409,35 @@ def main(argv=None):
                   nreads_species,
                   nreads_species_plus])) + "\n")
     elif options.summarise == "taxa-counts":
-        unmapped = collections.defaultdict(int)
-        total = 0
-        taxa_counts = {"domain": collections.defaultdict(int),
-                       "kingdom": collections.defaultdict(int),
-                       "kingdom+": collections.defaultdict(int),
-                       "phylum": collections.defaultdict(int),
-                       "phylum+": collections.defaultdict(int),
-                       "class": collections.defaultdict(int),
-                       "class+": collections.defaultdict(int),
-                       "order": collections.defaultdict(int),
-                       "order+": collections.defaultdict(int),
-                       "family": collections.defaultdict(int),
-                       "family+": collections.defaultdict(int),
-                       "genus": collections.defaultdict(int),
-                       "genus+": collections.defaultdict(int),
-                       "species": collections.defaultdict(int),
-                       "species+": collections.defaultdict(int)}
-
-        c = E.Counter()
-        for lca in LCA.iterate(options.stdin):
-            total += 1
-            if lca.domain != "NA":
-                taxa_counts["domain"][lca.domain] += 1
-            else:
-                c.kingdom_unmapped += 1
-                unmapped["domain"] += 1
-            if lca.kingdom != "NA":
-                taxa_counts["kingdom"][lca.kingdom] += 1
-            else:
-                c.kingdom_unmapped += 1
-                unmapped["kingdom"] += 1
-            if lca.kingdom_plus != "NA":
-                taxa_counts["kingdom+"][lca.kingdom_plus] += 1
-            else:
-                c.kingdom_plus_unmapped += 1
-                unmapped["kingdom+"] += 1
-            if lca.phylum != "NA":
-                taxa_counts["phylum"][lca.phylum] += 1
-            else:
-                c.phylum_unmapped += 1
-                unmapped["phylum"] += 1
-            if lca.phylum_plus != "NA":
-                taxa_counts["phylum+"][lca.phylum_plus] += 1
-            else:
-                c.phylum_plus_unmapped += 1
-                unmapped["phylum+"] += 1
-            if lca._class != "NA":
-                taxa_counts["class"][lca._class] += 1
-            else:
-                c.class_unmapped += 1
-                unmapped["class"] += 1
-            if lca._class_plus != "NA":
-                taxa_counts["class+"][lca._class_plus] += 1
-            else:
-                c.class_plus_unmapped += 1
-                unmapped["class+"] += 1
-            if lca.order != "NA":
-                taxa_counts["order"][lca.order] += 1
-            else:
-                c.order_unmapped += 1
-                unmapped["order"] += 1
-            if lca.order_plus != "NA":
-                taxa_counts["order+"][lca.order_plus] += 1
-            else:
-                c.order_plus_unmapped += 1
-                unmapped["order+"] += 1
-            if lca.family != "NA":
-                taxa_counts["family"][lca.family] += 1
-            else:
-                c.family_unmapped += 1
-                unmapped["family"] += 1
-            if lca.family_plus != "NA":
-                taxa_counts["family+"][lca.family_plus] += 1
-            else:
-                c.family_plus_unmapped += 1
-                unmapped["family+"] += 1
-            if lca.genus != "NA":
-                taxa_counts["genus"][lca.genus] += 1
-            else:
-                c.genus_unmapped += 1
-                unmapped["genus"] += 1
-            if lca.genus_plus != "NA":
-                taxa_counts["genus+"][lca.genus_plus] += 1
-            else:
-                c.genus_plus_unmapped += 1
-                unmapped["genus+"] += 1
-            if lca.species != "NA":
-                taxa_counts["species"][lca.species] += 1
-            else:
-                c.species_unmapped += 1
-                unmapped["species"] += 1
-            if lca.species_plus != "NA":
-                taxa_counts["species+"][lca.species_plus] += 1
-            else:
-                c.species_plus_unmapped += 1
-                unmapped["species+"] += 1
-
-        options.stdout.write("level\ttaxa\tcount\tproportion\trpm\n")
-        for level, taxa_count in sorted(taxa_counts.items()):
-            total_level = total - unmapped[level]
-            for taxa, count in sorted(taxa_count.items()):
-                options.stdout.write("\t".join(
-                    [level,
-                     taxa,
-                     str(count),
-                     "{:.8}".format(float(count)/total_level),
-                     "{:.8}".format(float(count)/(float(total_level)/1000000))])
-                                     + "\n")
-
-        E.info(c)
+        taxa = LCA.TaxonDictionary()
+        levels = [y for x, y in TAXA_LEVELS]
+        nreads, counts, samples = [], [], []
+        for filename in filenames:
+            if filename is None:
+                infile = options.stdin
+            else:
+                infile = iotools.open_file(filename)
+                samples.append(re.search(
+                    options.regex_filename,
+                    os.path.basename(filename)).groups()[0])
+            n, c = LCA.count_taxa(infile, taxa, levels,
+                                  block_size=options.block_size)
+            if filename is not None:
+                infile.close()
+            E.info("{}: {} reads, {} taxa".format(
+                filename or "stdin", n, len(taxa)))
+            nreads.append(n)
+            counts.append(c)
+
+        # extend counts of earlier samples to all taxa
+        counts = [LCA.resize_counts(x, len(taxa)) for x in counts]
+
+        if samples:
+            write_taxa_matrix(options.stdout, taxa, samples, nreads, counts,
+                              options.matrix_value)
+        else:
+            c = write_taxa_counts(options.stdout, taxa, nreads[0], counts[0])
+            E.info(c)
 
     elif options.summarise == "individual":
         # each read is output with its respective
@@ -10,6 +10,27 @@ Purpose
 This script reads lines from stdin and outputs them
 in randomized order.
 
+The following methods are available to shuffle lines
+(``--method``):
+
+memory
+   read all lines into memory and shuffle them. This is
+   the default.
+
+buckets
+   scatter lines randomly into ``--num-buckets`` temporary
+   files, shuffle each of these in memory and concatenate
+   them. Memory usage is proportional to the size of a bucket
+   instead of the size of the input.
+
+offsets
+   shuffle the offsets of lines instead of the lines themselves.
+   The input is memory-mapped and needs to be an uncompressed,
+   seekable file, for example supplied via ``--stdin``. For other
+   input, the script falls back to method ``memory``.
+
+Use ``--random-seed`` to obtain reproducible output.
+
 Usage
 -----
 
@@ -23,10 +44,126 @@ Command line options
 '''
 
 import sys
+import io
+import os
+import mmap
 import random
+import shutil
+import tempfile
+
+import numpy
 import cgatcore.experiment as E
 
 
+def shuffle_in_memory(inf, outf, counter):
+    '''shuffle all lines in *inf* in memory.'''
+    lines = inf.readlines()
+    counter.lines_input = len(lines)
+    random.shuffle(lines)
+    for line in lines:
+        outf.write(line)
+    counter.lines_output = len(lines)
+
+
+def shuffle_in_buckets(inf, outf, counter, num_buckets, tmpdir=None):
+    '''shuffle lines in *inf* by scattering them into
+    *num_buckets* temporary files.
+
+    Each bucket is shuffled in memory and the buckets are
+    output in order.
+    '''
+    tmpdir = tempfile.mkdtemp(dir=tmpdir)
+    E.debug("writing buckets to temporary directory %s" % tmpdir)
+
+    try:
+        filenames = [os.path.join(tmpdir, "bucket_%i" % x)
+                     for x in range(num_buckets)]
+        buckets = [open(x, "w") for x in filenames]
+        randrange = random.randrange
+        for line in inf:
+            counter.lines_input += 1
+            buckets[randrange(num_buckets)].write(line)
+        for bucket in buckets:
+            bucket.close()
+
+        for filename in filenames:
+            with open(filename) as bucket:
+                lines = bucket.readlines()
+            os.unlink(filename)
+            random.shuffle(lines)
+            outf.write("".join(lines))
+            counter.lines_output += len(lines)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def is_mappable(inf):
+    '''return True if *inf* is an uncompressed, seekable file that
+    can be memory-mapped.'''
+    inf = getattr(inf, "buffer", inf)
+    raw = getattr(inf, "raw", inf)
+    return isinstance(raw, io.FileIO) and raw.seekable()
+
+
+def shuffle_offsets(inf, outf, counter, chunk_size=1 << 24):
+    '''shuffle lines in *inf* by shuffling an index of
+    line offsets.
+
+    *inf* needs to be a seekable file and is memory-mapped.
+    Output is written in chunks of about *chunk_size* bytes.
+    '''
+    try:
+        fileno = inf.fileno()
+        start = inf.tell()
+    except (AttributeError, OSError, IOError):
+        raise ValueError(
+            "method 'offsets' requires a seekable input file")
+
+    # nothing to shuffle, for example a file with header only
+    if os.fstat(fileno).st_size <= start:
+        return
+
+    mm = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    data = None
+    try:
+        data = numpy.frombuffer(mm, dtype=numpy.uint8)
+        # collect line starts in chunks to avoid a boolean
+        # copy of the complete input
+        ends = []
+        for x in range(start, len(data), chunk_size):
+            ends.append(numpy.flatnonzero(
+                data[x:x + chunk_size] == ord("\n")) + x + 1)
+        ends = numpy.concatenate(ends).astype(numpy.int64)
+        if len(ends) == 0 or ends[-1] != len(data):
+            ends = numpy.append(ends, len(data))
+        starts = numpy.empty_like(ends)
+        starts[0] = start
+        starts[1:] = ends[:-1]
+        # release the view on the memory map, it can not be
+        # closed while the view exists
+        data = None
+
+        counter.lines_input = len(starts)
+        rng = numpy.random.RandomState(random.randint(0, 2 ** 32 - 1))
+        order = rng.permutation(len(starts))
+
+        buf, buf_size = [], 0
+        for x in order:
+            line = mm[starts[x]:ends[x]]
+            if not line.endswith(b"\n"):
+                line += b"\n"
+            buf.append(line)
+            buf_size += len(line)
+            if buf_size >= chunk_size:
+                outf.write(b"".join(buf).decode())
+                buf, buf_size = [], 0
+        outf.write(b"".join(buf).decode())
+        counter.lines_output = len(order)
+    finally:
+        data = None
+        mm.close()
+
+
 def main(argv=None):
     """script main.
     parses command line options in sys.argv, unless *argv* is given.
@@ -42,7 +179,22 @@ def main(argv=None):
     parser.add_option("-k", "--keep-header", dest="keep_header", type="int",
                       help="randomize, but keep header in place [%default]")
 
-    parser.set_defaults(keep_header=0)
+    parser.add_option("-m", "--method", dest="method", type="choice",
+                      choices=("memory", "buckets", "offsets"),
+                      help="method to shuffle lines [%default]")
+
+    parser.add_option("--num-buckets", dest="num_buckets", type="int",
+                      help="number of temporary files for method "
+                      "'buckets' [%default]")
+
+    parser.add_option("--tmpdir", dest="tmpdir", type="string",
+                      help="directory for temporary files for method "
+                      "'buckets' [%default]")
+
+    parser.set_defaults(keep_header=0,
+                        method="memory",
+                        num_buckets=64,
+                        tmpdir=None)
 
     # add common options (-h/--help, ...) and parse command line
     (options, args) = E.start(parser, argv=argv)
@@ -50,16 +202,31 @@ def main(argv=None):
     inf = options.stdin
     outf = options.stdout
     c = E.Counter()
-    for x in range(options.keep_header):
-        c.header += 1
-        outf.write(inf.readline())
 
-    lines = inf.readlines()
-    c.lines_input = len(lines)
-    random.shuffle(lines)
-    for line in lines:
-        outf.write(line)
-    c.lines_output = len(lines)
+    if options.method == "offsets" and not is_mappable(inf):
+        E.warn("method 'offsets' requires an uncompressed, seekable "
+               "input file, falling back to method 'memory'")
+        options.method = "memory"
+
+    if options.method == "offsets":
+        # read header lines from the underlying binary stream so
+        # that the offset is correct
+        inf = inf.buffer if hasattr(inf, "buffer") else inf
+        for x in range(options.keep_header):
+            c.header += 1
+            outf.write(inf.readline().decode())
+        shuffle_offsets(inf, outf, c)
+    else:
+        for x in range(options.keep_header):
+            c.header += 1
+            outf.write(inf.readline())
+
+        if options.method == "memory":
+            shuffle_in_memory(inf, outf, c)
+        elif options.method == "buckets":
+            shuffle_in_buckets(inf, outf, c,
+                               options.num_buckets,
+                               tmpdir=options.tmpdir)
 
     E.info(c)
 
@@ -30,9 +30,10 @@ Command line options
 '''
 import sys
 import re
-import string
 import os
 import getopt
+import collections
+import gzip
 import cgatcore.experiment as E
 import cgatcore.iotools as iotools
 
@@ -57,6 +58,13 @@ OPTIONS:
 --pattern-identifier            if given, use this pattern to extract
                                 id from column.
 --chunk-size                    Number of matching records in each output file
+--max-open                      maximum number of simultaneously open output
+                                files when splitting by column.
+--buffer-size                   number of bytes to buffer per output file
+                                before writing when splitting by column.
+--max-memory                    maximum number of bytes to buffer across all
+                                output files when splitting by column.
+--compress                      compress output files with gzip.
 --version                       output version information
 """ % (sys.argv[0], "s")
 
@@ -79,7 +87,12 @@ def CreateOpen(file, mode="w", dry_run=False, header=None):
     else:
         existed = False
 
-    f = iotools.open_file(file, mode)
+    # iotools.open_file truncates compressed files opened
+    # in append mode
+    if mode == "a" and file.endswith(".gz"):
+        f = gzip.open(file, "at")
+    else:
+        f = iotools.open_file(file, mode)
 
     if header and not existed:
         f.write(header + "\n")
@@ -87,6 +100,96 @@ def CreateOpen(file, mode="w", dry_run=False, header=None):
     return f
 
 
+def printComment(text):
+    """print *text* to stdout with each line prefixed by '#'."""
+    for line in text.splitlines():
+        print("# %s" % line)
+
+
+class BufferedFilePool:
+    """write to a large number of output files through
+    a bounded pool of file handles.
+
+    Data is buffered per file and written in blocks once
+    *buffer_size* bytes have accumulated for a file or
+    *max_memory* bytes have accumulated across all files.
+
+    At most *max_open* files are kept open. If more files
+    are needed, the least recently used file is closed and
+    re-opened in append mode when it is written to again.
+    """
+
+    def __init__(self,
+                 max_open=1000,
+                 buffer_size=1 << 16,
+                 max_memory=1 << 28,
+                 dry_run=False,
+                 header=None,
+                 loglevel=1):
+        self.max_open = max_open
+        self.buffer_size = buffer_size
+        self.max_memory = max_memory
+        self.dry_run = dry_run
+        self.header = header
+        self.loglevel = loglevel
+
+        self.files = collections.OrderedDict()
+        self.buffers = collections.defaultdict(list)
+        self.buffer_sizes = collections.defaultdict(int)
+        self.total_size = 0
+        self.nopened = 0
+
+    def write(self, filename, data):
+        """write *data* to *filename*."""
+        self.buffers[filename].append(data)
+        self.buffer_sizes[filename] += len(data)
+        self.total_size += len(data)
+
+        if self.buffer_sizes[filename] >= self.buffer_size:
+            self.flush(filename)
+
+        if self.total_size >= self.max_memory:
+            if self.loglevel >= 2:
+                print("# memory limit reached, flushing all buffers.")
+                sys.stdout.flush()
+            self.flush_all()
+
+    def get_file(self, filename):
+        """return an open file handle for *filename*."""
+        if filename in self.files:
+            self.files.move_to_end(filename)
+            return self.files[filename]
+
+        if len(self.files) >= self.max_open:
+            oldest, f = self.files.popitem(last=False)
+            f.close()
+
+        f = CreateOpen(filename, "a", self.dry_run, self.header)
+        self.files[filename] = f
+        self.nopened += 1
+        return f
+
+    def flush(self, filename):
+        """write buffered data for *filename*."""
+        data = self.buffers.pop(filename, None)
+        if not data:
+            return
+        self.get_file(filename).write("".join(data))
+        self.total_size -= self.buffer_sizes.pop(filename)
+
+    def flush_all(self):
+        """write all buffered data."""
+        for filename in list(self.buffers.keys()):
+            self.flush(filename)
+
+    def close(self):
+        """write all buffered data and close all files."""
+        self.flush_all()
+        for f in list(self.files.values()):
+            f.close()
+        self.files.clear()
+
+
 def main(argv=None):
     """script main.
 
@@ -100,7 +203,8 @@ def main(argv=None):
         "verbose=", "help", "split-regex=", "after", "pattern-output=", "skip",
         "column=", "map=", "dry-run",
         "header", "remove-key", "append", "pattern-identifier=", "version",
-        "chunk-size="]
+        "chunk-size=", "max-open=", "buffer-size=", "max-memory=",
+        "compress"]
 
     param_short_options = "v:hr:ap:sc:dek"
 
@@ -117,6 +221,10 @@ def main(argv=None):
     param_append = "w"
     param_pattern_identifier = None
     param_chunk_size = 1
+    param_max_open = 1000
+    param_buffer_size = 1 << 16
+    param_max_memory = 1 << 28
+    param_compress = False
 
     try:
         optlist, args = getopt.getopt(sys.argv[1:],
@@ -160,9 +268,20 @@ def main(argv=None):
             param_pattern_identifier = re.compile(a)
         elif o == "--chunk-size":
             param_chunk_size = int(a)
+        elif o == "--max-open":
+            param_max_open = int(a)
+        elif o == "--buffer-size":
+            param_buffer_size = int(a)
+        elif o == "--max-memory":
+            param_max_memory = int(a)
+        elif o == "--compress":
+            param_compress = True
+
+    if param_compress and not param_pattern_output.endswith(".gz"):
+        param_pattern_output += ".gz"
 
-    print(E.GetHeader())
-    print(E.GetParams())
+    printComment(E.get_header())
+    printComment(E.get_params())
 
     mymap = {}
     if param_filename_map:
@@ -180,7 +299,7 @@ def main(argv=None):
     if param_split_column is not None:
 
         header = None
-        files = {}
+        files = None
         for line in sys.stdin:
 
             if line[0] == "#":
@@ -195,6 +314,14 @@ def main(argv=None):
             else:
                 header = None
 
+            if files is None:
+                files = BufferedFilePool(max_open=param_max_open,
+                                         buffer_size=param_buffer_size,
+                                         max_memory=param_max_memory,
+                                         dry_run=param_dry_run,
+                                         header=header,
+                                         loglevel=param_loglevel)
+
             data = line[:-1].split("\t")
 
             try:
@@ -216,31 +343,19 @@ def main(argv=None):
             filename = re.sub("%s", key, param_pattern_output)
             filenames.add(filename)
 
-            if filename not in files:
-
-                # reset if too many files are open
-                if len(files) > 1000:
-                    if param_loglevel >= 1:
-                        print("# resetting all files.")
-                        sys.stdout.flush()
-
-                    for f in list(files.values()):
-                        f.close()
-                    files = {}
-
-                files[filename] = CreateOpen(
-                    filename, "a", param_dry_run, header)
-
             if param_remove_key:
                 del data[param_split_column]
-                files[filename].write(string.join(data, "\t") + "\n")
+                files.write(filename, "\t".join(data) + "\n")
             else:
-                files[filename].write(line)
+                files.write(filename, line)
 
             noutput += 1
 
-        for f in list(files.values()):
-            f.close()
+        if files is not None:
+            files.close()
+            if param_loglevel >= 2:
+                print("# opened files %i times for %i files" %
+                      (files.nopened, len(filenames)))
 
     else:
         file_id = 0
@@ -288,7 +403,7 @@ def main(argv=None):
                 len(set(mymap).difference(found)),
                 len(filenames)))
 
-    print(E.GetFooter())
+    printComment(E.get_footer())
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv))
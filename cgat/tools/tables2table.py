@@ -1,5 +1,5 @@
-'''combine_tables.py - join tables
-==================================
+'''tables2table.py - join tables
+=================================
 
 :Tags: Python
 
@@ -9,6 +9,24 @@ Purpose
 This script reads several tab-separated tables and joins them into a
 single one.
 
+Tables are joined on the key columns given by ``--columns``. The
+join is a merge over tables sorted by key, so that only the current
+row of each table is held in memory and the joined table is written
+as it is built. Rows are output sorted by key (``--sort-keys``).
+Tables that are not sorted by key are sorted one at a time into
+temporary files (``--tmpdir``). If all tables are known to be sorted,
+use ``--presorted`` to skip the check. Keys missing in a table are
+filled with ``--missing-value``.
+
+With ``--cat``, tables are concatenated instead. The output contains
+the union of all columns and additional columns identifying the
+input table. Tables are copied line by line.
+
+With ``--matrix-file``, the joined table is also written in a
+columnar format (npz, feather or parquet, see
+:mod:`cgat.ColumnarOutput`) with values stored as floats and
+missing values as NaN.
+
 Usage
 -----
 
@@ -19,11 +37,11 @@ the input files.
 
 Example::
 
-   python combine_tables.py --help
+   python tables2table.py --columns=1 --take=count *.tsv.gz
 
 Type::
 
-   python combine_tables.py --help
+   python tables2table.py --help
 
 for command line help.
 
@@ -35,56 +53,487 @@ import sys
 import re
 import os
 import glob
-import collections
-import pandas
+import heapq
+import shutil
+import tempfile
+
+import numpy
 
 import cgatcore.iotools as iotools
 import cgatcore.experiment as E
-
-
-def read_tables(filenames, *args, **kwargs):
-
-    tables = []
-    for filename in filenames:
+import cgat.ColumnarOutput as ColumnarOutput
+
+
+def read_lines(filename, regex_start=None, regex_end=None):
+    '''iterate over the lines of the table in *filename*.
+
+    Comments and empty lines are skipped. If *regex_start* is given,
+    the table starts at the first line matching the expression. If
+    *regex_end* is given, the table ends before the first line
+    matching the expression.
+    '''
+    with iotools.open_file(filename) as inf:
+        if regex_start:
+            rx = re.compile(regex_start)
+            for line in inf:
+                if rx.search(line):
+                    if not line.startswith("#") and line.strip():
+                        yield line
+                    break
+            else:
+                E.warn("start regex not found in {} - no table".format(
+                    filename))
+
+        if regex_end:
+            rx_end = re.compile(regex_end)
+
+        for line in inf:
+            if regex_end and rx_end.search(line):
+                break
+            if not line.startswith("#") and line.strip():
+                yield line
+
+
+def get_sort_key(sort_keys=None):
+    '''return a function converting a list of key fields into a
+    value that can be compared.
+
+    Keys are compared as strings unless *sort_keys* is ``numeric``.
+    '''
+    if sort_keys == "numeric":
+        return lambda fields: tuple(float(x) for x in fields)
+    else:
+        return tuple
+
+
+def iterate_rows(lines, columns, take,
+                 separator="\t",
+                 sort_key=tuple,
+                 filename=None,
+                 check_sorted=True):
+    '''iterate over the rows in *lines*.
+
+    yield tuples of (key, fields, values) with the fields in
+    *columns*, the fields in *take* and the key to sort by. If
+    *columns* is empty, rows are keyed by their number.
+
+    Raises ValueError if a key can not be converted by *sort_key*
+    or, if *check_sorted* is set, if rows are not sorted by key.
+    '''
+    last, last_fields = None, None
+    for n, line in enumerate(lines):
+        data = line.rstrip("\r\n").split(separator)
         try:
-            table = pandas.read_csv(filename, *args, **kwargs)
-        except pandas.errors.EmptyDataError:
-            E.warn("file '{}' is empty".format(filename))
-            continue
-        except pandas.errors.ParserError as ex:
-            E.warn("file '{}' has parsing error: {}".format(filename, ex))
-            continue
-        if len(table) == 0:
-            E.warn("table '{}' is empty".format(filename))
-            continue
-        tables.append((table, filename))
-    return zip(*tables)
+            if columns:
+                fields = [data[x] for x in columns]
+            else:
+                fields = [str(n)]
+            values = [data[x] for x in take]
+        except IndexError:
+            raise ValueError(
+                "{}: row {} has only {} fields: {}".format(
+                    filename, n + 1, len(data), line.strip()))
+        if columns:
+            try:
+                key = sort_key(fields)
+            except ValueError:
+                raise ValueError(
+                    "{}: row {} has a non-numeric key '{}', which "
+                    "can not be sorted with --sort-keys=numeric".format(
+                        filename, n + 1, "-".join(fields)))
+        else:
+            key = n
+        if check_sorted and last is not None and key < last:
+            raise ValueError(
+                "{}: table is not sorted by key, {} follows {}".format(
+                    filename, "-".join(fields), "-".join(last_fields)))
+        last, last_fields = key, fields
+        yield key, fields, values
+
+
+def open_table(filename,
+               columns,
+               take=None,
+               separator="\t",
+               has_titles=True,
+               regex_start=None,
+               regex_end=None):
+    '''open the table in *filename* for joining.
+
+    *take* is a list of column numbers (1-based) or column titles
+    of the value columns. If not given, all columns except the key
+    *columns* are taken.
+
+    return a tuple of (key_titles, value_titles, take, lines) with
+    the indices of the value columns in *take* and an iterator over
+    the rows in *lines*. Returns None if the table is empty.
+    '''
+    lines = read_lines(filename, regex_start, regex_end)
+    try:
+        first = next(lines)
+    except StopIteration:
+        return None
+
+    data = first.rstrip("\r\n").split(separator)
+
+    if take:
+        indices = []
+        for x in take:
+            try:
+                indices.append(int(x) - 1)
+            except ValueError:
+                if not has_titles or x not in data:
+                    raise ValueError(
+                        "{}: column {} not found".format(filename, x))
+                indices.append(data.index(x))
+    else:
+        indices = [x for x in range(len(data)) if x not in columns]
+
+    if has_titles:
+        return ([data[x] for x in columns],
+                [data[x] for x in indices],
+                indices,
+                lines)
+    else:
+        def _lines():
+            yield first
+            for line in lines:
+                yield line
+
+        return ([str(x + 1) for x in columns],
+                [str(x + 1) for x in indices],
+                indices,
+                _lines())
+
+
+def merge_rows(iterators):
+    '''merge rows from *iterators* that are sorted by key.
+
+    yield for each key a tuple of (fields, rows) with one entry
+    per iterator in *rows*. The entry is None if the key is not
+    present in an iterator. If a key appears several times in an
+    iterator, the last row is used.
+    '''
+    heap = []
+    for idx, rows in enumerate(iterators):
+        for key, fields, values in rows:
+            heap.append((key, idx, fields, values))
+            break
+    heapq.heapify(heap)
+
+    while heap:
+        key, fields = heap[0][0], heap[0][2]
+        rows = [None] * len(iterators)
+        while heap and heap[0][0] == key:
+            idx, values = heap[0][1], heap[0][3]
+            rows[idx] = values
+            for next_key, next_fields, next_values in iterators[idx]:
+                heapq.heapreplace(
+                    heap, (next_key, idx, next_fields, next_values))
+                break
+            else:
+                heapq.heappop(heap)
+        yield fields, rows
+
+
+def get_column_order(titles, sort_columns):
+    '''return the indices of *titles* sorted by *sort_columns*.
+
+    *sort_columns* is ``numeric``, ``alphabetical`` or a list of
+    titles. Titles not in the list are removed.
+    '''
+    if sort_columns == "numeric":
+        return sorted(range(len(titles)), key=lambda x: int(titles[x]))
+    elif sort_columns in ("alphabetical", "alphabetic"):
+        return sorted(range(len(titles)), key=lambda x: titles[x])
+    else:
+        map_title2pos = dict((y, x) for x, y in enumerate(titles))
+        return [map_title2pos[x] for x in sort_columns
+                if x in map_title2pos]
+
+
+def sort_table(rows, outfile):
+    '''sort *rows* from :func:`iterate_rows` by key in memory and
+    write them to *outfile*.
+
+    Key fields are written first, followed by the values. Rows with
+    the same key are kept in input order.
+
+    return the number of rows written.
+    '''
+    rows = [(key, x, fields + values)
+            for x, (key, fields, values) in enumerate(rows)]
+    rows.sort()
+    for key, x, data in rows:
+        outfile.write("\t".join(data) + "\n")
+    return len(rows)
+
+
+def join_tables(filenames,
+                outfile,
+                columns=(0,),
+                take=None,
+                separator="\t",
+                missing_value="na",
+                has_titles=True,
+                output_titles=True,
+                regex_start=None,
+                regex_end=None,
+                sort_keys=None,
+                presorted=False,
+                ignore_empty=True,
+                title_function=None,
+                headers=None,
+                skip_titles=False,
+                sort_columns=None,
+                tmpdir=None,
+                matrix_file=None):
+    '''join the tables in *filenames* on the key *columns* and write
+    the combined table to *outfile*.
+
+    Tables are combined by a merge join over the tables sorted by
+    key, keeping only the current row of each table in memory, and
+    rows are output in key order. Tables that are not sorted by key
+    are sorted in memory one at a time and written to temporary
+    files in *tmpdir*. If *presorted* is set, the tables are not
+    checked beforehand and an error is raised if a table turns out
+    not to be sorted. If *columns* is empty, rows are matched by
+    their number.
+
+    Tables without data rows are skipped if *ignore_empty* is set.
+    Otherwise their columns are filled with *missing_value*. Tables
+    without a title line take their titles from the first table
+    with data.
+
+    Keys missing from a table are filled with *missing_value*. If a
+    key appears several times in a table, the last row is used.
+
+    *title_function* is called with the index and filename of a
+    table and the title of a value column and returns the title in
+    the output. *headers* is a list of labels, one for each table,
+    that is output before the titles or instead of them if
+    *skip_titles* is set. *sort_columns* determines the order of the
+    value columns, see :func:`get_column_order`.
+
+    If *matrix_file* is given, the combined table is also written to
+    a columnar file (see :mod:`cgat.ColumnarOutput`) with the value
+    columns stored as floats and missing values as NaN.
+
+    return a counter.
+    '''
+    counter = E.Counter()
+    columns = list(columns)
+    sort_key = get_sort_key(sort_keys)
+
+    if headers is not None and len(headers) != len(filenames):
+        raise ValueError(
+            "number of provided headers ({}) is not equal to number "
+            "of filenames ({})".format(len(headers), len(filenames)))
+
+    def _open(filename):
+        return open_table(filename, columns,
+                          take=take,
+                          separator=separator,
+                          has_titles=has_titles,
+                          regex_start=regex_start,
+                          regex_end=regex_end)
+
+    def _rows(table, filename, check_sorted=True):
+        return iterate_rows(table[3], columns, table[2],
+                            separator=separator,
+                            sort_key=sort_key,
+                            filename=filename,
+                            check_sorted=check_sorted)
+
+    tmpdir = tempfile.mkdtemp(dir=tmpdir)
+    E.debug("writing sorted tables to temporary directory %s" % tmpdir)
+
+    try:
+        key_titles = None
+        tables = []
+        for nindex, filename in enumerate(filenames):
+            counter.input += 1
+            table = _open(filename)
+            if table is None or next(table[3], None) is None:
+                counter.empty += 1
+                if ignore_empty:
+                    E.warn("{} is empty - skipped".format(filename))
+                    continue
+                E.warn("{} is empty - filled with missing values".format(
+                    filename))
+                if table is None:
+                    value_titles = None
+                else:
+                    value_titles = table[1]
+                tables.append((nindex, filename, value_titles, iter(())))
+                continue
+
+            table = _open(filename)
+            if key_titles is None:
+                key_titles = table[0]
+
+            is_sorted = True
+            if not presorted and columns:
+                try:
+                    for row in _rows(table, filename):
+                        pass
+                except ValueError:
+                    is_sorted = False
+                table = _open(filename)
+
+            if is_sorted:
+                rows = _rows(table, filename)
+            else:
+                E.info("sorting {}".format(filename))
+                counter.sorted += 1
+                fn = os.path.join(tmpdir, "table_%i" % nindex)
+                with open(fn, "w") as outf:
+                    sort_table(_rows(table, filename, check_sorted=False),
+                               outf)
+                rows = iterate_rows(
+                    read_lines(fn),
+                    list(range(len(columns))),
+                    list(range(len(columns),
+                               len(columns) + len(table[1]))),
+                    sort_key=sort_key,
+                    filename=fn)
+
+            counter.joined += 1
+            tables.append((nindex, filename, table[1], rows))
+
+        if counter.joined == 0:
+            raise ValueError("no table with data found")
+
+        # tables without title line use the titles of the first
+        # table with data
+        default_titles = [x[2] for x in tables if x[2] is not None][0]
+        tables = [(nindex, filename,
+                   default_titles if value_titles is None else value_titles,
+                   rows)
+                  for nindex, filename, value_titles, rows in tables]
+
+        titles, missing, missing_nan = [], [], []
+        for nindex, filename, value_titles, rows in tables:
+            if title_function:
+                titles.extend([title_function(nindex, filename, x)
+                               for x in value_titles])
+            else:
+                titles.extend(value_titles)
+            missing.append([missing_value] * len(value_titles))
+            missing_nan.append(["nan"] * len(value_titles))
+
+        if columns and has_titles:
+            key_title = "-".join(key_titles)
+        elif columns:
+            key_title = "ID"
+        else:
+            key_title = "count"
+
+        if headers is not None:
+            header_line = []
+            for nindex, filename, value_titles, rows in tables:
+                header_line.append(headers[nindex])
+                header_line.extend([""] * (len(value_titles) - 1))
+            if skip_titles:
+                # use headers as titles
+                titles = header_line
+                key_title = "bin"
+                output_titles = True
+            else:
+                outfile.write(
+                    separator.join(["bin"] + header_line) + "\n")
+
+        if sort_columns:
+            order = get_column_order(titles, sort_columns)
+            titles = [titles[x] for x in order]
+        else:
+            order = None
+
+        titles = [key_title] + titles
+        if output_titles:
+            outfile.write(separator.join(titles) + "\n")
+
+        if matrix_file:
+            if len(set(titles)) != len(titles):
+                raise ValueError(
+                    "matrix output requires unique column titles, "
+                    "use --add-file-prefix or --prefixes")
+            writer = ColumnarOutput.ColumnarWriter(
+                matrix_file, titles,
+                dtypes=[str] + [numpy.float64] * (len(titles) - 1))
+        else:
+            writer = None
+
+        for fields, rows in merge_rows([x[3] for x in tables]):
+            values, matrix_values = [], []
+            for row, m, mn in zip(rows, missing, missing_nan):
+                if row is None:
+                    values.extend(m)
+                    matrix_values.extend(mn)
+                else:
+                    values.extend(row)
+                    matrix_values.extend(row)
+            if order is not None:
+                values = [values[x] for x in order]
+                matrix_values = [matrix_values[x] for x in order]
+            key = "-".join(fields)
+            outfile.write(separator.join([key] + values) + "\n")
+            if writer is not None:
+                writer.append([key] + matrix_values)
+            counter.output += 1
+
+        if writer is not None:
+            writer.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return counter
 
 
 def concatenate_tables(filenames,
+                       outfile,
                        regex_filename="(\S+)",
                        separator="\t",
                        headers=None,
                        missing_value=None,
-                       cat=None):
-
-    '''concatenate tables.'''
-
+                       cat=None,
+                       regex_start=None,
+                       regex_end=None):
+    '''concatenate the tables in *filenames* and write them to
+    *outfile*.
+
+    Each row is prefixed by one or more labels identifying its
+    table. The labels are taken from *headers* or extracted from the
+    filename by *regex_filename*. *cat* is a comma-separated list of
+    titles for the label columns.
+
+    The output contains the union of the columns in all tables.
+    Tables are read line by line and columns missing in a table are
+    filled with *missing_value*.
+
+    return a counter.
+    '''
+    counter = E.Counter()
     rx = re.compile(regex_filename)
 
-    tables, filenames = read_tables(filenames, sep=separator)
+    if missing_value is None:
+        missing_value = ""
 
     if headers is None or headers == "auto":
-        row_headers = [
-            [y for y in rx.search(x).groups()] for x in filenames]
+        row_headers = [list(rx.search(x).groups()) for x in filenames]
     else:
-        row_headers = [headers]
+        if len(headers) != len(filenames):
+            raise ValueError(
+                "number of provided headers ({}) is not equal to number "
+                "of filenames ({})".format(len(headers), len(filenames)))
+        row_headers = [[x] for x in headers]
 
     if cat is None:
-        if len(row_headers) == 1:
+        if len(row_headers[0]) == 1:
             row_head_titles = ["filename"]
         else:
-            row_head_titles = ["pattern" + str(x) for x in range(len(row_headers))]
+            row_head_titles = ["pattern" + str(x)
+                               for x in range(len(row_headers[0]))]
     else:
         row_head_titles = [x.strip() for x in cat.split(",")]
         if len(row_headers[0]) != len(row_head_titles):
@@ -93,15 +542,57 @@ def concatenate_tables(filenames,
                 "regular expression than supplied by the --cat option (%i)" %
                 (len(row_headers[0]), len(row_head_titles)))
 
-    # avoid MultiIndex if only single level
-    if len(row_head_titles) == 1:
-        row_head_titles = row_head_titles
-        row_headers = [x[0] for x in row_headers]
+    # collect the union of titles from the first line of each table
+    titles = []
+    map_title2column = {}
+    table_titles = []
+    for filename in filenames:
+        counter.input += 1
+        lines = read_lines(filename, regex_start, regex_end)
+        try:
+            title_line = next(lines)
+        except StopIteration:
+            E.warn("file '{}' is empty".format(filename))
+            counter.empty += 1
+            table_titles.append(None)
+            continue
+        lines.close()
+        data = title_line.rstrip("\r\n").split(separator)
+        for title in data:
+            if title not in map_title2column and \
+               title not in row_head_titles:
+                map_title2column[title] = len(titles)
+                titles.append(title)
+        table_titles.append(data)
+
+    outfile.write(separator.join(row_head_titles + titles) + "\n")
+
+    for filename, row_header, data in zip(
+            filenames, row_headers, table_titles):
+        if data is None:
+            continue
 
-    df = pandas.concat(tables, axis=0, keys=row_headers, names=row_head_titles) \
-               .reset_index() \
-               .drop(["level_1"], axis=1)
-    return df
+        map_old2new = [map_title2column.get(x, None) for x in data]
+        prefix = separator.join(row_header) + separator
+        lines = read_lines(filename, regex_start, regex_end)
+        next(lines)
+        for line in lines:
+            fields = line.rstrip("\r\n").split(separator)
+            if len(fields) > len(map_old2new):
+                raise ValueError(
+                    "{}: row has more fields ({}) than the table has "
+                    "titles ({}): {}".format(
+                        filename, len(fields), len(map_old2new),
+                        line.strip()))
+            row = [missing_value] * len(titles)
+            for x, value in enumerate(fields):
+                if map_old2new[x] is not None:
+                    row[map_old2new[x]] = value
+            outfile.write(prefix + separator.join(row) + "\n")
+            counter.output += 1
+        counter.concatenated += 1
+
+    return counter
 
 
 def main(argv=sys.argv):
@@ -222,6 +713,22 @@ def main(argv=sys.argv):
                       help="table separator to use. The default is to use tabs. "
                       "[default=%default]")
 
+    parser.add_option("--presorted", dest="presorted",
+                      action="store_true",
+                      help="tables are sorted by key. The tables are "
+                      "not checked and sorted beforehand "
+                      "[default=%default]")
+
+    parser.add_option("--tmpdir", dest="tmpdir", type="string",
+                      help="directory for sorted copies of tables that "
+                      "are not sorted by key [default=%default]")
+
+    parser.add_option("--matrix-file", dest="matrix_file", type="string",
+                      help="also write the joined table to this file in "
+                      "a columnar format. The format is determined by "
+                      "the extension (npz, feather or parquet) "
+                      "[default=%default]")
+
     parser.add_option("--test", dest="test",
                       type="int",
                       help="test combining tables with "
@@ -248,6 +755,9 @@ def main(argv=sys.argv):
         prefixes=None,
         test=0,
         separator="\t",
+        presorted=False,
+        tmpdir=None,
+        matrix_file=None,
     )
 
     (options, args) = E.start(parser, argv=argv)
@@ -258,7 +768,8 @@ def main(argv=sys.argv):
         else:
             options.headers = re.split("\s+", options.headers.strip())
 
-    if options.sort and options.sort not in ("numeric", "alphabetic"):
+    if options.sort and options.sort not in ("numeric", "alphabetical",
+                                             "alphabetic"):
         if "," in options.sort:
             options.sort = options.sort.split(",")
         else:
@@ -282,14 +793,76 @@ def main(argv=sys.argv):
     E.info("combining %i tables" % len(options.filenames))
 
     if options.cat:
-        table = concatenate_tables(options.filenames,
-                                   regex_filename=options.regex_filename,
-                                   separator=options.separator,
-                                   headers=options.headers,
-                                   missing_value=options.missing_value,
-                                   cat=options.cat)
-
-    table.to_csv(options.stdout, sep=options.separator, index=False)
+        counter = concatenate_tables(options.filenames,
+                                     options.stdout,
+                                     regex_filename=options.regex_filename,
+                                     separator=options.separator,
+                                     headers=options.headers,
+                                     missing_value=options.missing_value,
+                                     cat=options.cat,
+                                     regex_start=options.regex_start,
+                                     regex_end=options.regex_end)
+    else:
+        if options.prefixes:
+            prefixes = [x.strip() for x in options.prefixes.split(",")]
+            if len(prefixes) != len(options.filenames):
+                raise ValueError(
+                    "number of prefixes (%i) and tables (%i) do not match" %
+                    (len(prefixes), len(options.filenames)))
+        else:
+            prefixes = None
+
+        def _get_prefix(filename):
+            match = re.search(options.regex_filename,
+                              os.path.basename(filename))
+            if match is None:
+                E.warn("can't extract title from filename %s" % filename)
+                return "unknown"
+            return match.groups()[0]
+
+        if options.add_file_prefix:
+            def title_function(nindex, filename, title):
+                return "%s_%s" % (_get_prefix(filename), title)
+        elif options.use_file_prefix:
+            def title_function(nindex, filename, title):
+                return _get_prefix(filename)
+        elif prefixes:
+            def title_function(nindex, filename, title):
+                return "%s_%s" % (prefixes[nindex], title)
+        else:
+            title_function = None
+
+        headers = options.headers
+        if headers and headers[0] == "auto":
+            headers = [os.path.basename(x) for x in options.filenames]
+
+        if options.missing_value is None:
+            options.missing_value = "na"
+
+        counter = join_tables(
+            options.filenames,
+            options.stdout,
+            columns=options.columns,
+            take=options.take,
+            separator=options.separator,
+            missing_value=options.missing_value,
+            has_titles=options.input_has_titles,
+            output_titles=(options.input_has_titles or
+                           options.add_file_prefix or
+                           options.use_file_prefix),
+            regex_start=options.regex_start,
+            regex_end=options.regex_end,
+            sort_keys=options.sort_keys,
+            presorted=options.presorted,
+            ignore_empty=options.ignore_empty,
+            title_function=title_function,
+            headers=headers,
+            skip_titles=options.skip_titles,
+            sort_columns=options.sort,
+            tmpdir=options.tmpdir,
+            matrix_file=options.matrix_file)
+
+    E.info(counter)
     E.stop()
 
 
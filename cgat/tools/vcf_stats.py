@@ -150,6 +150,18 @@ def main(argv=sys.argv):
         "of 50 means that 50 bases on either side of the variant are "
         "used to compute the G+C content [%default]")
 
+    parser.add_option(
+        "--num-processes", dest="num_processes", type="int",
+        help="number of processes to use for counting. If larger than 1, "
+        "the genome or the intervals in --input-bed are split into "
+        "regions that are counted in parallel and the results are "
+        "merged. Ignored if --region is given [%default]")
+
+    parser.add_option(
+        "--region-size", dest="region_size", type="int",
+        help="size of regions to split the genome into when counting "
+        "in parallel [%default]")
+
     parser.set_defaults(
         methods=[],
         input_vcf_file=None,
@@ -160,6 +172,8 @@ def main(argv=sys.argv):
         format_distribution_nbins=1000,
         gc_window_size=50,
         report_step=1000000,
+        num_processes=1,
+        region_size=10000000,
     )
 
     (options, args) = E.start(parser, argv, add_output_options=True)
@@ -0,0 +1,70 @@
+"""unit testing module for the Bed.py module."""
+import io
+import unittest
+
+import cgat.Bed as Bed
+
+
+BED = """track name=test
+chr1\t100\t200\tinterval1\t0\t+
+# comment
+chr2\t10\t20
+
+chr1\t300\t400\tinterval3
+"""
+
+
+class TestBed(unittest.TestCase):
+
+    def testIterator(self):
+        beds = list(Bed.iterator(io.StringIO(BED)))
+        self.assertEqual(len(beds), 3)
+        self.assertEqual(str(beds[0]), "chr1\t100\t200\tinterval1\t0\t+")
+        self.assertEqual(beds[0].name, "interval1")
+        self.assertEqual(beds[0].strand, "+")
+        self.assertEqual(beds[0].track["name"], "test")
+        self.assertEqual(beds[1].name, None)
+        self.assertEqual(beds[1].columns, 3)
+
+    def testSetOptionalField(self):
+        bed = Bed.Bed("chr1", 0, 10)
+        bed.score = 5
+        self.assertEqual(str(bed), "chr1\t0\t10\t.\t5")
+        self.assertEqual(bed["score"], 5)
+
+    def testCopy(self):
+        bed = next(Bed.iterator(io.StringIO(BED)))
+        bed.gene_id = "gene1"
+        other = bed.copy()
+        other.name = "other"
+        self.assertEqual(bed.name, "interval1")
+        self.assertEqual(other.gene_id, "gene1")
+        self.assertEqual(str(other), "chr1\t100\t200\tother\t0\t+")
+
+
+class TestReadArrays(unittest.TestCase):
+
+    def testReadArrays(self):
+        for block_size in (1, 2, 100):
+            contigs, codes, starts, ends, names = Bed.read_arrays(
+                io.StringIO(BED), with_names=True, block_size=block_size)
+            self.assertEqual(contigs, ["chr1", "chr2"])
+            self.assertEqual(list(codes), [0, 1, 0])
+            self.assertEqual(list(starts), [100, 10, 300])
+            self.assertEqual(list(ends), [200, 20, 400])
+            self.assertEqual(list(names), ["interval1", None, "interval3"])
+
+    def testEmpty(self):
+        contigs, codes, starts, ends, names = Bed.read_arrays(
+            io.StringIO(""))
+        self.assertEqual(contigs, [])
+        self.assertEqual(len(starts), 0)
+        self.assertEqual(names, None)
+
+    def testParsingError(self):
+        self.assertRaises(ValueError, Bed.read_arrays,
+                          io.StringIO("chr1\t100\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+"""unit testing module for the ColumnarOutput.py module."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import cgat.ColumnarOutput as ColumnarOutput
+
+
+class TestConvertColumn(unittest.TestCase):
+
+    def test_integers(self):
+        array = ColumnarOutput.convert_column(["1", "2", "3"])
+        self.assertEqual(array.dtype, numpy.int64)
+        self.assertEqual(list(array), [1, 2, 3])
+
+    def test_floats_with_missing_values(self):
+        array = ColumnarOutput.convert_column(["1.5", "na", "2"])
+        self.assertEqual(array.dtype, numpy.float64)
+        self.assertTrue(numpy.isnan(array[1]))
+
+    def test_strings(self):
+        array = ColumnarOutput.convert_column(["a", "1", "b"])
+        self.assertEqual(array.dtype.kind, "U")
+
+    def test_float_in_integer_column_fails(self):
+        self.assertRaises(ValueError,
+                          ColumnarOutput.convert_column,
+                          [1.5], numpy.int64)
+
+
+class TestPromoteDtype(unittest.TestCase):
+
+    def test_promotion(self):
+        self.assertEqual(ColumnarOutput.promote_dtype(numpy.int64,
+                                                      numpy.float64),
+                         numpy.float64)
+        self.assertEqual(ColumnarOutput.promote_dtype(numpy.float64,
+                                                      "<U3").kind, "U")
+        self.assertEqual(ColumnarOutput.promote_dtype(numpy.int64,
+                                                      numpy.int64),
+                         numpy.int64)
+
+
+class TestColumnarWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "table.npz")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_npz_batches(self):
+        with ColumnarOutput.ColumnarWriter(
+                self.filename, ("name", "count", "value"),
+                batch_size=3) as writer:
+            for x in range(10):
+                writer.append(("id%i" % x, x, x / 2.0))
+
+        data = numpy.load(self.filename)
+        self.assertEqual(sorted(data.keys()), ["count", "name", "value"])
+        self.assertEqual(data["count"].dtype, numpy.int64)
+        self.assertEqual(list(data["count"]), list(range(10)))
+        self.assertEqual(data["name"][9], "id9")
+        self.assertAlmostEqual(data["value"][3], 1.5)
+
+    def test_append_columns(self):
+        with ColumnarOutput.ColumnarWriter(
+                self.filename, ("a", "b")) as writer:
+            writer.append((1, 2))
+            writer.append_columns(([3, 4], [5, 6]))
+
+        data = numpy.load(self.filename)
+        self.assertEqual(list(data["a"]), [1, 3, 4])
+        self.assertEqual(list(data["b"]), [2, 5, 6])
+
+    def test_type_promotion(self):
+        with ColumnarOutput.ColumnarWriter(
+                self.filename, ("a", "b", "c"), batch_size=2) as writer:
+            writer.append((1, "2", 1))
+            writer.append((2, "3", 2))
+            writer.append((3, "na", 3.5))
+            writer.append((4, "5", "x"))
+
+        data = numpy.load(self.filename)
+        self.assertEqual(data["a"].dtype, numpy.int64)
+        self.assertEqual(data["b"].dtype, numpy.float64)
+        self.assertEqual(list(data["b"][:2]), [2.0, 3.0])
+        self.assertTrue(numpy.isnan(data["b"][2]))
+        self.assertEqual(data["c"].dtype.kind, "U")
+        self.assertEqual(list(data["c"]), ["1", "2", "3.5", "x"])
+
+    def test_declared_string_columns(self):
+        with ColumnarOutput.ColumnarWriter(
+                self.filename, ("id", "count"),
+                dtypes=(str, None)) as writer:
+            writer.append(("001", "1"))
+            writer.append(("1e5", "2"))
+
+        data = numpy.load(self.filename)
+        self.assertEqual(list(data["id"]), ["001", "1e5"])
+        self.assertEqual(data["count"].dtype, numpy.int64)
+
+    def test_declared_type_mismatch_fails(self):
+        writer = ColumnarOutput.ColumnarWriter(
+            self.filename, ("a",), batch_size=1, dtypes=(numpy.int64,))
+        writer.append((1,))
+        self.assertRaises(ValueError, writer.append, ("x",))
+
+    def test_wrong_number_of_values_fails(self):
+        writer = ColumnarOutput.ColumnarWriter(self.filename, ("a", "b"))
+        self.assertRaises(ValueError, writer.append, (1,))
+
+    def test_unknown_format_fails(self):
+        self.assertRaises(ValueError,
+                          ColumnarOutput.ColumnarWriter,
+                          os.path.join(self.tmpdir, "table.xyz"),
+                          ("a",))
+
+
+if __name__ == "__main__":
+    unittest.main()
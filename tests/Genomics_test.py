@@ -0,0 +1,120 @@
+"""unit testing module for the Genomics.py module."""
+
+import random
+import unittest
+
+import cgat.Genomics as Genomics
+
+
+def translate_slow(sequence, is_seleno=False, prefer_lowercase=True,
+                   ignore_n=False):
+    """translate codon by codon with MapCodon2AA."""
+    residues = []
+    for x in range(0, len(sequence), 3):
+        codon = sequence[x:x + 3]
+        if prefer_lowercase:
+            is_lower = any(c in "acgtnx" for c in codon)
+        else:
+            is_lower = all(c in "acgtnx" for c in codon)
+        aa = Genomics.MapCodon2AA(codon.upper(),
+                                  is_seleno=is_seleno,
+                                  ignore_n=ignore_n)
+        if is_lower:
+            residues.append(aa.lower())
+        else:
+            residues.append(aa.upper())
+    return "".join(residues)
+
+
+class EncodeCodonsCheck(unittest.TestCase):
+
+    def testAllCodons(self):
+        for codon, aa in Genomics.GeneticCode.items():
+            index = Genomics.encodeCodons(codon)
+            self.assertEqual(len(index), 1)
+            self.assertEqual(chr(Genomics.CODON_TABLE[index[0]]),
+                             Genomics.MapCodon2AA(codon))
+            self.assertEqual(chr(Genomics.CODON_TABLE_SELENO[index[0]]),
+                             Genomics.MapCodon2AA(codon, is_seleno=True))
+
+    def testInvalidCodons(self):
+        index = Genomics.encodeCodons("ANGTRAAC-acg")
+        self.assertEqual(list(index[:3]),
+                         [Genomics.INVALID_CODON_INDEX] * 3)
+        self.assertNotEqual(index[3], Genomics.INVALID_CODON_INDEX)
+
+    def testCase(self):
+        self.assertEqual(list(Genomics.encodeCodons("acg")),
+                         list(Genomics.encodeCodons("ACG")))
+        self.assertEqual(list(Genomics.encodeCodons("acg",
+                                                    ignore_case=False)),
+                         [Genomics.INVALID_CODON_INDEX])
+
+    def testIncompleteCodon(self):
+        self.assertEqual(len(Genomics.encodeCodons("ACGTA")), 1)
+        self.assertEqual(len(Genomics.encodeCodons("AC")), 0)
+
+
+class TranslateCheck(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(1)
+        self.sequences = ["", "A", "AC", "ACG", "TGA", "tga", "NNN",
+                          "ACN", "GCN", "---", "AC-", "TGAtga"] + [
+            "".join(random.choice("ACGTacgtNnRYx-.")
+                    for y in range(random.randint(0, 60)))
+            for x in range(200)]
+
+    def check(self, **kwargs):
+        for sequence in self.sequences:
+            self.assertEqual(Genomics.translate(sequence, **kwargs),
+                             translate_slow(sequence, **kwargs),
+                             "mismatch for %s with %s" %
+                             (sequence, str(kwargs)))
+
+    def testDefault(self):
+        self.check()
+
+    def testSelenocysteine(self):
+        self.assertEqual(Genomics.translate("ATGTGAAAA", is_seleno=True),
+                         "MUK")
+        self.check(is_seleno=True)
+
+    def testIgnoreN(self):
+        self.assertEqual(Genomics.translate("NNN", ignore_n=True), "?")
+        self.check(ignore_n=True)
+
+    def testPreferUppercase(self):
+        self.check(prefer_lowercase=False)
+
+    def testLengthNotMultipleOfThree(self):
+        self.assertEqual(Genomics.translate("ATGAAAGC"),
+                         translate_slow("ATGAAAGC"))
+        self.assertEqual(Genomics.translate("ATGAAAG"),
+                         translate_slow("ATGAAAG"))
+
+
+class CountCodonsCheck(unittest.TestCase):
+
+    def testCounts(self):
+        random.seed(1)
+        sequence = "".join(random.choice("ACGTacgN")
+                           for x in range(3000))
+        counts = Genomics.CountCodons(sequence)
+        self.assertEqual(sorted(counts.keys()),
+                         sorted(Genomics.GeneticCodeAA.keys()))
+        codons = [sequence[x:x + 3] for x in range(0, len(sequence), 3)]
+        for codon, count in counts.items():
+            self.assertEqual(count, codons.count(codon))
+
+    def testStopCodonsSkipped(self):
+        counts = Genomics.CountCodons("TGATAAATG")
+        self.assertEqual(counts["ATG"], 1)
+        self.assertEqual(sum(counts.values()), 1)
+
+    def testLengthNotMultipleOfThree(self):
+        self.assertRaises(ValueError, Genomics.CountCodons, "ATGA")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""unit testing module for the Histogram.py module."""
+import bisect
+import io
+import pickle
+import unittest
+
+import numpy
+
+import cgat.Histogram as Histogram
+
+
+class ArrayHistogramCheck(unittest.TestCase):
+
+    def setUp(self):
+        numpy.random.seed(1)
+        self.values = numpy.random.normal(0, 2, 10000)
+        self.bins = Histogram.make_bins(-5, 5, bin_size=0.5)
+
+    def testAgainstNumpy(self):
+        h = Histogram.ArrayHistogram(self.bins)
+        h.fill(numpy.array_split(self.values, 7))
+        self.assertEqual(list(h.counts),
+                         list(numpy.histogram(self.values, self.bins)[0]))
+
+    def testClip(self):
+        h = Histogram.ArrayHistogram(self.bins, clip=True)
+        h.add(self.values)
+        self.assertEqual(h.counts.sum(), len(self.values))
+        self.assertEqual(h.counts[0], (self.values < 0.5 - 5).sum())
+
+    def testMissingValues(self):
+        h = Histogram.ArrayHistogram([0, 1, 2])
+        h.add([numpy.nan, 0, 1, 2, 3, -1])
+        self.assertEqual(list(h.counts), [1, 2])
+
+    def testMerge(self):
+        h1 = Histogram.ArrayHistogram(self.bins).add(self.values[:5000])
+        h2 = Histogram.ArrayHistogram(self.bins).add(self.values[5000:])
+        h2 = pickle.loads(pickle.dumps(h2))
+        h = Histogram.ArrayHistogram(self.bins).add(self.values)
+        self.assertEqual(list(h1.merge(h2).counts), list(h.counts))
+        self.assertRaises(ValueError, h1.merge,
+                          Histogram.ArrayHistogram([0, 1]))
+
+    def testCumulateNormalize(self):
+        h = Histogram.ArrayHistogram(self.bins).add(self.values)
+        self.assertEqual(h.cumulate().tolist(),
+                         Histogram.Cumulate(h.tolist()))
+        self.assertEqual(h.cumulate(direction=0).tolist(),
+                         Histogram.Cumulate(h.tolist(), direction=0))
+        self.assertAlmostEqual(h.normalize().counts.sum(), 1.0)
+
+    def testCombine(self):
+        h1 = Histogram.ArrayHistogram(self.bins).add(self.values)
+        h2 = Histogram.ArrayHistogram(self.bins).add(self.values + 1)
+        self.assertEqual(Histogram.combine_arrays([h1, h2]),
+                         Histogram.Combine([h1.tolist(), h2.tolist()]))
+
+    def testLogBins(self):
+        bins = Histogram.make_bins(1, 1000, num_bins=3, log=True)
+        self.assertTrue(numpy.allclose(bins, [1, 10, 100, 1000]))
+        self.assertRaises(ValueError, Histogram.make_bins, 0, 10,
+                          num_bins=3, log=True)
+
+
+class FillHistogramsCheck(unittest.TestCase):
+
+    def testFillHistograms(self):
+        numpy.random.seed(1)
+        data = numpy.random.normal(0, 2, (1000, 2))
+        lines = ["#comment"] + ["\t".join(map(str, x)) for x in data]
+        lines.append("1.0")
+        lines.append("na\t1.0")
+        bins = numpy.arange(-3, 3, 0.5)
+
+        expected = [numpy.zeros(len(bins)), numpy.zeros(len(bins))]
+        for line in lines:
+            if line.startswith("#"):
+                continue
+            for x, v in enumerate(line.split()):
+                if v == "na":
+                    continue
+                i = bisect.bisect(bins, float(v)) - 1
+                if i >= 0:
+                    expected[x][i] += 1
+
+        hh = Histogram.fillHistograms(io.StringIO("\n".join(lines) + "\n"),
+                                      [0, 1], [bins, bins])
+        for h, e in zip(hh, expected):
+            self.assertEqual(h.dtype, numpy.float64)
+            self.assertEqual(list(h), list(e))
+
+    def testIterateColumnsInlineHash(self):
+        infile = io.StringIO("# header\n1\t2#3\n4\t5\n")
+        chunks = list(Histogram.iterate_columns(infile, [0, 1],
+                                                chunk_size=1))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(list(chunks[0][0]), [1.0])
+        self.assertTrue(numpy.isnan(chunks[0][1][0]))
+        self.assertEqual(list(chunks[1][1]), [5.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+"""unit testing module for the IndexedFasta.py module."""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import pysam
+
+import cgat.IndexedFasta as IndexedFasta
+
+
+class SequenceCacheCheck(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(1)
+        self.tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(self.tmpdir, "genome.fa")
+        with open(filename, "w") as outf:
+            for contig in ("chr1", "chr2"):
+                outf.write(">%s\n%s\n" % (contig, "".join(
+                    random.choice("ACGTNacgt") for x in range(1000))))
+        pysam.faidx(filename)
+        self.fasta = IndexedFasta.IndexedFasta(filename)
+        self.cache = IndexedFasta.SequenceCache(
+            IndexedFasta.IndexedFasta(filename))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testSequence(self):
+        self.cache.setRegion("chr1", 100, 500)
+        for strand in ("+", "-"):
+            for x in range(100):
+                start = random.randint(0, 900)
+                end = random.randint(start + 1, 1000)
+                self.assertEqual(
+                    self.cache.getSequence("chr1", strand, start, end),
+                    self.fasta.getSequence("chr1", strand, start, end))
+        self.assertTrue(self.cache.nhits > 0)
+        self.assertTrue(self.cache.nmisses > 0)
+
+    def testEviction(self):
+        self.cache.setRegion("chr1", 100, 500)
+        self.cache.getSequence("chr1", "+", 100, 200)
+        self.cache.setRegion("chr2", 100, 500)
+        self.assertEqual(self.cache.getSequence("chr2", "+", 100, 200),
+                         self.fasta.getSequence("chr2", "+", 100, 200))
+        self.assertEqual(self.cache.nhits, 2)
+
+    def testDelegation(self):
+        self.assertEqual(self.cache.getContigSizes(),
+                         self.fasta.getContigSizes())
+        self.assertTrue("chr1" in self.cache)
+
+
+if __name__ == "__main__":
+    unittest.main()
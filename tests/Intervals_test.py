@@ -1,6 +1,7 @@
 """unit testing module for the Tree.py class."""
 
 import cgat.Intervals as Intervals
+import random
 import unittest
 
 
@@ -109,5 +110,29 @@ class FromArrayCheck(unittest.TestCase):
             Intervals.fromArray([not x for x in a]), [(3, 6), (9, 12)])
 
 
+class CalculateOverlapCheck(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(1)
+
+    def getIntervals(self):
+        intervals = []
+        for x in range(random.randint(0, 8)):
+            start = random.randint(0, 200)
+            intervals.append((start, start + random.randint(1, 30)))
+        return Intervals.combine(intervals)
+
+    def testAgainstJoinedIterator(self):
+        for x in range(200):
+            intervals1 = self.getIntervals()
+            intervals2 = self.getIntervals()
+            expected = sum(
+                end - start for start, end in
+                Intervals.joined_iterator(intervals1, intervals2))
+            self.assertEqual(
+                Intervals.calculateOverlap(intervals1, intervals2),
+                expected)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,64 @@
+"""unit testing module for the Motifs.py module."""
+import random
+import re
+import unittest
+
+import cgat.Motifs as Motifs
+
+
+def count_slow(sequence, pattern):
+    regex = "".join("[%s]" % Motifs.iupacdict[x] for x in pattern)
+    return len(re.findall("(?=%s)" % regex, sequence.upper()))
+
+
+class MotifScannerTest(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(1)
+        self.motifs = [("m%i" % x, "".join(
+            random.choice("ACGTNRYWSMKBDHV")
+            for y in range(random.randint(1, 16))))
+            for x in range(100)]
+        self.sequences = [""] + ["".join(
+            random.choice("ACGTacgtN")
+            for y in range(random.randint(0, 200)))
+            for x in range(50)]
+
+    def testForwardStrand(self):
+        scanner = Motifs.MotifScanner(self.motifs, both_strands=False)
+        counts = scanner.count(self.sequences)
+        self.assertEqual(counts.shape,
+                         (len(self.sequences), len(self.motifs)))
+        for sequence, row in zip(self.sequences, counts):
+            self.assertEqual(
+                list(row),
+                [count_slow(sequence, x[1]) for x in self.motifs])
+
+    def testBothStrands(self):
+        scanner = Motifs.MotifScanner(self.motifs)
+        counts = scanner.count(self.sequences)
+        for sequence, row in zip(self.sequences, counts):
+            expected = []
+            for name, pattern in self.motifs:
+                reverse = Motifs.reverse_complement_iupac(pattern)
+                n = count_slow(sequence, pattern)
+                if reverse != pattern:
+                    n += count_slow(sequence, reverse)
+                expected.append(n)
+            self.assertEqual(list(row), expected)
+
+    def testPalindromeCountedOnce(self):
+        scanner = Motifs.MotifScanner([("ebox", "CACGTG")])
+        self.assertEqual(scanner.count(["ACACGTGA"])[0][0], 1)
+
+    def testNoMatchAcrossSequences(self):
+        scanner = Motifs.MotifScanner([("m", "AACC")])
+        self.assertEqual(list(scanner.count(["GGAA", "CCGG"])[:, 0]),
+                         [0, 0])
+
+    def testInvalidMotif(self):
+        self.assertRaises(ValueError, Motifs.MotifScanner, [("m", "AXZ")])
+
+
+if __name__ == "__main__":
+    unittest.main()
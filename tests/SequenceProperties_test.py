@@ -0,0 +1,41 @@
+"""unit testing module for the SequenceProperties.py module."""
+import unittest
+
+import cgat.SequenceProperties as SequenceProperties
+
+
+class SequencePropertiesNATest(unittest.TestCase):
+
+    def testCounts(self):
+        c = SequenceProperties.SequencePropertiesNA()
+        c.loadSequence("AACCGGTTNNRx")
+        self.assertEqual(c.mCountsNA,
+                         {"A": 2, "C": 2, "G": 2, "T": 2, "N": 2})
+        self.assertEqual(c.mCountsGC, 4)
+        self.assertEqual(c.mCountsAT, 4)
+        self.assertEqual(c.mCountsOthers, 2)
+
+
+class SequencePropertiesCpgTest(unittest.TestCase):
+
+    def testCpG(self):
+        c = SequenceProperties.SequencePropertiesCpg()
+        c.loadSequence("ACGCGT")
+        self.assertEqual(c.mCountsDinuc["CG"], 2)
+        self.assertEqual(c.mCountsDinuc["GC"], 1)
+        self.assertEqual(c.getFields(), ["2", "0.6667", "3.0000"])
+
+    def testCaseSensitiveDinucleotides(self):
+        c = SequenceProperties.SequencePropertiesCpg()
+        c.loadSequence("acgCG")
+        self.assertEqual(c.mCountsDinuc["CG"], 1)
+        self.assertEqual(c.mCountsNA["C"], 2)
+
+    def testEmptySequence(self):
+        c = SequenceProperties.SequencePropertiesCpg()
+        c.loadSequence("")
+        self.assertEqual(c.getFields(), ["0", "0.0000", "0.0000"])
+
+
+if __name__ == "__main__":
+    unittest.main()
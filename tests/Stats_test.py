@@ -196,6 +196,103 @@ class TestFDRPythonAgainstRDataset1(unittest.TestCase):
         self.checkFDR(vlambda=(0.5,))
 
 
+class TestFDRPython(unittest.TestCase):
+
+    '''test vectorized q-value computation against a direct
+    implementation.'''
+
+    def setUp(self):
+        numpy.random.seed(1)
+        self.pvalues = numpy.round(numpy.concatenate(
+            [numpy.random.uniform(0, 1, 800),
+             numpy.random.beta(0.2, 5, 200)]), 3)
+
+    def getQValues(self, pvalues, pi0):
+        m = len(pvalues)
+        qvalues = [min(1.0, min(
+            pi0 * m * y / numpy.sum(pvalues <= y)
+            for y in pvalues if y >= x)) for x in pvalues]
+        return numpy.array(qvalues)
+
+    def testQValues(self):
+        result = Stats.doFDRPython(self.pvalues, fdr_level=0.05)
+        pi0 = min(1.0, float(numpy.mean(self.pvalues >= 0.5)) / 0.5)
+        self.assertAlmostEqual(
+            Stats.doFDRPython(self.pvalues, vlambda=0.5).mPi0, pi0)
+        self.assertTrue(numpy.allclose(
+            result.mQValues, self.getQValues(self.pvalues, result.mPi0)))
+        self.assertEqual(list(result.mPassed),
+                         list(result.mQValues <= 0.05))
+
+    def testChunked(self):
+        result = Stats.doFDRPython(self.pvalues)
+        chunked = Stats.doFDRPython(self.pvalues, chunk_size=7)
+        self.assertEqual(result.mPi0, chunked.mPi0)
+        self.assertEqual(list(result.mQValues), list(chunked.mQValues))
+
+    def testFloat32(self):
+        result = Stats.doFDRPython(self.pvalues, pi0=0.8,
+                                   dtype=numpy.float32, chunk_size=100)
+        self.assertEqual(result.mQValues.dtype, numpy.float32)
+        self.assertTrue(numpy.allclose(
+            result.mQValues,
+            Stats.doFDRPython(self.pvalues, pi0=0.8).mQValues,
+            atol=1e-6))
+
+    def testBootstrap(self):
+        vlambda = numpy.arange(0, 0.95, 0.05)
+        result = Stats.doFDRPython(self.pvalues, pi0_method="bootstrap")
+        self.assertTrue(numpy.any(numpy.isclose(
+            result.mPi0, Stats.estimatePi0(numpy.sort(self.pvalues),
+                                           vlambda))))
+
+    def testOutOfRange(self):
+        self.assertRaises(ValueError, Stats.doFDRPython, [0.1, 1.5])
+
+
+class TestAdjustPValuesVectorized(unittest.TestCase):
+
+    '''test p-value adjustment against direct implementations.'''
+
+    def setUp(self):
+        numpy.random.seed(1)
+        self.pvalues = numpy.round(numpy.random.beta(0.5, 2, 200), 2)
+        n = len(self.pvalues)
+        self.ranks = numpy.array([numpy.sum(self.pvalues <= x)
+                                  for x in self.pvalues])
+        self.bh = numpy.array([
+            min(n * self.pvalues[j] / self.ranks[j]
+                for j in range(n) if self.pvalues[j] >= x)
+            for x in self.pvalues])
+
+    def testBH(self):
+        self.assertTrue(numpy.allclose(
+            Stats.adjustPValues(self.pvalues, method="BH"),
+            numpy.minimum(self.bh, 1.0)))
+
+    def testBY(self):
+        q = numpy.sum(1.0 / numpy.arange(1, len(self.pvalues) + 1))
+        self.assertTrue(numpy.allclose(
+            Stats.adjustPValues(self.pvalues, method="BY"),
+            numpy.minimum(q * self.bh, 1.0)))
+
+    def testHolm(self):
+        n = len(self.pvalues)
+        holm = numpy.array([
+            max((n - numpy.sum(self.pvalues < y)) * y
+                for y in self.pvalues if y <= x)
+            for x in self.pvalues])
+        self.assertTrue(numpy.allclose(
+            Stats.adjustPValues(self.pvalues, method="holm"),
+            numpy.minimum(holm, 1.0)))
+
+    def testFloat32(self):
+        adjusted = Stats.adjustPValues(self.pvalues, dtype=numpy.float32)
+        self.assertEqual(adjusted.dtype, numpy.float32)
+        self.assertTrue(numpy.allclose(
+            adjusted, Stats.adjustPValues(self.pvalues)))
+
+
 class TestPValueAdust(unittest.TestCase):
 
     def setUp(self):